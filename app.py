@@ -1,32 +1,29 @@
-from flask import Flask, request, redirect, url_for, render_template_string, jsonify
+from flask import Flask, request, redirect, url_for, render_template, jsonify, Response, stream_with_context
 import os
 import json
-import re
+import time
+
+from collate import (
+    PROFILES_FILE, DEFAULT_OUTPUT_FORMAT, OUTPUT_FORMATS, TOKENIZERS,
+    get_profile_store, get_profile_paths, get_profile_exclusions, invalidate_exclusion_matcher,
+    iter_profile_chunks, iter_aggregated_chunks, choose_processes, get_output_format,
+    build_manifest, search_profile, get_search_index, available_compressions, make_compressor, iter_compressed,
+    iter_written_output, check_search_query,
+    get_profile_watcher, ensure_profile_watcher, notify_profile_changed,
+    PipelineMetrics, METRIC_PHASES, METRIC_COUNTS, METRIC_BYTES
+)
+from jobs import JobManager
 
 # -----------------------
 # FLASK SETUP
 # -----------------------
 app = Flask(__name__)
 
-# This is where we store user-defined profiles (e.g., "default", "project_x").
-# Each profile has a list of file paths to be aggregated.
-PROFILES_FILE = "profiles.json"
-
-# Global exclusion list for directories/patterns to skip
-EXCLUDED_DIRS = []
-
-# Basic extension-to-language mapping
-EXTENSION_MAP = {
-    ".py": "Python",
-    ".js": "JavaScript",
-    ".java": "Java",
-    ".cpp": "C++",
-    ".c": "C",
-    ".html": "HTML",
-    ".css": "CSS",
-    ".cs": "C#"
-    # ...add more as needed
-}
+# How long /generate waits for a freshly started watcher to build its first snapshot
+WATCH_SNAPSHOT_TIMEOUT = 60
+
+# How often /jobs/<id>/events pushes a progress update while a job runs
+JOB_EVENT_INTERVAL = 0.5
 
 # If profiles.json doesn't exist, create a default structure
 if not os.path.exists(PROFILES_FILE):
@@ -57,157 +54,17 @@ if not os.path.exists(PROFILES_FILE):
     with open(PROFILES_FILE, "w", encoding="utf-8") as f:
         json.dump({"default": default_profile}, f, indent=2)
 
-def load_profiles():
-    """Load profiles from the JSON file."""
-    with open(PROFILES_FILE, "r", encoding="utf-8") as f:
-        profiles = json.load(f)
-        
-        # Convert old format to new format if needed
-        for profile_name, profile_data in profiles.items():
-            if isinstance(profile_data, list):
-                # Convert old format (list of paths) to new format (dict with paths and exclusions)
-                profiles[profile_name] = {
-                    "paths": profile_data,
-                    "exclusions": []
-                }
-        
-        return profiles
-
-def save_profiles(profiles):
-    """Save profiles to the JSON file."""
-    with open(PROFILES_FILE, "w", encoding="utf-8") as f:
-        json.dump(profiles, f, indent=2)
-        
-def get_profile_paths(profile_name):
-    """Get the paths for a specific profile."""
-    profiles = load_profiles()
-    if profile_name not in profiles:
-        return []
-    
-    profile_data = profiles[profile_name]
-    if isinstance(profile_data, dict):
-        return profile_data.get("paths", [])
-    return profile_data  # Fallback for old format
-
-def get_profile_exclusions(profile_name):
-    """Get the exclusions for a specific profile."""
-    profiles = load_profiles()
-    if profile_name not in profiles:
-        return []
-    
-    profile_data = profiles[profile_name]
-    if isinstance(profile_data, dict):
-        return profile_data.get("exclusions", [])
-    return []  # If old format, no exclusions
-
 # -----------------------
-# HELPER: AGGREGATE FILES
+# INDEX PAGE
 # -----------------------
-def aggregate_files(profile_name):
-    """Read each file or directory for a profile, respecting exclusions, and return a combined JSON-like string."""
-    aggregated_data = []
-    file_paths = get_profile_paths(profile_name)
-    exclusions = get_profile_exclusions(profile_name)
-    
-    # Compile exclusion patterns for faster matching
-    compiled_exclusions = [re.compile(pattern) for pattern in exclusions]
-    
-    for path in file_paths:
-        # Check if path is a directory
-        if os.path.isdir(path):
-            # Process directory recursively
-            for root, dirs, files in os.walk(path):
-                # Skip directories that match exclusion patterns
-                if should_exclude(root, compiled_exclusions):
-                    continue
-                
-                # Filter directories list in-place to skip excluded dirs in future iterations
-                dirs[:] = [d for d in dirs if not should_exclude(os.path.join(root, d), compiled_exclusions)]
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # Skip hidden files and excluded paths
-                    if os.path.basename(file_path).startswith('.') or should_exclude(file_path, compiled_exclusions):
-                        continue
-                    process_file(file_path, aggregated_data)
-        else:
-            # Process single file if it's not excluded
-            if not should_exclude(path, compiled_exclusions):
-                process_file(path, aggregated_data)
-
-    # Create a string that starts with "Current code below:" then the JSON
-    combined = "Current code below:\n" + json.dumps(aggregated_data, indent=2)
-    return combined
-
-def should_exclude(path, compiled_exclusions):
-    """Check if a path matches any exclusion pattern."""
-    for pattern in compiled_exclusions:
-        if pattern.search(path):
-            return True
-    return False
-
-def process_file(path, aggregated_data):
-    """Process a single file and add it to the aggregated data."""
-    _, ext = os.path.splitext(path)
-    language = EXTENSION_MAP.get(ext.lower(), "Unknown")
-    
-    # Skip binary files and other non-text formats
-    binary_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.pdf', '.zip', 
-                         '.tar', '.gz', '.exe', '.dll', '.so', '.pyc', '.class'}
-    if ext.lower() in binary_extensions:
-        aggregated_data.append({
-            "filename": os.path.basename(path),
-            "language": "Binary",
-            "content": f"[Binary file: {os.path.basename(path)}]",
-            "full_path": path
-        })
-        return
-
-    try:
-        # Try to read as text
-        with open(path, "r", encoding="utf-8") as file:
-            content = file.read()
-        aggregated_data.append({
-            "filename": os.path.basename(path),
-            "language": language,
-            "content": content,
-            "full_path": path
-        })
-    except UnicodeDecodeError:
-        # Handle case where the file is binary but doesn't have a recognized extension
-        aggregated_data.append({
-            "filename": os.path.basename(path),
-            "language": "Binary",
-            "content": f"[Binary file: {os.path.basename(path)}]",
-            "full_path": path
-        })
-    except Exception as e:
-        # Handle other errors
-        aggregated_data.append({
-            "filename": os.path.basename(path),
-            "language": "Error",
-            "content": f"Could not read file: {e}",
-            "full_path": path
-        })
+# How many paths/exclusions the page is rendered with; the rest are loaded on demand from /get_paths and /get_exclusions
+INDEX_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
-# -----------------------
-# ROUTES
-# -----------------------
-@app.route("/", methods=["GET", "POST"])
-def index():
-    profiles = load_profiles()
-    # If there's no explicit selected profile in the query, pick "default" if it exists
-    selected_profile = request.args.get("profile", "default" if "default" in profiles else None)
-    
-    # Pass the os module to the template for path operations
-    template_context = {
-        "profiles": profiles,
-        "selected_profile": selected_profile,
-        "os": os
-    }
+# How long os.path.isdir results for profile paths are reused (they may live on slow mounts)
+PATH_INFO_TTL = 30
 
-    # Construct a minimal HTML using render_template_string
-    template = """
+INDEX_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -404,6 +261,15 @@ def index():
                 border-color: var(--primary);
                 box-shadow: 0 0 0 2px rgba(76, 175, 80, 0.2);
             }
+
+            select {
+                padding: 9px 10px;
+                border: 1px solid var(--gray);
+                border-radius: var(--radius);
+                font-size: 0.9rem;
+                background-color: var(--white);
+                outline: none;
+            }
             
             button {
                 background-color: var(--primary);
@@ -665,6 +531,28 @@ def index():
                 color: #1976D2;
                 margin-left: 10px;
             }
+
+            .output-stats {
+                margin-bottom: 15px;
+                color: #666;
+            }
+
+            .output-stats table {
+                width: 100%;
+                margin-top: 10px;
+                border-collapse: collapse;
+                font-size: 0.85rem;
+            }
+
+            .output-stats td {
+                padding: 4px 8px;
+                border-bottom: 1px solid var(--gray);
+            }
+
+            .output-stats td:last-child {
+                text-align: right;
+                white-space: nowrap;
+            }
         </style>
     </head>
     <body>
@@ -710,6 +598,12 @@ def index():
                             <label for="profile_name">Profile Name</label>
                             <input type="text" id="profile_name" name="profile_name" placeholder="e.g., Project X" required>
                         </div>
+                        <div class="form-control">
+                            <label>
+                                <input type="checkbox" name="gitignore" value="1">
+                                Skip files ignored by .gitignore instead of the default exclusion list
+                            </label>
+                        </div>
                         <button type="submit"><i class="fas fa-save"></i> Create Profile</button>
                     </form>
                 </div>
@@ -751,49 +645,39 @@ def index():
                                 <div class="panel">
                                     <h3><i class="fas fa-list"></i> Files in this Profile</h3>
                                     
-                                    {% set profile_paths = profiles[selected_profile].get('paths', profiles[selected_profile] if profiles[selected_profile] is not mapping else []) %}
-                                    {% if profile_paths|length > 0 %}
+                                    {% if paths_total > 0 %}
                                         <div class="file-list">
-                                            {% for path in profile_paths %}
+                                            {% for item in path_page %}
                                                 <div class="file-item">
                                                     <div class="file-icon">
-                                                        {% if os.path.isdir(path) %}
-                                                            <i class="fas fa-folder" style="color: #FFC107;"></i>
-                                                        {% else %}
-                                                            {% set ext = path.split('.')[-1] %}
-                                                            {% if ext == 'py' %}
-                                                                <i class="fab fa-python" style="color: #3776AB;"></i>
-                                                            {% elif ext == 'js' %}
-                                                                <i class="fab fa-js" style="color: #F7DF1E;"></i>
-                                                            {% elif ext == 'html' %}
-                                                                <i class="fab fa-html5" style="color: #E34F26;"></i>
-                                                            {% elif ext == 'css' %}
-                                                                <i class="fab fa-css3-alt" style="color: #1572B6;"></i>
-                                                            {% elif ext == 'java' %}
-                                                                <i class="fab fa-java" style="color: #007396;"></i>
-                                                            {% elif ext == 'cs' %}
-                                                                <i class="fas fa-code" style="color: #68217A;"></i>
-                                                            {% else %}
-                                                                <i class="fas fa-file-code"></i>
-                                                            {% endif %}
-                                                        {% endif %}
+                                                        <i class="{{ item.icon }}"{% if item.color %} style="color: {{ item.color }};"{% endif %}></i>
                                                     </div>
-                                                    <div class="file-path" title="{{ path }}">
-                                                        {{ path }}
-                                                        {% if os.path.isdir(path) %}
+                                                    <div class="file-path" title="{{ item.path }}">
+                                                        {{ item.path }}
+                                                        {% if item.is_dir %}
                                                             <span class="language-label" style="background-color: #FFF3CD; color: #856404;">Folder</span>
                                                         {% endif %}
                                                     </div>
                                                     <div class="file-actions">
-                                                        <button type="button" class="remove-file" data-path="{{ path }}" data-profile="{{ selected_profile }}" title="Remove file">
+                                                        <button type="button" class="remove-file" data-path="{{ item.path }}" data-profile="{{ selected_profile }}" title="Remove file">
                                                             <i class="fas fa-times"></i>
                                                         </button>
                                                     </div>
                                                 </div>
                                             {% endfor %}
                                         </div>
+                                        {% if paths_total > path_page|length %}
+                                            <button type="button" class="load-more secondary" data-kind="paths" data-offset="{{ path_page|length }}">
+                                                <i class="fas fa-angle-down"></i> Show more ({{ paths_total - path_page|length }} remaining)
+                                            </button>
+                                        {% endif %}
                                         
                                         <div class="actions-bar">
+                                            <select id="outputFormat" title="Output format">
+                                                {% for name in output_formats %}
+                                                <option value="{{ name }}" {{ 'selected' if name == profiles[selected_profile].get('format', default_output_format) else '' }}>{{ name }}</option>
+                                                {% endfor %}
+                                            </select>
                                             <button id="generateBtn" class="secondary">
                                                 <i class="fas fa-sync-alt"></i> Generate & Copy to Clipboard
                                             </button>
@@ -831,8 +715,8 @@ def index():
                                     </form>
                                     
                                     <div class="file-list" id="exclusions-list">
-                                        {% if profiles[selected_profile].get('exclusions', [])|length > 0 %}
-                                            {% for pattern in profiles[selected_profile].get('exclusions', []) %}
+                                        {% if exclusions_total > 0 %}
+                                            {% for pattern in exclusion_page %}
                                                 <div class="file-item exclusion-item">
                                                     <div class="file-icon">
                                                         <i class="fas fa-ban" style="color: #dc3545;"></i>
@@ -847,6 +731,11 @@ def index():
                                                     </div>
                                                 </div>
                                             {% endfor %}
+                                            {% if exclusions_total > exclusion_page|length %}
+                                                <button type="button" class="load-more secondary" data-kind="exclusions" data-offset="{{ exclusion_page|length }}">
+                                                    <i class="fas fa-angle-down"></i> Show more ({{ exclusions_total - exclusion_page|length }} remaining)
+                                                </button>
+                                            {% endif %}
                                         {% else %}
                                             <div class="empty-state" id="no-exclusions-message">
                                                 <i class="fas fa-filter"></i>
@@ -876,12 +765,10 @@ def index():
                                         </div>
                                     </div>
                                     
-                                    {% set exclusions = profiles[selected_profile].get('exclusions', []) %}
-                                    
                                     <div id="exclusions-container">
-                                        {% if exclusions|length > 0 %}
+                                        {% if exclusions_total > 0 %}
                                             <div class="file-list">
-                                                {% for pattern in exclusions %}
+                                                {% for pattern in exclusion_page %}
                                                     <div class="file-item">
                                                         <div class="file-icon">
                                                             <i class="fas fa-ban" style="color: #dc3545;"></i>
@@ -895,6 +782,11 @@ def index():
                                                     </div>
                                                 {% endfor %}
                                             </div>
+                                            {% if exclusions_total > exclusion_page|length %}
+                                                <button type="button" class="load-more secondary" data-kind="exclusions" data-offset="{{ exclusion_page|length }}">
+                                                    <i class="fas fa-angle-down"></i> Show more ({{ exclusions_total - exclusion_page|length }} remaining)
+                                                </button>
+                                            {% endif %}
                                         {% else %}
                                             <div class="empty-state">
                                                 <i class="fas fa-filter"></i>
@@ -909,6 +801,7 @@ def index():
                             <div class="tab-pane" id="output-tab">
                                 <div class="panel">
                                     <h3><i class="fas fa-clipboard"></i> Generated Output</h3>
+                                    <div id="outputStats" class="output-stats"></div>
                                     <textarea id="outputArea" placeholder="Generated content will appear here...
 Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></textarea>
                                 </div>
@@ -969,22 +862,52 @@ Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></tex
                         fetch("{{ url_for('generate') }}", {
                             method: "POST",
                             headers: {"Content-Type": "application/json"},
-                            body: JSON.stringify({ profile: "{{ selected_profile }}" })
+                            body: JSON.stringify({
+                                profile: "{{ selected_profile }}",
+                                format: document.getElementById("outputFormat").value,
+                                stream: true
+                            })
                         })
-                        .then(response => response.json())
-                        .then(data => {
+                        .then(response => {
+                            if (!response.ok) {
+                                throw new Error(response.statusText);
+                            }
+
+                            // Switch to output tab and show the output as it streams in
+                            outputArea.value = "";
+                            document.querySelector('.tab[data-tab="output"]').click();
+
+                            const reader = response.body.getReader();
+                            const decoder = new TextDecoder();
+                            const chunks = [];
+                            let lastRender = 0;
+
+                            function pump() {
+                                return reader.read().then(({ done, value }) => {
+                                    if (done) {
+                                        chunks.push(decoder.decode());
+                                        outputArea.value = chunks.join("");
+                                        return outputArea.value;
+                                    }
+                                    chunks.push(decoder.decode(value, { stream: true }));
+                                    // Re-render at most a few times per second to keep the page responsive
+                                    if (Date.now() - lastRender > 250) {
+                                        outputArea.value = chunks.join("");
+                                        lastRender = Date.now();
+                                    }
+                                    return pump();
+                                });
+                            }
+                            return pump();
+                        })
+                        .then(aggregated => {
                             // Hide loader
                             generateLoader.style.display = "none";
                             generateBtn.disabled = false;
-                            
-                            // Update textarea
-                            outputArea.value = data.aggregated;
-                            
-                            // Switch to output tab
-                            document.querySelector('.tab[data-tab="output"]').click();
+                            showOutputStats();
                             
                             // Copy to clipboard
-                            navigator.clipboard.writeText(data.aggregated)
+                            navigator.clipboard.writeText(aggregated)
                                 .then(() => {
                                     showNotification("Success! Content copied to clipboard.", "success");
                                 })
@@ -1002,8 +925,9 @@ Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></tex
                 }
                 
                 // Remove file functionality
-                const removeButtons = document.querySelectorAll('.remove-file');
-                removeButtons.forEach(button => {
+                document.querySelectorAll('.remove-file').forEach(attachRemoveFileListener);
+
+                function attachRemoveFileListener(button) {
                     button.addEventListener('click', () => {
                         const filePath = button.getAttribute('data-path');
                         const profile = button.getAttribute('data-profile');
@@ -1044,7 +968,7 @@ Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></tex
                             });
                         }
                     });
-                });
+                }
                 
                 // Exclusions tab functionality
                 const addExclusionForm = document.getElementById('add-exclusion-form');
@@ -1294,6 +1218,142 @@ Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></tex
                     attachRemoveExclusionListener(button);
                 });
                 
+                // Show more: long lists are rendered one page at a time, the rest is fetched on demand
+                document.querySelectorAll('.load-more').forEach(button => {
+                    button.addEventListener('click', () => {
+                        const kind = button.getAttribute('data-kind');
+                        const url = kind === "paths" ? "{{ url_for('get_paths') }}" : "{{ url_for('get_exclusions') }}";
+                        const query = "?profile=" + encodeURIComponent("{{ selected_profile }}") +
+                            "&offset=" + button.getAttribute('data-offset') + "&limit={{ page_size }}";
+                        button.disabled = true;
+                        fetch(url + query)
+                        .then(response => response.json())
+                        .then(data => {
+                            if (!data.success) {
+                                showNotification(data.message || "Failed to load more items.", "error");
+                                button.disabled = false;
+                                return;
+                            }
+                            // Items go into the list just before the button, or alongside the items before it
+                            const list = button.previousElementSibling;
+                            const inList = list && list.classList.contains('file-list');
+                            data[kind].forEach(item => {
+                                const element = kind === "paths" ? renderPathItem(item) : renderExclusionItem(item, inList);
+                                if (inList) {
+                                    list.appendChild(element);
+                                } else {
+                                    button.before(element);
+                                }
+                            });
+                            if (data.next_offset === null) {
+                                button.remove();
+                            } else {
+                                button.setAttribute('data-offset', data.next_offset);
+                                button.innerHTML = `<i class="fas fa-angle-down"></i> Show more (${data.total - data.next_offset} remaining)`;
+                                button.disabled = false;
+                            }
+                        })
+                        .catch(err => {
+                            button.disabled = false;
+                            showNotification("Error: " + err, "error");
+                        });
+                    });
+                });
+
+                function renderPathItem(item) {
+                    const element = document.createElement('div');
+                    element.className = 'file-item';
+                    element.innerHTML = `
+                        <div class="file-icon"><i></i></div>
+                        <div class="file-path"></div>
+                        <div class="file-actions">
+                            <button type="button" class="remove-file" title="Remove file">
+                                <i class="fas fa-times"></i>
+                            </button>
+                        </div>
+                    `;
+                    const icon = element.querySelector('.file-icon i');
+                    icon.className = item.icon;
+                    if (item.color) {
+                        icon.style.color = item.color;
+                    }
+                    const label = element.querySelector('.file-path');
+                    label.title = item.path;
+                    label.textContent = item.path;
+                    if (item.is_dir) {
+                        label.insertAdjacentHTML('beforeend', ' <span class="language-label" style="background-color: #FFF3CD; color: #856404;">Folder</span>');
+                    }
+                    const removeBtn = element.querySelector('.remove-file');
+                    removeBtn.setAttribute('data-path', item.path);
+                    removeBtn.setAttribute('data-profile', "{{ selected_profile }}");
+                    attachRemoveFileListener(removeBtn);
+                    return element;
+                }
+
+                // The exclusions tab has two lists: items inside a .file-list use the second one's markup
+                function renderExclusionItem(pattern, inList) {
+                    const element = document.createElement('div');
+                    element.className = inList ? 'file-item' : 'file-item exclusion-item';
+                    element.innerHTML = `
+                        <div class="file-icon">
+                            <i class="fas fa-ban" style="color: #dc3545;"></i>
+                        </div>
+                        <div class="file-path"></div>
+                        <div class="file-actions">
+                            <button type="button" class="remove-exclusion" title="Remove exclusion">
+                                <i class="fas fa-times"></i>
+                            </button>
+                        </div>
+                    `;
+                    const label = element.querySelector('.file-path');
+                    label.title = pattern;
+                    label.textContent = pattern;
+                    const removeBtn = element.querySelector('.remove-exclusion');
+                    removeBtn.setAttribute('data-pattern', pattern);
+                    removeBtn.setAttribute('data-profile', "{{ selected_profile }}");
+                    if (inList) {
+                        attachRemoveExclusionListener(removeBtn);
+                    } else {
+                        addRemoveExclusionListener(removeBtn);
+                    }
+                    return element;
+                }
+
+                // Token stats of the last generate run
+                function showOutputStats() {
+                    const outputStats = document.getElementById("outputStats");
+                    fetch("{{ url_for('generate_stats') }}?profile=" + encodeURIComponent("{{ selected_profile }}"))
+                    .then(response => response.json())
+                    .then(data => {
+                        if (!data.success) {
+                            outputStats.textContent = "";
+                            return;
+                        }
+                        const files = Object.entries(data.tokens.files).sort((a, b) => b[1] - a[1]);
+                        outputStats.innerHTML = `
+                            <i class="fas fa-calculator"></i>
+                            ~${data.tokens.total.toLocaleString()} tokens across ${files.length.toLocaleString()} files
+                            (${data.tokens.tokenizer} estimate),
+                            ${data.output.bytes[data.output.format].toLocaleString()} bytes as ${data.output.format}
+                            ${data.dedup ? `(${data.dedup.duplicates.toLocaleString()} duplicates saved
+                                ${data.dedup.bytes_saved.toLocaleString()} bytes, ~${data.dedup.tokens_saved.toLocaleString()} tokens)` : ""}
+                            <details>
+                                <summary>Largest files</summary>
+                                <table><tbody></tbody></table>
+                            </details>
+                        `;
+                        const tbody = outputStats.querySelector("tbody");
+                        files.slice(0, 20).forEach(([path, tokens]) => {
+                            const row = tbody.insertRow();
+                            row.insertCell().textContent = path;
+                            row.insertCell().textContent = tokens.toLocaleString();
+                        });
+                    })
+                    .catch(() => {
+                        outputStats.textContent = "";
+                    });
+                }
+
                 // Notification system
                 function showNotification(message, type = "success") {
                     const notification = document.getElementById("notification");
@@ -1323,8 +1383,145 @@ Click 'Generate & Copy to Clipboard' on the Files tab to generate output."></tex
         </script>
     </body>
     </html>
-    """
-    return render_template_string(template, **template_context)
+"""
+
+# Compiled once, on first use
+_index_template = None
+
+def get_index_template():
+    """Get the compiled index page template."""
+    global _index_template
+    if _index_template is None:
+        _index_template = app.jinja_env.from_string(INDEX_TEMPLATE)
+    return _index_template
+
+# (checked at, isdir) per path
+_path_info_cache = {}
+
+def path_is_dir(path):
+    """os.path.isdir(path), reused for PATH_INFO_TTL seconds."""
+    now = time.monotonic()
+    cached = _path_info_cache.get(path)
+    if cached is not None and now - cached[0] < PATH_INFO_TTL:
+        return cached[1]
+    is_dir = os.path.isdir(path)
+    _path_info_cache[path] = (now, is_dir)
+    return is_dir
+
+# Font Awesome icon and colour for files, by extension
+FILE_ICONS = {
+    "py": ("fab fa-python", "#3776AB"),
+    "js": ("fab fa-js", "#F7DF1E"),
+    "html": ("fab fa-html5", "#E34F26"),
+    "css": ("fab fa-css3-alt", "#1572B6"),
+    "java": ("fab fa-java", "#007396"),
+    "cs": ("fas fa-code", "#68217A")
+}
+
+def path_item(path):
+    """What the page shows for a profile path: the path, whether it is a folder and its icon."""
+    is_dir = path_is_dir(path)
+    if is_dir:
+        icon, color = "fas fa-folder", "#FFC107"
+    else:
+        icon, color = FILE_ICONS.get(path.split('.')[-1], ("fas fa-file-code", None))
+    return {"path": path, "is_dir": is_dir, "icon": icon, "color": color}
+
+def get_page_args():
+    """Parse the offset/limit query arguments of a paginated endpoint; returns (offset, limit) or None if invalid."""
+    try:
+        offset = int(request.args.get("offset", 0))
+        limit = int(request.args.get("limit", INDEX_PAGE_SIZE))
+    except ValueError:
+        return None
+    if offset < 0 or limit < 1:
+        return None
+    return offset, min(limit, MAX_PAGE_SIZE)
+
+def page_response(key, items, total, offset):
+    """JSON for one page of a list, with where the next page starts (None after the last one)."""
+    next_offset = offset + len(items)
+    return jsonify({
+        "success": True,
+        key: items,
+        "total": total,
+        "offset": offset,
+        "next_offset": next_offset if next_offset < total else None
+    })
+
+# -----------------------
+# RESPONSE COMPRESSION
+# -----------------------
+# Responses smaller than this are sent uncompressed
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+
+def accepted_encoding():
+    """Pick the preferred compression (see available_compressions()) the client accepts, or None."""
+    accepted = set()
+    for part in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    for compression in available_compressions():
+        if compression in accepted:
+            return compression
+    return None
+
+def compress_response(response):
+    """Compress a finished (non-streaming) response body if the client accepts it."""
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding()
+    if encoding is None or response.content_length < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+    compressor = make_compressor(encoding)
+    response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+# -----------------------
+# ROUTES
+# -----------------------
+# Stats of the most recent generate run, keyed by profile name
+_last_run_stats = {}
+
+# Number of generate runs since startup, keyed by profile name (for /metrics)
+_run_counts = {}
+
+# Background aggregation jobs started with {"async": true}; finished jobs are recorded like other runs
+job_manager = JobManager(on_finish=lambda profile, stats: record_run(profile, stats))
+
+@app.route("/", methods=["GET", "POST"])
+def index():
+    profiles = get_profile_store().profiles()
+    # If there's no explicit selected profile in the query, pick "default" if it exists
+    selected_profile = request.args.get("profile", "default" if "default" in profiles else None)
+
+    # Only the first page of paths and exclusions is rendered; the page fetches the rest on demand
+    paths = []
+    exclusions = []
+    if selected_profile in profiles:
+        paths = profiles[selected_profile].get("paths", [])
+        exclusions = profiles[selected_profile].get("exclusions", [])
+
+    template_context = {
+        "profiles": profiles,
+        "selected_profile": selected_profile,
+        "output_formats": OUTPUT_FORMATS,
+        "default_output_format": DEFAULT_OUTPUT_FORMAT,
+        "path_page": [path_item(path) for path in paths[:INDEX_PAGE_SIZE]],
+        "paths_total": len(paths),
+        "exclusion_page": exclusions[:INDEX_PAGE_SIZE],
+        "exclusions_total": len(exclusions),
+        "page_size": INDEX_PAGE_SIZE
+    }
+
+    return render_template(get_index_template(), **template_context)
 
 @app.route("/add_profile", methods=["POST"])
 def add_profile():
@@ -1333,27 +1530,30 @@ def add_profile():
     if not profile_name:
         return redirect(url_for("index"))
 
-    profiles = load_profiles()
-    if profile_name not in profiles:
-        # Default exclusions that will skip common non-source directories
-        default_exclusions = [
-            r"/node_modules/", 
-            r"/.git/", 
-            r"/__pycache__/",
-            r"/venv/",
-            r"/.venv/",
-            r"/env/",
-            r"/dist/",
-            r"/build/",
-            r"/.idea/",
-            r"/.vscode/"
-        ]
-        profiles[profile_name] = {
-            "paths": [],
-            "exclusions": default_exclusions
-        }
-        save_profiles(profiles)
-    return redirect(url_for("index", profile=profile_name))
+    with get_profile_store().transaction() as profiles:
+        if profile_name not in profiles:
+            # Default exclusions that will skip common non-source directories
+            default_exclusions = [
+                r"/node_modules/", 
+                r"/.git/", 
+                r"/__pycache__/",
+                r"/venv/",
+                r"/.venv/",
+                r"/env/",
+                r"/dist/",
+                r"/build/",
+                r"/.idea/",
+                r"/.vscode/"
+            ]
+            profiles[profile_name] = {
+                "paths": [],
+                "exclusions": default_exclusions
+            }
+            # .gitignore files cover the build and dependency folders; .git itself is never listed in them
+            if request.form.get("gitignore"):
+                profiles[profile_name]["exclusions"] = [r"/.git/"]
+                profiles[profile_name]["gitignore"] = True
+        return redirect(url_for("index", profile=profile_name))
 
 @app.route("/add_exclusion", methods=["POST"])
 def add_exclusion():
@@ -1365,24 +1565,29 @@ def add_exclusion():
     if not profile or not pattern:
         return jsonify({"success": False, "message": "Missing profile or pattern"}), 400
     
-    profiles = load_profiles()
-    if profile not in profiles:
-        return jsonify({"success": False, "message": "Profile not found"}), 404
-    
-    profile_data = profiles[profile]
+    added = False
+    with get_profile_store().transaction() as profiles:
+        if profile not in profiles:
+            return jsonify({"success": False, "message": "Profile not found"}), 404
     
-    # Convert old format if needed
-    if isinstance(profile_data, list):
-        profile_data = {"paths": profile_data, "exclusions": []}
-        profiles[profile] = profile_data
+        profile_data = profiles[profile]
     
-    # Add the exclusion if it's not already in the profile
-    exclusions = profile_data.get("exclusions", [])
-    if pattern not in exclusions:
-        exclusions.append(pattern)
-        profile_data["exclusions"] = exclusions
-        save_profiles(profiles)
+        # Convert old format if needed
+        if isinstance(profile_data, list):
+            profile_data = {"paths": profile_data, "exclusions": []}
+            profiles[profile] = profile_data
     
+        # Add the exclusion if it's not already in the profile
+        exclusions = profile_data.get("exclusions", [])
+        if pattern not in exclusions:
+            exclusions.append(pattern)
+            profile_data["exclusions"] = exclusions
+            added = True
+
+    # The matcher and the watcher read the saved profile, so they are updated once the transaction is done
+    if added:
+        invalidate_exclusion_matcher(profile)
+        notify_profile_changed(profile)
     return jsonify({"success": True, "exclusions": exclusions})
 
 @app.route("/remove_exclusion", methods=["POST"])
@@ -1395,33 +1600,59 @@ def remove_exclusion():
     if not profile or not pattern:
         return jsonify({"success": False, "message": "Missing profile or pattern"}), 400
     
-    profiles = load_profiles()
-    if profile not in profiles:
-        return jsonify({"success": False, "message": "Profile not found"}), 404
-    
-    profile_data = profiles[profile]
+    removed = False
+    with get_profile_store().transaction() as profiles:
+        if profile not in profiles:
+            return jsonify({"success": False, "message": "Profile not found"}), 404
     
-    # Handle new format only (old format doesn't have exclusions)
-    if isinstance(profile_data, dict):
-        exclusions = profile_data.get("exclusions", [])
-        if pattern in exclusions:
-            exclusions.remove(pattern)
-            profile_data["exclusions"] = exclusions
-            save_profiles(profiles)
-            return jsonify({"success": True, "exclusions": exclusions})
+        profile_data = profiles[profile]
     
-    return jsonify({"success": False, "message": "Exclusion pattern not found"}), 404
+        # Handle new format only (old format doesn't have exclusions)
+        if isinstance(profile_data, dict):
+            exclusions = profile_data.get("exclusions", [])
+            if pattern in exclusions:
+                exclusions.remove(pattern)
+                profile_data["exclusions"] = exclusions
+                removed = True
+
+    if not removed:
+        return jsonify({"success": False, "message": "Exclusion pattern not found"}), 404
+    invalidate_exclusion_matcher(profile)
+    notify_profile_changed(profile)
+    return jsonify({"success": True, "exclusions": exclusions})
 
 @app.route("/get_exclusions", methods=["GET"])
 def get_exclusions():
-    """Get all exclusion patterns for the specified profile."""
+    """Get the exclusion patterns for the specified profile: all of them, or one page with offset/limit."""
     profile = request.args.get("profile")
     
     if not profile:
         return jsonify({"success": False, "message": "Missing profile"}), 400
     
     exclusions = get_profile_exclusions(profile)
-    return jsonify({"success": True, "exclusions": exclusions})
+    if "offset" not in request.args and "limit" not in request.args:
+        return jsonify({"success": True, "exclusions": exclusions})
+
+    page = get_page_args()
+    if page is None:
+        return jsonify({"success": False, "message": "Invalid offset or limit"}), 400
+    offset, limit = page
+    return page_response("exclusions", exclusions[offset:offset + limit], len(exclusions), offset)
+
+@app.route("/get_paths", methods=["GET"])
+def get_paths():
+    """Get one page (offset/limit) of the paths in the specified profile, with folder flags and icons."""
+    profile = request.args.get("profile")
+
+    if not profile:
+        return jsonify({"success": False, "message": "Missing profile"}), 400
+
+    page = get_page_args()
+    if page is None:
+        return jsonify({"success": False, "message": "Invalid offset or limit"}), 400
+    offset, limit = page
+    paths = get_profile_paths(profile)
+    return page_response("paths", [path_item(path) for path in paths[offset:offset + limit]], len(paths), offset)
 
 @app.route("/add_path", methods=["POST"])
 def add_path():
@@ -1431,25 +1662,29 @@ def add_path():
     if not profile or not file_path:
         return redirect(url_for("index"))
 
-    profiles = load_profiles()
-    if profile not in profiles:
-        profiles[profile] = {"paths": [], "exclusions": []}
+    with get_profile_store().transaction() as profiles:
+        if profile not in profiles:
+            profiles[profile] = {"paths": [], "exclusions": []}
     
-    # Get profile data
-    profile_data = profiles[profile]
+        # Get profile data
+        profile_data = profiles[profile]
     
-    # Convert old format if needed
-    if isinstance(profile_data, list):
-        profile_data = {"paths": profile_data, "exclusions": []}
-        profiles[profile] = profile_data
+        # Convert old format if needed
+        if isinstance(profile_data, list):
+            profile_data = {"paths": profile_data, "exclusions": []}
+            profiles[profile] = profile_data
     
-    # Add the path if it's not already in the profile
-    paths = profile_data.get("paths", [])
-    if file_path not in paths:
-        paths.append(file_path)
-        profile_data["paths"] = paths
-    
-    save_profiles(profiles)
+        # Add the path if it's not already in the profile
+        paths = profile_data.get("paths", [])
+        added = file_path not in paths
+        if added:
+            paths.append(file_path)
+            profile_data["paths"] = paths
+            _path_info_cache.pop(file_path, None)
+
+    # The watcher schedules its watches from the saved paths
+    if added:
+        notify_profile_changed(profile)
     return redirect(url_for("index", profile=profile))
 
 @app.route("/remove_path", methods=["POST"])
@@ -1462,45 +1697,322 @@ def remove_path():
     if not profile or not path:
         return jsonify({"success": False, "message": "Missing profile or path"}), 400
     
-    profiles = load_profiles()
-    if profile not in profiles:
-        return jsonify({"success": False, "message": "Profile not found"}), 404
-    
-    profile_data = profiles[profile]
+    removed = False
+    with get_profile_store().transaction() as profiles:
+        if profile not in profiles:
+            return jsonify({"success": False, "message": "Profile not found"}), 404
     
-    # Handle old format
-    if isinstance(profile_data, list):
-        if path in profile_data:
-            profile_data.remove(path)
-            save_profiles(profiles)
-            return jsonify({"success": True})
-    else:
-        # New format
-        paths = profile_data.get("paths", [])
-        if path in paths:
-            paths.remove(path)
-            profile_data["paths"] = paths
-            save_profiles(profiles)
-            return jsonify({"success": True})
+        profile_data = profiles[profile]
     
-    return jsonify({"success": False, "message": "Path not found in profile"}), 404
+        # Handle old format
+        if isinstance(profile_data, list):
+            if path in profile_data:
+                profile_data.remove(path)
+                removed = True
+        else:
+            # New format
+            paths = profile_data.get("paths", [])
+            if path in paths:
+                paths.remove(path)
+                profile_data["paths"] = paths
+                removed = True
+
+    if not removed:
+        return jsonify({"success": False, "message": "Path not found in profile"}), 404
+    notify_profile_changed(profile)
+    return jsonify({"success": True})
 
 @app.route("/generate", methods=["POST"])
 def generate():
     """Generate the aggregated code for the given profile and return JSON."""
     data = request.get_json()
     profile = data.get("profile")
+
+    workers = data.get("workers")
+    if workers is not None:
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid workers value"}), 400
     
-    # Aggregate files
-    content = aggregate_files(profile)
+    tokenizer = data.get("tokenizer")
+    if tokenizer is not None and tokenizer not in TOKENIZERS:
+        return jsonify({"success": False, "message": "Unknown tokenizer"}), 400
+
+    output_format = get_output_format(profile, data.get("format"))
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({"success": False, "message": "Unknown output format"}), 400
+    measure_all = bool(data.get("compare_formats"))
+    dedup = data.get("dedup")
+    if dedup is not None:
+        dedup = bool(dedup)
+    # Delta mode only sends the files added, modified or deleted since the profile's last delta run
+    delta = bool(data.get("delta"))
+    # Ranking picks the most relevant files that fit the budget; a query turns it on and adds keyword matching
+    query = data.get("query") or None
+    rank = data.get("rank")
+    if rank is not None:
+        rank = bool(rank)
+    # Only aggregate the files that contain every term of this search (see /search)
+    search = data.get("search") or None
+    if search is not None:
+        try:
+            check_search_query(search)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+    compression = data.get("compression")
+    if compression is not None and compression != "none" and compression not in available_compressions():
+        return jsonify({"success": False, "message": "Unknown or unavailable compression"}), 400
+
+    processes = data.get("processes")
+    if processes is not None:
+        try:
+            processes = int(processes)
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Invalid processes value"}), 400
+    try:
+        processes = choose_processes(profile, processes, delta, measure_all)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    # Async mode hands the aggregation to a background job and returns its id straight away
+    if data.get("async"):
+        job, deduplicated = job_manager.submit(profile, output_format, tokenizer, workers, dedup, delta, rank, query,
+                                               search, processes, compression, measure_all)
+        return jsonify({"success": True, "deduplicated": deduplicated, **job.progress()}), 202
+    
+    # Watched profiles are served from their warm snapshot unless the request changes how files are read
+    entries = None
+    stats = {}
+    sizes = {}
+    metrics = PipelineMetrics()
+    watcher = ensure_profile_watcher(profile)
+    # Process-pool mode does its own reading and encoding, so it never uses the snapshot
+    if (watcher is not None and not processes and workers is None and dedup is None and not delta and rank is None
+            and query is None and search is None):
+        snapshot = watcher.get_snapshot(timeout=WATCH_SNAPSHOT_TIMEOUT)
+        if snapshot is not None and tokenizer in (None, snapshot.stats["tokens"]["tokenizer"]):
+            entries = snapshot.entries
+            stats = dict(snapshot.stats)
+            stats["snapshot"] = {
+                "version": snapshot.version,
+                "age_seconds": round(time.time() - snapshot.built_at, 3),
+                "mode": watcher.mode
+            }
+    if entries is not None:
+        chunks = iter_aggregated_chunks(entries, output_format, sizes, measure_all, metrics)
+    else:
+        chunks = iter_profile_chunks(profile, output_format, stats, sizes, metrics, measure_all, processes,
+                                     workers=workers, tokenizer=tokenizer, dedup=dedup, delta=delta, rank=rank,
+                                     query=query, search=search)
+    # Snapshot stats carry the metrics of the run that built them; report this request's instead
+    stats["metrics"] = metrics.data
+    
+    if data.get("stream"):
+        chunks = stream_aggregate(profile, chunks, stats, sizes, output_format, metrics, compression)
+        encoding = accepted_encoding()
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding is not None:
+            chunks = iter_compressed(chunks, encoding)
+            headers["Content-Encoding"] = encoding
+        return Response(stream_with_context(chunks), mimetype=OUTPUT_FORMATS[output_format].mimetype,
+                        headers=headers)
+
+    # Aggregate files, also writing out the 'aggregated_files.json' (or a compressed, timestamped artifact)
+    # for reference. We keep the same "Current code below:\n" + JSON structure here
+    content = "".join(iter_written_output(profile, chunks, stats, sizes, output_format, metrics, compression))
+    record_run(profile, stats)
+
+    return compress_response(jsonify({"aggregated": content, **stats}))
+
+def stream_aggregate(profile, chunks, stats, sizes, output_format=DEFAULT_OUTPUT_FORMAT, metrics=None,
+                     compression=None):
+    """Yield the aggregated output chunks while tee-ing them to 'aggregated_files.<ext>'.
+
+    With `compression` (the profile's "compression" setting by default), the copy on disk is a
+    compressed, timestamped artifact instead (see open_output_artifact()).
+    `stats` and `sizes` are the dicts the chunks' producer fills in; stats is completed and stored once
+    the stream ends.
+    """
+    yield from iter_written_output(profile, chunks, stats, sizes, output_format, metrics, compression)
+    record_run(profile, stats)
+
+def record_run(profile, stats):
+    """Keep a finished run's stats (including background jobs') for /generate_stats and /metrics."""
+    _last_run_stats[profile] = stats
+    _run_counts[profile] = _run_counts.get(profile, 0) + 1
+
+@app.route("/generate_stats", methods=["GET"])
+def generate_stats():
+    """Get the stats (cache, budget, tokens) of the last generate run for the specified profile."""
+    profile = request.args.get("profile")
+
+    if not profile:
+        return jsonify({"success": False, "message": "Missing profile"}), 400
+
+    stats = _last_run_stats.get(profile)
+    if stats is None:
+        return jsonify({"success": False, "message": "Profile has not been generated yet"}), 404
+    return jsonify({"success": True, **stats})
+
+@app.route("/manifest", methods=["GET"])
+def manifest():
+    """Dry run: list the files a generate would pick up for a profile, with sizes and projected tokens, without reading them."""
+    profile = request.args.get("profile")
+
+    if not profile:
+        return jsonify({"success": False, "message": "Missing profile"}), 400
+    if profile not in get_profile_store().profiles():
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+
+    return jsonify({"success": True, **build_manifest(profile)})
+
+@app.route("/search", methods=["GET"])
+def search_files():
+    """Find the files of a profile that contain every term of q, from its persistent search index."""
+    profile = request.args.get("profile")
+    query = request.args.get("q", "").strip()
+
+    if not profile:
+        return jsonify({"success": False, "message": "Missing profile"}), 400
+    if not query:
+        return jsonify({"success": False, "message": "Missing query"}), 400
+    if profile not in get_profile_store().profiles():
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+
+    try:
+        check_search_query(query)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    start = time.perf_counter()
+    files = search_profile(profile, query)
+    return jsonify({
+        "success": True,
+        "query": query,
+        "files": files,
+        "total": len(files),
+        "indexed_files": len(get_search_index(profile).files),
+        "seconds": round(time.perf_counter() - start, 6)
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Phase timings, counters and sizes of each profile's last generate run, in Prometheus text format."""
+    return Response(format_metrics(), mimetype="text/plain; version=0.0.4")
+
+def format_metrics():
+    """Render the recorded runs in the Prometheus text exposition format."""
+    def label(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    families = [
+        ("collate_generate_runs_total", "counter", "Generate runs since the server started."),
+        ("collate_last_run_wall_seconds", "gauge", "Wall time of the last generate run."),
+        ("collate_last_run_phase_seconds", "gauge",
+         "Time spent in each phase of the last generate run (summed across reader threads)."),
+        ("collate_last_run_count", "gauge", "Counters of the last generate run (dirs visited, files excluded, ...)."),
+        ("collate_last_run_bytes", "gauge", "Bytes read from disk and written out by the last generate run."),
+        ("collate_last_run_tokens", "gauge", "Estimated tokens in the last generate run."),
+    ]
+    samples = {name: [] for name, _, _ in families}
+    for profile, stats in _last_run_stats.items():
+        p = label(profile)
+        samples["collate_generate_runs_total"].append((f'profile="{p}"', _run_counts.get(profile, 0)))
+        if "tokens" in stats:
+            samples["collate_last_run_tokens"].append((f'profile="{p}"', stats["tokens"]["total"]))
+        run_metrics = stats.get("metrics")
+        if run_metrics is None:
+            continue
+        if run_metrics["wall_seconds"] is not None:
+            samples["collate_last_run_wall_seconds"].append((f'profile="{p}"', run_metrics["wall_seconds"]))
+        for phase in METRIC_PHASES:
+            samples["collate_last_run_phase_seconds"].append(
+                (f'profile="{p}",phase="{phase}"', run_metrics["seconds"][phase]))
+        for counter in METRIC_COUNTS:
+            samples["collate_last_run_count"].append(
+                (f'profile="{p}",counter="{counter}"', run_metrics["counts"][counter]))
+        for kind in METRIC_BYTES:
+            samples["collate_last_run_bytes"].append((f'profile="{p}",kind="{kind}"', run_metrics["bytes"][kind]))
+
+    lines = []
+    for name, metric_type, help_text in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples[name]:
+            lines.append(f"{name}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Get the status and progress (files scanned, bytes read, ETA) of a background job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, **job.progress()})
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Stream a background job's progress as server-sent events until it finishes."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+
+    def events():
+        while True:
+            finished = job.done.wait(JOB_EVENT_INTERVAL)
+            yield f"data: {json.dumps(job.progress())}\n\n"
+            if finished:
+                break
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """Get the aggregated output and stats of a finished background job."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    if job.status == "failed":
+        return jsonify({"success": False, "message": job.error}), 500
+    if job.status != "done":
+        return jsonify({"success": False, "message": "Job has not finished yet", **job.progress()}), 409
+
+    return compress_response(jsonify({"aggregated": job.result, **job.stats}))
+
+@app.route("/watch", methods=["GET", "POST"])
+def watch():
+    """Get (GET) or set (POST) whether a profile is kept warm by a background watcher."""
+    if request.method == "GET":
+        profile = request.args.get("profile")
+    else:
+        data = request.get_json()
+        profile = data.get("profile")
+
+    if not profile:
+        return jsonify({"success": False, "message": "Missing profile"}), 400
+
+    if request.method == "POST":
+        with get_profile_store().transaction() as profiles:
+            if profile not in profiles:
+                return jsonify({"success": False, "message": "Profile not found"}), 404
+            profiles[profile]["watch"] = bool(data.get("enabled"))
+        ensure_profile_watcher(profile)
 
-    # Also write out the 'aggregated_files.json' for reference, if desired
-    # We keep the same "Current code below:\n" + JSON structure here
-    output_filename = "aggregated_files.json"
-    with open(output_filename, "w", encoding="utf-8") as out_file:
-        out_file.write(content)
+    watcher = get_profile_watcher(profile)
+    if watcher is None:
+        return jsonify({"success": True, "watching": False})
 
-    return jsonify({"aggregated": content})
+    snapshot = watcher.snapshot
+    return jsonify({
+        "success": True,
+        "watching": True,
+        "mode": watcher.mode,
+        "version": snapshot.version if snapshot is not None else None,
+        "age_seconds": round(time.time() - snapshot.built_at, 3) if snapshot is not None else None,
+        "error": watcher.last_error
+    })
 
 # -----------------------
 # RUN SERVER
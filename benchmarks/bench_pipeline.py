@@ -0,0 +1,231 @@
+"""Time each phase of the aggregation pipeline (walk, match, read, serialize) on a synthetic source tree.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--files N] [--depth D] [--size-dist lognormal] [--binary-ratio R]
+                                        [--excluded-dirs N] [--repeat N] [--output results.json]
+
+The tree is generated from --seed, so runs with the same arguments are comparable.
+Results are printed (or written to --output) as JSON.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collate
+from collate import (
+    OUTPUT_FORMATS, TOKENIZERS, DEFAULT_TOKENIZER,
+    ExclusionMatcher, iter_file_paths, load_file_entry, iter_aggregated_chunks, aggregate_files, save_profiles
+)
+
+DEFAULT_EXCLUSIONS = [r"/node_modules/", r"/.git/", r"/__pycache__/", r"/venv/", r"/.venv/",
+                      r"/env/", r"/dist/", r"/build/", r"/.idea/", r"/.vscode/"]
+
+# Names used for the exclusion-heavy directories; all of them match DEFAULT_EXCLUSIONS
+EXCLUDED_DIR_NAMES = ["node_modules", "build", "dist", "__pycache__", ".venv"]
+
+SOURCE_EXTENSIONS = [".py", ".js", ".java", ".cpp", ".c", ".html", ".css", ".cs", ".md", ".txt"]
+
+# -----------------------
+# SYNTHETIC TREES
+# -----------------------
+def file_size(rng, args):
+    """Draw a file size from the configured distribution."""
+    if args.size_dist == "fixed":
+        return args.mean_size
+    if args.size_dist == "uniform":
+        return rng.randint(0, args.mean_size * 2)
+    # Log-normal: mostly small files with a long tail, like real source trees
+    return min(int(rng.lognormvariate(0, 1) * args.mean_size / 1.65), args.max_size)
+
+def source_text(rng, size):
+    """Plausible-looking source text of roughly `size` bytes."""
+    words = ["def", "return", "self", "value", "for", "in", "if", "else", "import", "class",
+             "result", "=", "(", ")", ":", "+", "1", "0", "\"text\"", "None"]
+    lines = []
+    total = 0
+    while total < size:
+        line = "    " * rng.randint(0, 3) + " ".join(rng.choice(words) for _ in range(rng.randint(2, 12)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+def random_directory(rng, root, depth, fanout):
+    """Pick (creating the path lazily) a directory up to `depth` levels below root."""
+    parts = [f"dir{rng.randrange(fanout)}" for _ in range(rng.randint(0, depth))]
+    return os.path.join(root, *parts)
+
+def generate_tree(root, args):
+    """Write a synthetic tree under root and return a summary of what was generated."""
+    rng = random.Random(args.seed)
+    summary = {"files": 0, "binary_files": 0, "excluded_files": 0, "bytes": 0}
+
+    def write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        summary["bytes"] += len(data)
+
+    for i in range(args.files):
+        directory = random_directory(rng, root, args.depth, args.fanout)
+        size = file_size(rng, args)
+        if rng.random() < args.binary_ratio:
+            # Half are caught by their extension, half only by sniffing their content
+            name = f"asset{i}.png" if i % 2 else f"blob{i}.blob"
+            write(os.path.join(directory, name), b"\x00" + rng.getrandbits(8 * size).to_bytes(size, "little"))
+            summary["binary_files"] += 1
+        else:
+            name = f"file{i}{rng.choice(SOURCE_EXTENSIONS)}"
+            write(os.path.join(directory, name), source_text(rng, size).encode("utf-8"))
+        summary["files"] += 1
+
+    for i in range(args.excluded_dirs):
+        directory = os.path.join(random_directory(rng, root, args.depth, args.fanout),
+                                 EXCLUDED_DIR_NAMES[i % len(EXCLUDED_DIR_NAMES)], f"pkg{i}")
+        for j in range(args.excluded_files):
+            write(os.path.join(directory, f"mod{j}.js"), source_text(rng, file_size(rng, args)).encode("utf-8"))
+            summary["excluded_files"] += 1
+
+    summary["dirs"] = sum(len(dirs) for _, dirs, _ in os.walk(root))
+    return summary
+
+# -----------------------
+# PHASES
+# -----------------------
+def measure(func, repeat):
+    """Run func repeat times for the best wall time, then once more under tracemalloc for peak memory."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+def phase_result(seconds, peak, items, nbytes=None):
+    """Timing, throughput and peak memory of one phase."""
+    result = {
+        "seconds": round(seconds, 6),
+        "items": items,
+        "items_per_second": round(items / seconds, 1) if seconds else None,
+        "peak_memory_bytes": peak
+    }
+    if nbytes is not None:
+        result["bytes"] = nbytes
+        result["mb_per_second"] = round(nbytes / seconds / 1e6, 2) if seconds else None
+    return result
+
+def run_benchmarks(root, work_dir, args):
+    """Time the walk, match, read and serialize phases and a full aggregate_files() run."""
+    matcher = ExclusionMatcher(DEFAULT_EXCLUSIONS)
+    count_tokens = TOKENIZERS[args.tokenizer]
+    phases = {}
+
+    # walk: the pruned scandir traversal the profile would use
+    seconds, peak, files = measure(lambda: list(iter_file_paths([root], matcher)), args.repeat)
+    phases["walk"] = phase_result(seconds, peak, len(files))
+
+    # match: the exclusion regex over every path in the tree, pruned or not
+    all_paths = []
+    for current, dirs, names in os.walk(root):
+        all_paths.extend(os.path.join(current, d) for d in dirs)
+        all_paths.extend(os.path.join(current, n) for n in names)
+    seconds, peak, _ = measure(lambda: [matcher.matches(path) for path in all_paths], args.repeat)
+    phases["match"] = phase_result(seconds, peak, len(all_paths))
+
+    # read: decode and tokenize each walked file, without the content cache
+    read_bytes = sum(st.st_size for _, st in files if st is not None)
+    seconds, peak, loaded = measure(
+        lambda: [load_file_entry(path, None, st, None, args.tokenizer) for path, st in files], args.repeat
+    )
+    entries = [entry for entry, _ in loaded]
+    phases["read"] = phase_result(seconds, peak, len(files), read_bytes)
+    phases["read"]["tokens"] = sum(count_tokens(entry["content"]) for entry in entries)
+
+    # serialize: encode the entries in each output format
+    for name in args.format or sorted(OUTPUT_FORMATS):
+        seconds, peak, output = measure(lambda: "".join(iter_aggregated_chunks(entries, name)), args.repeat)
+        phases[f"serialize_{name}"] = phase_result(seconds, peak, len(entries), len(output.encode("utf-8")))
+
+    # end to end: aggregate_files() through a throwaway profile, with a cold and a warm content cache
+    collate.PROFILES_FILE = os.path.join(work_dir, "profiles.json")
+    collate.CACHE_DIR = os.path.join(work_dir, "cache")
+    profile = {"paths": [root], "exclusions": DEFAULT_EXCLUSIONS, "tokenizer": args.tokenizer}
+    cold_runs = iter(range(args.repeat + 1))
+    save_profiles({**{f"cold{i}": profile for i in range(args.repeat + 1)}, "warm": profile})
+    seconds, peak, _ = measure(lambda: aggregate_files(f"cold{next(cold_runs)}"), args.repeat)
+    phases["aggregate_cold"] = phase_result(seconds, peak, len(files), read_bytes)
+    aggregate_files("warm")
+    seconds, peak, _ = measure(lambda: aggregate_files("warm"), args.repeat)
+    phases["aggregate_warm"] = phase_result(seconds, peak, len(files), read_bytes)
+    if args.processes:
+        seconds, peak, _ = measure(lambda: aggregate_files("warm", processes=args.processes), args.repeat)
+        phases["aggregate_warm_processes"] = phase_result(seconds, peak, len(files), read_bytes)
+        phases["aggregate_warm_processes"]["processes"] = args.processes
+
+    return phases
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000, help="Files outside the excluded directories")
+    parser.add_argument("--depth", type=int, default=4, help="Maximum directory depth")
+    parser.add_argument("--fanout", type=int, default=4, help="Subdirectories per level")
+    parser.add_argument("--size-dist", choices=["lognormal", "uniform", "fixed"], default="lognormal",
+                        help="File size distribution")
+    parser.add_argument("--mean-size", type=int, default=4096, help="Typical file size in bytes")
+    parser.add_argument("--max-size", type=int, default=1024 * 1024, help="Largest file size in bytes")
+    parser.add_argument("--binary-ratio", type=float, default=0.05, help="Fraction of binary files")
+    parser.add_argument("--excluded-dirs", type=int, default=20,
+                        help="Directories such as node_modules/ or build/ that the exclusions prune")
+    parser.add_argument("--excluded-files", type=int, default=100, help="Files in each excluded directory")
+    parser.add_argument("--tokenizer", choices=sorted(TOKENIZERS), default=DEFAULT_TOKENIZER)
+    parser.add_argument("--format", action="append", choices=sorted(OUTPUT_FORMATS),
+                        help="Output format to serialize (repeatable, default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated tree")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per phase; the best time is reported")
+    parser.add_argument("--processes", type=int,
+                        help="Also time a warm aggregate_files() run in process-pool mode with this many processes")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated tree and print where it is")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="collate-bench-")
+    root = os.path.join(work_dir, "tree")
+    try:
+        tree = generate_tree(root, args)
+        phases = run_benchmarks(root, work_dir, args)
+    finally:
+        if args.keep:
+            print(f"Tree kept at {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("keep", "output")},
+        "tree": tree,
+        "phases": phases
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3238 @@
+import os
+import json
+import math
+import bisect
+import mmap
+import multiprocessing
+import re
+import codecs
+import copy
+import hashlib
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+try:
+    # Optional: filesystem events wake watchers immediately instead of waiting for the next poll
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+try:
+    # Optional: zstd as an alternative to gzip for output artifacts and /generate responses
+    import zstandard
+except ImportError:
+    zstandard = None
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# -----------------------
+# CONFIGURATION
+# -----------------------
+# This is where we store user-defined profiles (e.g., "default", "project_x").
+# Each profile has a list of file paths to be aggregated.
+PROFILES_FILE = "profiles.json"
+
+# Global exclusion list for directories/patterns to skip
+EXCLUDED_DIRS = []
+
+# Per-profile content caches are persisted here so unchanged files aren't re-read
+CACHE_DIR = ".collate_cache"
+
+# Upper bound on cached file content per profile (in characters)
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Number of files each profile's content cache is split into, so saving a change rewrites only a fraction of it
+CACHE_SHARDS = 64
+
+# Number of threads used to read files; profiles and /generate can override it
+DEFAULT_WORKERS = 8
+
+# Files larger than this are truncated; profiles can override it with "max_file_bytes" (null for no limit)
+DEFAULT_MAX_FILE_BYTES = 10 * 1024 * 1024
+
+# Rough source-code ratio used to turn byte sizes into token estimates before a file is read
+BYTES_PER_TOKEN = 4
+
+# Token estimator used for the /generate stats and token budgets; profiles and /generate can pick another
+# from TOKENIZERS ("bpe" follows code more closely but costs a regex pass over every file)
+DEFAULT_TOKENIZER = "chars"
+
+# Output encoding; profiles and /generate can pick another from OUTPUT_FORMATS
+DEFAULT_OUTPUT_FORMAT = "json"
+
+# Compressed output artifacts are written here as <profile>-<timestamp><ext>.<gz|zst>; profiles pick a
+# compression with "compression" and how many artifacts to keep with "artifacts_keep" (null to keep all)
+ARTIFACT_DIR = "artifacts"
+DEFAULT_ARTIFACT_KEEP = 10
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Relevance ranking (see rank_files()): weight of each signal in a file's score, and how much of
+# each file is scanned (once per change) for keywords and imports
+RANK_WEIGHTS = {
+    "recency": 1.0,
+    "size": 0.5,
+    "keyword": 3.0,
+    "centrality": 1.5
+}
+RANK_SCAN_BYTES = 64 * 1024
+RANK_MAX_WORDS = 2000
+
+# Text files at least this large are read through mmap and streamed into the output in chunks
+# instead of being held in memory (and the content cache) as one string
+MMAP_THRESHOLD_BYTES = 4 * 1024 * 1024
+MMAP_CHUNK_BYTES = 1024 * 1024
+
+# Process-pool mode hands files to worker processes in contiguous shards of at most this many files/bytes
+SHARD_MAX_FILES = 64
+SHARD_MAX_BYTES = 8 * 1024 * 1024
+
+# With deduplication on, bodies shorter than this are always emitted in full (a reference wouldn't save much)
+DEDUP_MIN_CHARS = 128
+
+# Seconds between rescans of a watched profile; profiles can override it with "watch_interval".
+# With watchdog installed, filesystem events trigger rescans and polling is only a fallback.
+DEFAULT_WATCH_INTERVAL = 2.0
+WATCHDOG_POLL_INTERVAL = 60.0
+
+# Quiet period after a filesystem event before rescanning, so bursts of writes cause one rescan
+WATCH_DEBOUNCE = 0.2
+
+# Basic extension-to-language mapping
+EXTENSION_MAP = {
+    ".py": "Python",
+    ".js": "JavaScript",
+    ".java": "Java",
+    ".cpp": "C++",
+    ".c": "C",
+    ".html": "HTML",
+    ".css": "CSS",
+    ".cs": "C#"
+    # ...add more as needed
+}
+
+# Extensions that are always treated as binary and never opened
+BINARY_EXTENSIONS = {
+    # Images and textures
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.ico', '.webp', '.tif', '.tiff', '.psd',
+    '.tga', '.dds', '.exr', '.hdr', '.ktx', '.astc',
+    # Audio and video
+    '.wav', '.mp3', '.ogg', '.flac', '.aif', '.aiff', '.m4a', '.mp4', '.mov', '.avi', '.mkv', '.webm',
+    # Meshes, 3D and Unity/engine assets
+    '.fbx', '.blend', '.3ds', '.max', '.glb', '.unitypackage', '.assetbundle', '.bundle', '.bank',
+    # Fonts
+    '.ttf', '.otf', '.woff', '.woff2', '.eot',
+    # Archives and compressed files
+    '.zip', '.tar', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.war', '.whl', '.apk',
+    # Compiled code and libraries
+    '.exe', '.dll', '.so', '.dylib', '.a', '.lib', '.o', '.obj', '.pdb', '.mdb', '.pyc', '.pyo',
+    '.class', '.wasm',
+    # Documents, databases and data blobs
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.sqlite', '.db', '.bin', '.dat',
+    '.npy', '.npz', '.pkl', '.pt', '.pth', '.onnx', '.h5', '.parquet'
+}
+
+# Leading bytes of common binary formats, for files whose extension doesn't give them away.
+# Short, text-like magics (e.g. "MZ", "BM") are left to the NUL-byte check instead.
+BINARY_SIGNATURES = (
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'8BPS',
+    b'PK\x03\x04', b'\x1f\x8b', b'\xfd7zXZ', b'(\xb5/\xfd', b'7z\xbc\xaf', b'Rar!\x1a',
+    b'\x7fELF', b'\xca\xfe\xba\xbe', b'\xcf\xfa\xed\xfe', b'\x00asm',
+    b'%PDF-', b'SQLite format 3\x00', b'OggS', b'fLaC', b'Kaydara FBX Binary'
+)
+
+# Byte order marks and the codec used to decode files that start with them (longest first)
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+    (codecs.BOM_UTF8, "utf-8")
+)
+
+# How much of a file is sniffed to tell text from binary before reading the rest
+SNIFF_BYTES = 8192
+
+# Control characters that are normal in text files (tab, newlines, form feed, backspace, escape)
+TEXT_CONTROL_BYTES = {0x08, 0x09, 0x0a, 0x0c, 0x0d, 0x1b}
+# The other control characters, which count against a file being text
+BINARY_CONTROL_BYTES = bytes(byte for byte in range(0x20) if byte not in TEXT_CONTROL_BYTES)
+
+# -----------------------
+# HELPER: PROFILES
+# -----------------------
+class ProfileStore:
+    """Parsed profiles held in memory and re-read only when the profiles file changes on disk.
+
+    Writes are atomic (temp file + rename) and serialized by a lock. transaction() batches a
+    read-modify-write into a single write, so concurrent requests can't lose each other's updates.
+    """
+
+    def __init__(self, profiles_file):
+        self.profiles_file = profiles_file
+        self.lock = threading.RLock()
+        self._profiles = None
+        self._version = None
+
+    def profiles(self):
+        """Return the current profiles. The dict is shared, so treat it as read-only."""
+        with self.lock:
+            st = os.stat(self.profiles_file)
+            version = (st.st_mtime_ns, st.st_size)
+            if self._profiles is None or version != self._version:
+                self._profiles = read_profiles_file(self.profiles_file)
+                self._version = version
+            return self._profiles
+
+    def save(self, profiles):
+        """Atomically replace the profiles file with the given profiles."""
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.profiles_file))
+            fd, tmp_file = tempfile.mkstemp(prefix=".profiles-", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(profiles, f, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.profiles_file)
+            except BaseException:
+                os.unlink(tmp_file)
+                raise
+            st = os.stat(self.profiles_file)
+            self._profiles = copy.deepcopy(profiles)
+            self._version = (st.st_mtime_ns, st.st_size)
+
+    @contextmanager
+    def transaction(self):
+        """Lock the store and yield a mutable copy of the profiles, written back once on exit if it changed."""
+        with self.lock:
+            profiles = copy.deepcopy(self.profiles())
+            yield profiles
+            if profiles != self._profiles:
+                self.save(profiles)
+
+# Profile stores, keyed by profiles file (the CLI can point PROFILES_FILE elsewhere)
+_profile_stores = {}
+_profile_stores_lock = threading.Lock()
+
+def get_profile_store():
+    """Get the store for the current PROFILES_FILE."""
+    with _profile_stores_lock:
+        store = _profile_stores.get(PROFILES_FILE)
+        if store is None:
+            store = ProfileStore(PROFILES_FILE)
+            _profile_stores[PROFILES_FILE] = store
+        return store
+
+def read_profiles_file(profiles_file):
+    """Read and parse a profiles file, converting old-format profiles."""
+    with open(profiles_file, "r", encoding="utf-8") as f:
+        profiles = json.load(f)
+        
+        # Convert old format to new format if needed
+        for profile_name, profile_data in profiles.items():
+            if isinstance(profile_data, list):
+                # Convert old format (list of paths) to new format (dict with paths and exclusions)
+                profiles[profile_name] = {
+                    "paths": profile_data,
+                    "exclusions": []
+                }
+        
+        return profiles
+
+def load_profiles():
+    """Load profiles from the JSON file (through the in-memory store). The result is a copy and safe to modify."""
+    return copy.deepcopy(get_profile_store().profiles())
+
+def save_profiles(profiles):
+    """Save profiles to the JSON file."""
+    get_profile_store().save(profiles)
+        
+def get_profile_paths(profile_name):
+    """Get the paths for a specific profile."""
+    profiles = get_profile_store().profiles()
+    if profile_name not in profiles:
+        return []
+    
+    profile_data = profiles[profile_name]
+    if isinstance(profile_data, dict):
+        return profile_data.get("paths", [])
+    return profile_data  # Fallback for old format
+
+def get_profile_exclusions(profile_name):
+    """Get the exclusions for a specific profile."""
+    profiles = get_profile_store().profiles()
+    if profile_name not in profiles:
+        return []
+    
+    profile_data = profiles[profile_name]
+    if isinstance(profile_data, dict):
+        return profile_data.get("exclusions", [])
+    return []  # If old format, no exclusions
+
+def get_profile_setting(profile_name, key, default=None):
+    """Get an optional per-profile setting (e.g. "workers"), falling back to a default."""
+    profiles = get_profile_store().profiles()
+    profile_data = profiles.get(profile_name)
+    if isinstance(profile_data, dict):
+        return profile_data.get(key, default)
+    return default
+
+# -----------------------
+# HELPER: FILE CONTENT CACHE
+# -----------------------
+class FileCache:
+    """LRU cache of processed file entries, validated against each file's (mtime, size).
+
+    Entries are persisted in CACHE_SHARDS JSON files under `cache_dir`, picked by a hash of the
+    path, and save() only rewrites the shards that changed, so one edited file in a large
+    profile doesn't rewrite the whole cache. Reads go through a CacheRun (see start_run()).
+    """
+
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.dirty_shards = set()
+        self.runs = []
+        self.lock = threading.Lock()
+        self.load()
+
+    def start_run(self):
+        """Start an aggregation run's use of the cache; call finish() on the returned CacheRun when it's done."""
+        run = CacheRun(self)
+        with self.lock:
+            self.runs.append(run)
+        return run
+
+    def finish_run(self, run):
+        """Let the entries a finished run used be evicted again."""
+        with self.lock:
+            if run in self.runs:
+                self.runs.remove(run)
+
+    def get(self, path, st, run=None):
+        """Return the cached record ({"entry", "tokens", ...}) for path if the file is unchanged, otherwise None."""
+        with self.lock:
+            record = self.entries.get(path)
+            if record is None or record["mtime"] != st.st_mtime_ns or record["size"] != st.st_size:
+                if run is not None:
+                    run.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            if run is not None:
+                run.hits += 1
+                run.used.add(path)
+            return record
+
+    def put(self, path, st, entry, tokens=None, run=None):
+        """Store an entry (and its token counts per tokenizer) for path, evicting least recently used entries over the size bound.
+
+        Entries used by a run that hasn't finished are never evicted. A profile larger than the
+        bound would otherwise evict each file just before the next run reads it again, so the
+        entry isn't stored instead and the cache keeps serving the files it already holds.
+        """
+        with self.lock:
+            self._discard(path)
+            cost = len(entry["content"])
+            if cost > self.max_bytes or not self._make_room(cost):
+                return
+            self.entries[path] = {"mtime": st.st_mtime_ns, "size": st.st_size, "entry": entry, "tokens": tokens or {}}
+            self.total_bytes += cost
+            self.dirty_shards.add(cache_shard(path))
+            if run is not None:
+                run.used.add(path)
+
+    def _make_room(self, cost):
+        """Evict least recently used entries until `cost` more fits; False if only entries in use are left."""
+        while self.total_bytes + cost > self.max_bytes:
+            oldest = next(iter(self.entries), None)
+            # Entries in use were moved to the end when they were used, so everything after this one is too
+            if oldest is None or any(oldest in run.used for run in self.runs):
+                return False
+            self._discard(oldest)
+        return True
+
+    def known_tokens(self, path, st, tokenizer):
+        """Return the cached token count of path under tokenizer if the file is unchanged, without counting a hit."""
+        with self.lock:
+            record = self.entries.get(path)
+            if record is None or record["mtime"] != st.st_mtime_ns or record["size"] != st.st_size:
+                return None
+            return record["tokens"].get(tokenizer)
+
+    def touch(self, path, run):
+        """Mark an entry as recently used by a run that was served it elsewhere (e.g. in a worker process)."""
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+                run.used.add(path)
+
+    def set_tokens(self, path, record, tokenizer, count):
+        """Record a token count on path's cached record, e.g. after switching tokenizers."""
+        with self.lock:
+            record["tokens"][tokenizer] = count
+            self.dirty_shards.add(cache_shard(path))
+
+    def discard(self, path):
+        """Drop any cached entry for path."""
+        with self.lock:
+            self._discard(path)
+
+    def _discard(self, path):
+        record = self.entries.pop(path, None)
+        if record is not None:
+            self.total_bytes -= len(record["entry"]["content"])
+            self.dirty_shards.add(cache_shard(path))
+
+    def load(self):
+        """Load persisted entries from disk, ignoring missing or corrupt shard files."""
+        for path, record in load_cache_shards(self.cache_dir):
+            record.setdefault("tokens", {})
+            self.entries[path] = record
+            self.total_bytes += len(record["entry"]["content"])
+
+    def save(self):
+        """Persist the shards that changed since the last save."""
+        with self.lock:
+            save_cache_shards(self.cache_dir, self.entries, self.dirty_shards)
+            self.dirty_shards.clear()
+
+class CacheRun:
+    """One aggregation run's use of a FileCache.
+
+    Counts the run's own hits and misses, so concurrent runs don't mix up each other's stats,
+    and keeps the entries the run used from being evicted until finish() is called.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, st):
+        return self.cache.get(path, st, self)
+
+    def put(self, path, st, entry, tokens=None):
+        self.cache.put(path, st, entry, tokens, self)
+
+    def set_tokens(self, path, record, tokenizer, count):
+        self.cache.set_tokens(path, record, tokenizer, count)
+
+    def touch(self, path):
+        self.cache.touch(path, self)
+
+    def finish(self):
+        self.cache.finish_run(self)
+
+    def summary(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def cache_shard(path):
+    """The number of the shard file a path's cache entry is stored in."""
+    return zlib.crc32(path.encode("utf-8", "surrogateescape")) % CACHE_SHARDS
+
+def load_cache_shards(cache_dir):
+    """Yield the (path, record) pairs persisted in a sharded cache directory, skipping missing or corrupt shards."""
+    for shard in range(CACHE_SHARDS):
+        try:
+            with open(os.path.join(cache_dir, f"{shard:02x}.json"), "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            continue
+        yield from records.items()
+
+def save_cache_shards(cache_dir, entries, shards):
+    """Rewrite the given shards of a sharded cache directory from `entries` (path -> record)."""
+    if not shards:
+        return
+    records_by_shard = {shard: {} for shard in shards}
+    for path, record in entries.items():
+        records = records_by_shard.get(cache_shard(path))
+        if records is not None:
+            records[path] = record
+    os.makedirs(cache_dir, exist_ok=True)
+    for shard, records in records_by_shard.items():
+        shard_file = os.path.join(cache_dir, f"{shard:02x}.json")
+        tmp_file = shard_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            # json.dumps() runs entirely in the C encoder; json.dump() would iterate in Python
+            f.write(json.dumps(records))
+        os.replace(tmp_file, shard_file)
+
+# Loaded caches, keyed by profile name
+_file_caches = {}
+_file_caches_lock = threading.Lock()
+
+def safe_file_name(profile_name):
+    """A profile name reduced to characters that are safe in file names."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", profile_name)
+
+def get_file_cache(profile_name):
+    """Get (loading on first use) the content cache for a profile."""
+    with _file_caches_lock:
+        cache = _file_caches.get(profile_name)
+        if cache is None:
+            cache = FileCache(os.path.join(CACHE_DIR, safe_file_name(profile_name)))
+            _file_caches[profile_name] = cache
+        return cache
+
+# -----------------------
+# HELPER: TOKEN ESTIMATION
+# -----------------------
+# Pre-tokenizer split modelled on GPT-style BPE tokenizers: contractions, words,
+# runs of up to three digits, punctuation runs and whitespace
+BPE_PIECE_RE = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|_+|\s+(?!\S)|\s+""")
+
+def estimate_tokens_bpe(text):
+    """Approximate a BPE tokenizer offline.
+
+    Text is split into pre-tokenizer pieces; whitespace runs (e.g. indentation) cost one
+    token and every other piece one token per ~4 characters.
+    """
+    tokens = 0
+    for piece in BPE_PIECE_RE.findall(text):
+        tokens += 1 if piece.isspace() else (len(piece) + 3) // 4
+    return tokens
+
+def estimate_tokens_chars(text):
+    """Cheapest estimate: one token per 4 characters."""
+    return (len(text) + 3) // 4
+
+# Available token estimators by name; use register_tokenizer() to plug in another
+TOKENIZERS = {
+    "bpe": estimate_tokens_bpe,
+    "chars": estimate_tokens_chars
+}
+
+def register_tokenizer(name, count_tokens):
+    """Make a token counting function (text -> int) selectable by name."""
+    TOKENIZERS[name] = count_tokens
+
+# -----------------------
+# HELPER: EXCLUSION MATCHING
+# -----------------------
+# Backreferences can't be renumbered safely when patterns are joined into one regex
+BACKREFERENCE_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+class ExclusionMatcher:
+    """Matches paths against all of a profile's exclusion patterns with a single regex search."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.compiled = [re.compile(pattern) for pattern in self.patterns]
+        self.combined = None
+        if self.compiled and not any(BACKREFERENCE_RE.search(pattern) for pattern in self.patterns):
+            try:
+                self.combined = re.compile("|".join(f"(?:{pattern})" for pattern in self.patterns))
+            except re.error:
+                # e.g. inline global flags, which are only allowed at the start of a pattern
+                self.combined = None
+
+    def matches(self, path):
+        """Check if a path matches any of the patterns."""
+        if self.combined is not None:
+            return self.combined.search(path) is not None
+        for pattern in self.compiled:
+            if pattern.search(path):
+                return True
+        return False
+
+    def matching_pattern(self, path):
+        """Return the first pattern that matches a path, or None."""
+        for pattern, compiled in zip(self.patterns, self.compiled):
+            if compiled.search(path):
+                return pattern
+        return None
+
+# Compiled matchers, keyed by profile name
+_exclusion_matchers = {}
+
+def get_exclusion_matcher(profile_name):
+    """Get the compiled exclusion matcher for a profile, rebuilding it if the patterns changed."""
+    exclusions = get_profile_exclusions(profile_name)
+    matcher = _exclusion_matchers.get(profile_name)
+    if matcher is None or matcher.patterns != exclusions:
+        matcher = ExclusionMatcher(exclusions)
+        _exclusion_matchers[profile_name] = matcher
+    return matcher
+
+def invalidate_exclusion_matcher(profile_name):
+    """Drop the cached exclusion matcher for a profile after its patterns change."""
+    _exclusion_matchers.pop(profile_name, None)
+
+# -----------------------
+# HELPER: GITIGNORE
+# -----------------------
+GITIGNORE_FILE = ".gitignore"
+
+def translate_gitignore_pattern(line):
+    """Translate one .gitignore line into (regex, negated, directories_only), or None for blanks and comments.
+
+    The regex matches paths relative to the .gitignore's directory, with "/" separators.
+    """
+    line = line.rstrip("\n").rstrip("\r")
+    # Trailing spaces are ignored unless escaped
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    if not line or line.startswith("#"):
+        return None
+
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith("\\"):
+        line = line[1:]
+    directories_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # Patterns with a slash before the end are relative to the .gitignore; others match at any depth
+    anchored = "/" in line
+    line = line.lstrip("/")
+
+    parts = []
+    i = 0
+    while i < len(line):
+        if line.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif line.startswith("/**", i) and i + 3 == len(line):
+            parts.append("/.*")
+            i += 3
+        elif line.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif line[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif line[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif line[i] == "[" and "]" in line[i + 2:]:
+            end = line.index("]", i + 2)
+            body = line[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+        elif line[i] == "\\" and i + 1 < len(line):
+            parts.append(re.escape(line[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(line[i]))
+            i += 1
+
+    prefix = "" if anchored else "(?:.*/)?"
+    return "^" + prefix + "".join(parts) + "$", negated, directories_only
+
+class GitignoreRules:
+    """The patterns of one .gitignore file, matched against paths below its directory."""
+
+    def __init__(self, base_dir, lines):
+        self.base_dir = base_dir
+        self.rules = []
+        for line in lines:
+            translated = translate_gitignore_pattern(line)
+            if translated is None:
+                continue
+            pattern, negated, directories_only = translated
+            try:
+                self.rules.append((re.compile(pattern), negated, directories_only))
+            except re.error:
+                continue
+        # One search tells whether any rule applies, so most paths never reach the per-rule loop
+        self.any_dir = self._combine(self.rules)
+        self.any_file = self._combine([rule for rule in self.rules if not rule[2]])
+
+    @staticmethod
+    def _combine(rules):
+        if not rules:
+            return None
+        return re.compile("|".join(f"(?:{rule[0].pattern})" for rule in rules))
+
+    def match(self, path, is_dir):
+        """True if the rules ignore the path, False if a negated rule re-includes it, None if none apply."""
+        combined = self.any_dir if is_dir else self.any_file
+        if combined is None:
+            return None
+        relative = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+        if not combined.match(relative):
+            return None
+        # The last matching rule wins
+        for pattern, negated, directories_only in reversed(self.rules):
+            if directories_only and not is_dir:
+                continue
+            if pattern.match(relative):
+                return not negated
+        return None
+
+# Parsed .gitignore files, keyed by path, with the (mtime_ns, size) they were parsed at
+_gitignore_rules = {}
+
+def load_gitignore(directory):
+    """Get the parsed .gitignore in a directory, or None; re-parsed only when the file changes."""
+    path = os.path.join(directory, GITIGNORE_FILE)
+    try:
+        st = os.stat(path)
+    except OSError:
+        _gitignore_rules.pop(path, None)
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _gitignore_rules.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            rules = GitignoreRules(directory, f.readlines())
+    except OSError:
+        return None
+    _gitignore_rules[path] = (key, rules)
+    return rules
+
+def is_gitignored(path, is_dir, gitignores):
+    """Check a path against a chain of .gitignore rules, outermost first; deeper files take precedence."""
+    for rules in reversed(gitignores):
+        result = rules.match(path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+# -----------------------
+# HELPER: READ BUDGETS
+# -----------------------
+class ReadBudget:
+    """Per-file and total byte/token limits, charged as files are queued for reading.
+
+    Token limits are charged with each file's token count when it is already known (see
+    get_token_lookup()), and otherwise with an estimate derived from its size, so the walk
+    can stop before anything beyond the budget is read. Estimates can be off, so the actual
+    token counts of the loaded files are charged again with take(), which enforces
+    max_total_tokens on what is emitted.
+    """
+
+    def __init__(self, max_file_bytes=None, max_total_bytes=None, max_total_tokens=None):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_total_tokens = max_total_tokens
+        self.bytes_used = 0
+        self.tokens_used = 0
+        self.tokens_read = 0
+        self.truncated_files = 0
+        self.exhausted = False
+
+    def allot(self, size, tokens=None):
+        """Charge a file of the given size (and token count, if known) and return how many bytes of it may be read.
+
+        Returns None when the whole file fits, and 0 once the total budget is exhausted.
+        """
+        if self.exhausted:
+            return 0
+        if size is None:
+            return None
+
+        allowed = size
+        if self.max_file_bytes is not None:
+            allowed = min(allowed, self.max_file_bytes)
+        bytes_per_token = size / tokens if tokens else BYTES_PER_TOKEN
+        remaining = self.remaining_bytes(bytes_per_token)
+        if remaining == 0:
+            self.exhausted = True
+            return 0
+        if remaining is not None and allowed >= remaining:
+            allowed = remaining
+            self.exhausted = True
+
+        self.bytes_used += allowed
+        if tokens is not None and allowed == size:
+            self.tokens_used += tokens
+        else:
+            self.tokens_used += math.ceil(allowed / bytes_per_token)
+        if allowed < size:
+            self.truncated_files += 1
+            return allowed
+        return None
+
+    def take(self, tokens):
+        """Charge the actual token count of a loaded file; returns False (charging nothing) if it exceeds max_total_tokens."""
+        if tokens is None:
+            return True
+        if self.max_total_tokens is not None and self.tokens_read + tokens > self.max_total_tokens:
+            return False
+        self.tokens_read += tokens
+        return True
+
+    def tokens_left(self):
+        """Actual tokens left under max_total_tokens, or None if unlimited."""
+        if self.max_total_tokens is None:
+            return None
+        return max(self.max_total_tokens - self.tokens_read, 0)
+
+    def fits(self, size, tokens=None):
+        """Check whether a file would be charged in full (up to max_file_bytes) without using up the total budget."""
+        allowed = size if self.max_file_bytes is None else min(size, self.max_file_bytes)
+        remaining = self.remaining_bytes(size / tokens if tokens else BYTES_PER_TOKEN)
+        return not self.exhausted and (remaining is None or allowed < remaining)
+
+    def remaining_bytes(self, bytes_per_token=BYTES_PER_TOKEN):
+        """Bytes left under the tighter of the byte and token budgets, or None if unlimited.
+
+        The token budget is converted to bytes at `bytes_per_token`.
+        """
+        limits = []
+        if self.max_total_bytes is not None:
+            limits.append(self.max_total_bytes - self.bytes_used)
+        if self.max_total_tokens is not None:
+            limits.append(int((self.max_total_tokens - self.tokens_used) * bytes_per_token))
+        if not limits:
+            return None
+        return max(min(limits), 0)
+
+    def summary(self):
+        """Budget usage for the /generate stats."""
+        return {
+            "bytes": self.bytes_used,
+            "estimated_tokens": self.tokens_used,
+            "tokens": self.tokens_read,
+            "truncated_files": self.truncated_files,
+            "exhausted": self.exhausted
+        }
+
+def cut_to_tokens(entry, size, limit, max_tokens, count_tokens):
+    """Cut a loaded text entry down to a prefix of at most `max_tokens` tokens, truncation marker included.
+
+    `size` is the file's size and `limit` the byte limit it was read with, if any. Returns
+    (entry, tokens), or (None, 0) if not even the marker fits or the entry can't be cut
+    (binaries, read errors and streamed large files).
+    """
+    content = entry["content"]
+    if entry["language"] in ("Binary", "Error") or not isinstance(content, str):
+        return None, 0
+    if limit is not None:
+        # Drop the marker of the byte-based truncation
+        content = content[:content.rfind("\n[Truncated: ")]
+    if size is None:
+        size = len(content.encode("utf-8"))
+
+    def cut(length):
+        text = content[:length]
+        return (text + f"\n[Truncated: {entry['filename']} is {size} bytes, "
+                       f"only the first {len(text.encode('utf-8'))} bytes are included]")
+
+    if count_tokens(cut(0)) > max_tokens:
+        return None, 0
+    low, high = 0, len(content)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(cut(middle)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    # End on a line boundary when there is one
+    end = content.rfind("\n", 0, low) + 1 or low
+    truncated = cut(end)
+    return {**entry, "content": truncated}, count_tokens(truncated)
+
+def get_profile_budget(profile_name):
+    """Build the read budget configured for a profile."""
+    return ReadBudget(
+        max_file_bytes=get_profile_setting(profile_name, "max_file_bytes", DEFAULT_MAX_FILE_BYTES),
+        max_total_bytes=get_profile_setting(profile_name, "max_total_bytes"),
+        max_total_tokens=get_profile_setting(profile_name, "max_total_tokens")
+    )
+
+def get_token_lookup(profile_name, tokenizer):
+    """Return a function (path, stat) -> the file's token count under `tokenizer` if already known, else None.
+
+    Counts come from the profile's content cache, or else from its ranking feature cache, and
+    are only used while the file's (mtime, size) still matches them.
+    """
+    cache = get_file_cache(profile_name)
+    features = get_feature_cache(profile_name)
+
+    def known_tokens(path, st):
+        tokens = cache.known_tokens(path, st, tokenizer)
+        if tokens is None:
+            tokens = features.known_tokens(path, st, tokenizer)
+        return tokens
+    return known_tokens
+
+# -----------------------
+# HELPER: DEDUPLICATION
+# -----------------------
+class ContentDeduplicator:
+    """Emits each unique file body once; later copies become references to the first file that had it."""
+
+    def __init__(self, min_chars=DEDUP_MIN_CHARS):
+        self.min_chars = min_chars
+        self.first_paths = {}
+        self.duplicates = {}
+        self.bytes_saved = 0
+
+    def digest(self, entry):
+        """Return (content hash, UTF-8 size) of an entry, or None if it is always emitted in full."""
+        content = entry["content"]
+        if entry["language"] in ("Binary", "Error") or len(content) < self.min_chars:
+            return None
+        return content_digest(content)
+
+    def process(self, entry, digest=None):
+        """Return the entry itself, or a reference entry if its content was already emitted.
+
+        `digest` can be passed if digest(entry) was already computed (e.g. in a worker process);
+        the entry's content isn't looked at then.
+        """
+        if digest is None:
+            digest = self.digest(entry)
+            if digest is None:
+                return entry
+        digest, size = digest
+        first_path = self.first_paths.setdefault(digest, entry["full_path"])
+        if first_path == entry["full_path"]:
+            return entry
+
+        reference = {
+            "filename": entry["filename"],
+            "language": entry["language"],
+            "content": f"[Duplicate of {first_path}]",
+            "full_path": entry["full_path"],
+            "duplicate_of": first_path
+        }
+        self.duplicates[entry["full_path"]] = reference["content"]
+        self.bytes_saved += size - len(reference["content"].encode("utf-8"))
+        return reference
+
+    def summary(self, file_tokens=None, count_tokens=None):
+        """Savings of this run; per-file token counts of duplicates are replaced by their reference's."""
+        tokens_saved = 0
+        if file_tokens is not None and count_tokens is not None:
+            for path, content in self.duplicates.items():
+                reference_tokens = count_tokens(content)
+                tokens_saved += file_tokens[path] - reference_tokens
+                file_tokens[path] = reference_tokens
+        return {
+            "duplicates": len(self.duplicates),
+            "bytes_saved": self.bytes_saved,
+            "tokens_saved": tokens_saved
+        }
+
+def content_digest(content):
+    """Return (SHA-256 digest, UTF-8 size) of an entry's content (a string or MappedText)."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter_content_chunks(content):
+        encoded = chunk.encode("utf-8", "surrogatepass")
+        digest.update(encoded)
+        size += len(encoded)
+    return digest.digest(), size
+
+# -----------------------
+# HELPER: DELTA OUTPUT
+# -----------------------
+class DeltaTracker:
+    """Compares a run against the (path, content hash) manifest saved by the profile's previous delta run.
+
+    Only added and modified files are emitted, each marked with a "change" key, followed by
+    entries for the files that were deleted since. Hashes are reused for files whose
+    (mtime, size) hasn't changed, so unchanged files are never hashed again. The first run
+    (without a manifest) emits every file as added.
+    """
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.previous = {}
+        self.current = {}
+        self.counts = {"added": 0, "modified": 0, "deleted": 0, "unchanged": 0}
+        self.load()
+
+    def process(self, entry, st=None, limit=None):
+        """Return the entry marked as added or modified, or None if it is unchanged since the last run."""
+        path = entry["full_path"]
+        key = [st.st_mtime_ns, st.st_size, limit] if st is not None else None
+        record = self.previous.get(path)
+        if record is not None and key is not None and record["key"] == key:
+            digest = record["digest"]
+        else:
+            digest = content_digest(entry["content"])[0].hex()
+        self.current[path] = {"key": key, "digest": digest, "language": entry["language"]}
+
+        if record is not None and record["digest"] == digest:
+            self.counts["unchanged"] += 1
+            return None
+        change = "added" if record is None else "modified"
+        self.counts[change] += 1
+        return {**entry, "change": change}
+
+    def iter_deleted(self):
+        """Yield an entry for each file of the previous run that this run didn't see."""
+        for path, record in self.previous.items():
+            if path in self.current:
+                continue
+            self.counts["deleted"] += 1
+            yield {
+                "filename": os.path.basename(path),
+                "language": record["language"],
+                "content": f"[Deleted file: {os.path.basename(path)}]",
+                "full_path": path,
+                "change": "deleted"
+            }
+
+    def keep_unseen(self):
+        """Carry the previous records of unseen files over, e.g. when the walk stopped early on a budget."""
+        for path, record in self.previous.items():
+            self.current.setdefault(path, record)
+
+    def load(self):
+        """Load the previous manifest, ignoring a missing or corrupt file."""
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {}
+
+    def save(self):
+        """Persist this run's manifest for the next delta run."""
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.current, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def summary(self):
+        """Counts of added, modified, deleted and unchanged files for the run's stats."""
+        return dict(self.counts)
+
+def get_delta_tracker(profile_name):
+    """Create a DeltaTracker for a profile, loading the manifest of its last delta run."""
+    return DeltaTracker(os.path.join(CACHE_DIR, safe_file_name(profile_name) + ".manifest.json"))
+
+# -----------------------
+# HELPER: PIPELINE METRICS
+# -----------------------
+METRIC_PHASES = ("traversal", "exclusion", "read", "decode", "tokenize", "serialize", "write")
+METRIC_COUNTS = ("dirs_visited", "dirs_excluded", "files_excluded", "files", "files_read",
+                 "binaries_skipped", "errors")
+METRIC_BYTES = ("read", "written")
+
+class PipelineMetrics:
+    """Durations, counters and byte totals for each phase of one aggregation run.
+
+    Reads, decoding and tokenizing happen on worker threads, so those durations are summed
+    across threads and can add up to more than the run's wall time.
+    `data` is the JSON-ready view; it keeps filling in until finish() is called.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.data = {
+            "wall_seconds": None,
+            "seconds": dict.fromkeys(METRIC_PHASES, 0.0),
+            "counts": dict.fromkeys(METRIC_COUNTS, 0),
+            "bytes": dict.fromkeys(METRIC_BYTES, 0)
+        }
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.data["seconds"][phase] += seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.data["counts"][name] += n
+
+    def add_bytes(self, name, n):
+        with self.lock:
+            self.data["bytes"][name] += n
+
+    def timed(self, phase, func):
+        """Wrap func so the time spent in it is charged to a phase."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(phase, time.perf_counter() - start)
+        return wrapper
+
+    def merge(self, data):
+        """Add the durations, counts and bytes of another run's `data` (e.g. from a worker process)."""
+        with self.lock:
+            for section in ("seconds", "counts", "bytes"):
+                for name, value in data[section].items():
+                    self.data[section][name] += value
+
+    def finish(self):
+        """Record the wall time of the run and return `data`."""
+        self.data["wall_seconds"] = time.perf_counter() - self.started
+        return self.data
+
+# -----------------------
+# HELPER: OUTPUT FORMATS
+# -----------------------
+class OutputFormat:
+    """An output encoding: a header, one chunk per entry (given whether it is the first) and a footer (given whether there were no entries).
+
+    `stream_entry` encodes an entry whose content is a MappedText as a series of chunks instead.
+    """
+
+    def __init__(self, header, encode_entry, footer, extension, mimetype, stream_entry):
+        self.header = header
+        self.encode_entry = encode_entry
+        self.footer = footer
+        self.extension = extension
+        self.mimetype = mimetype
+        self.stream_entry = stream_entry
+
+# Stands in for streamed content while the rest of an entry is encoded
+CONTENT_PLACEHOLDER = "\x00collate-content\x00"
+
+def encode_json_entry(entry, first):
+    """Indented JSON array element; joins to exactly json.dumps(entries, indent=2)."""
+    # Newlines inside strings are escaped by json.dumps, so this only re-indents the structure
+    body = json.dumps(entry, indent=2).replace("\n", "\n  ")
+    return ("\n  " if first else ",\n  ") + body
+
+def encode_compact_entry(entry, first):
+    """Minified JSON array element with non-ASCII characters left unescaped."""
+    body = json.dumps(entry, separators=(",", ":"), ensure_ascii=False)
+    return body if first else "," + body
+
+def encode_ndjson_entry(entry, first):
+    """One minified JSON object per line."""
+    return json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+def encode_text_entry(entry, first):
+    """File header line followed by the raw, unescaped content."""
+    content = entry["content"]
+    if not content.endswith("\n"):
+        content += "\n"
+    return f"\n===== {entry['full_path']} ({entry['language']}) =====\n{content}"
+
+def stream_escaped_entry(encode_entry, escape):
+    """Build a stream_entry function that splices escaped content chunks into what encode_entry produces."""
+    def stream_entry(entry, first):
+        encoded = encode_entry({**entry, "content": CONTENT_PLACEHOLDER}, first)
+        head, tail = encoded.split(escape(CONTENT_PLACEHOLDER), 1)
+        yield head
+        for chunk in entry["content"].iter_chunks():
+            yield escape(chunk)
+        yield tail
+    return stream_entry
+
+def stream_text_entry(entry, first):
+    """encode_text_entry() for streamed content."""
+    yield f"\n===== {entry['full_path']} ({entry['language']}) =====\n"
+    last = ""
+    for chunk in entry["content"].iter_chunks():
+        yield chunk
+        last = chunk
+    if not last.endswith("\n"):
+        yield "\n"
+
+def escape_json_ascii(text):
+    return json.dumps(text)[1:-1]
+
+def escape_json(text):
+    return json.dumps(text, ensure_ascii=False)[1:-1]
+
+OUTPUT_FORMATS = {
+    "json": OutputFormat("Current code below:\n[", encode_json_entry, lambda empty: "]" if empty else "\n]",
+                         ".json", "text/plain", stream_escaped_entry(encode_json_entry, escape_json_ascii)),
+    "compact": OutputFormat("Current code below:\n[", encode_compact_entry, lambda empty: "]",
+                            ".json", "text/plain", stream_escaped_entry(encode_compact_entry, escape_json)),
+    "ndjson": OutputFormat("", encode_ndjson_entry, lambda empty: "",
+                           ".ndjson", "application/x-ndjson", stream_escaped_entry(encode_ndjson_entry, escape_json)),
+    "text": OutputFormat("Current code below:\n", encode_text_entry, lambda empty: "",
+                         ".txt", "text/plain", stream_text_entry)
+}
+
+def iter_aggregated_chunks(entries, output_format=DEFAULT_OUTPUT_FORMAT, sizes=None, measure_all=False,
+                           metrics=None):
+    """Yield the entries encoded in an output format, one entry at a time.
+
+    For the default "json" format the chunks join to exactly
+    "Current code below:\\n" + json.dumps(entries, indent=2).
+    If a sizes dict is passed, the UTF-8 byte size of the output is recorded in it under the
+    format's name, and with measure_all the size every other format would have had as well.
+    Encoding time is charged to the "serialize" phase of `metrics`, if given.
+    Entries whose content is a MappedText are decoded and escaped chunk by chunk.
+    """
+    measured = OUTPUT_FORMATS if measure_all else {output_format: OUTPUT_FORMATS[output_format]}
+    totals = {name: len(fmt.header.encode("utf-8")) for name, fmt in measured.items()}
+    fmt = OUTPUT_FORMATS[output_format]
+
+    yield fmt.header
+    first = True
+    for entry in entries:
+        if isinstance(entry["content"], MappedText):
+            yield from iter_streamed_entry(entry, first, output_format, measured,
+                                           totals if sizes is not None else None, metrics)
+            first = False
+            continue
+        start = time.perf_counter()
+        chunk = fmt.encode_entry(entry, first)
+        if sizes is not None:
+            for name, other in measured.items():
+                encoded = chunk if name == output_format else other.encode_entry(entry, first)
+                totals[name] += len(encoded.encode("utf-8"))
+        if metrics is not None:
+            metrics.add_time("serialize", time.perf_counter() - start)
+        yield chunk
+        first = False
+    footer = fmt.footer(first)
+    yield footer
+
+    if sizes is not None:
+        for name, other in measured.items():
+            totals[name] += len(other.footer(first).encode("utf-8"))
+        sizes.update(totals)
+
+def iter_streamed_entry(entry, first, output_format, measured, totals=None, metrics=None):
+    """Yield the chunks of an entry with MappedText content, adding their sizes to `totals` if given."""
+    if totals is not None:
+        for name, other in measured.items():
+            if name != output_format:
+                totals[name] += sum(len(chunk.encode("utf-8")) for chunk in other.stream_entry(entry, first))
+
+    chunks = OUTPUT_FORMATS[output_format].stream_entry(entry, first)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is not None and totals is not None:
+            totals[output_format] += len(chunk.encode("utf-8"))
+        if metrics is not None:
+            metrics.add_time("serialize", time.perf_counter() - start)
+        if chunk is None:
+            return
+        yield chunk
+
+def get_output_format(profile_name, output_format=None):
+    """Resolve the output format for a run: explicit choice, then the profile's "format" setting, then the default."""
+    if output_format is None:
+        output_format = get_profile_setting(profile_name, "format", DEFAULT_OUTPUT_FORMAT)
+    return output_format
+
+# -----------------------
+# HELPER: COMPRESSED ARTIFACTS
+# -----------------------
+# Available compressions and their file extensions, in order of preference for HTTP responses
+COMPRESSIONS = {
+    "zstd": ".zst",
+    "gzip": ".gz"
+}
+
+def available_compressions():
+    """Names of the compressions usable here (zstd needs the optional zstandard package)."""
+    return [name for name in COMPRESSIONS if name != "zstd" or zstandard is not None]
+
+def make_compressor(compression):
+    """Create a streaming compressor with compress(data) and flush() methods, both returning bytes."""
+    if compression == "gzip":
+        # wbits=31 adds the gzip header and trailer, so the stream is a valid .gz file
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    if compression == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"Unsupported compression: {compression}")
+
+def iter_compressed(chunks, compression):
+    """Compress a stream of text chunks, yielding compressed bytes as the compressor produces them."""
+    compressor = make_compressor(compression)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+class OutputArtifact:
+    """The file a generate run writes its output to, used as a context manager.
+
+    Without compression this is the plain 'aggregated_files.<ext>' in the working directory,
+    overwritten on every run. With compression, chunks are compressed as they are written to
+    ARTIFACT_DIR/<profile>-<timestamp><ext><.gz|.zst>; the file only appears under that name
+    once it is complete, and the profile's oldest artifacts beyond `keep` are then deleted.
+    """
+
+    def __init__(self, profile_name, output_format=DEFAULT_OUTPUT_FORMAT, compression=None, keep=None):
+        self.profile_name = profile_name
+        self.compression = compression
+        self.keep = keep
+        extension = OUTPUT_FORMATS[output_format].extension
+        if compression is None:
+            self.path = "aggregated_files" + extension
+        else:
+            if compression not in available_compressions():
+                raise ValueError(f"Unsupported compression: {compression}")
+            now = time.time()
+            timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+            self.path = os.path.join(ARTIFACT_DIR, f"{safe_file_name(profile_name)}-{timestamp}{extension}"
+                                                   f"{COMPRESSIONS[compression]}")
+        self.bytes_written = 0
+        self._file = None
+        self._compressor = None
+
+    def __enter__(self):
+        if self.compression is None:
+            self._file = open(self.path, "w", encoding="utf-8")
+        else:
+            os.makedirs(ARTIFACT_DIR, exist_ok=True)
+            self._compressor = make_compressor(self.compression)
+            self._file = open(self.path + ".tmp", "wb")
+        return self
+
+    def write(self, chunk):
+        """Write (and compress, if enabled) one chunk of output text."""
+        if self._compressor is None:
+            self._file.write(chunk)
+            return
+        data = self._compressor.compress(chunk.encode("utf-8"))
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._compressor is None:
+            self._file.close()
+            return
+        if exc_type is not None:
+            self._file.close()
+            os.remove(self.path + ".tmp")
+            return
+        data = self._compressor.flush()
+        self._file.write(data)
+        self.bytes_written += len(data)
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+        if self.keep is not None:
+            prune_artifacts(self.profile_name, self.keep)
+
+    def summary(self):
+        """Where the output went, for the run's stats."""
+        summary = {"path": self.path, "compression": self.compression}
+        if self.compression is not None:
+            summary["compressed_bytes"] = self.bytes_written
+        return summary
+
+def open_output_artifact(profile_name, output_format=DEFAULT_OUTPUT_FORMAT, compression=None):
+    """Create the OutputArtifact for a run, using the profile's "compression" and "artifacts_keep" settings.
+
+    An explicit compression of "none" writes the plain file even if the profile sets one.
+    """
+    if compression is None:
+        compression = get_profile_setting(profile_name, "compression")
+    if compression == "none":
+        compression = None
+    keep = get_profile_setting(profile_name, "artifacts_keep", DEFAULT_ARTIFACT_KEEP)
+    return OutputArtifact(profile_name, output_format, compression, keep)
+
+def iter_written_output(profile_name, chunks, stats, sizes, output_format=DEFAULT_OUTPUT_FORMAT, metrics=None,
+                        compression=None):
+    """Yield a run's output chunks while writing them to its output artifact (see open_output_artifact()).
+
+    `stats` and `sizes` are the dicts the chunks' producer fills in; once the chunks are
+    exhausted, stats["output"] is completed and the run's `metrics` are finished.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    with open_output_artifact(profile_name, output_format, compression) as artifact:
+        write = metrics.timed("write", artifact.write)
+        for chunk in chunks:
+            write(chunk)
+            yield chunk
+    stats["output"] = {"format": output_format, "bytes": sizes, "artifact": artifact.summary()}
+    metrics.add_bytes("written", sizes[output_format])
+    metrics.finish()
+
+def list_artifacts(profile_name):
+    """Paths of a profile's compressed artifacts, oldest first."""
+    # Matching the whole timestamp keeps e.g. profile "a" from picking up the artifacts of "a-1"
+    artifact_re = re.compile(re.escape(safe_file_name(profile_name)) + r"-\d{8}-\d{6}-\d{3}\.[^-]+$")
+    try:
+        names = os.listdir(ARTIFACT_DIR)
+    except OSError:
+        return []
+    # The timestamp format sorts chronologically
+    names = sorted(name for name in names if artifact_re.match(name) and not name.endswith(".tmp"))
+    return [os.path.join(ARTIFACT_DIR, name) for name in names]
+
+def prune_artifacts(profile_name, keep):
+    """Delete a profile's oldest compressed artifacts so at most `keep` remain; returns the deleted paths."""
+    artifacts = list_artifacts(profile_name)
+    deleted = artifacts[:max(len(artifacts) - keep, 0)]
+    for path in deleted:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return deleted
+
+# -----------------------
+# HELPER: AGGREGATE FILES
+# -----------------------
+def aggregate_files(profile_name, stats=None, workers=None, budget=None, tokenizer=None,
+                    output_format=None, measure_all=False, dedup=None, gitignore=None, metrics=None, processes=None,
+                    rank=None, query=None, search=None):
+    """Read each file or directory for a profile, respecting exclusions, and return a combined JSON-like string.
+
+    The output is encoded in `output_format` (the profile's "format" setting by default; see
+    OUTPUT_FORMATS). Its byte size, and with measure_all the size of every other format,
+    is recorded in stats["output"]. See iter_profile_chunks() for the other arguments.
+    """
+    output_format = get_output_format(profile_name, output_format)
+    sizes = {}
+    if metrics is None:
+        metrics = PipelineMetrics()
+    chunks = iter_profile_chunks(profile_name, output_format, stats, sizes, metrics, measure_all, processes,
+                                 workers=workers, budget=budget, tokenizer=tokenizer, dedup=dedup, gitignore=gitignore,
+                                 rank=rank, query=query, search=search)
+    combined = "".join(chunks)
+    metrics.finish()
+    if stats is not None:
+        stats["output"] = {"format": output_format, "bytes": sizes}
+    return combined
+
+def choose_processes(profile_name, processes=None, delta=False, measure_all=False):
+    """Decide how many worker processes a run uses, or 0 for the thread-based pipeline.
+
+    `processes` defaults to the profile's "processes" setting. Process-pool mode can't produce
+    delta output or measure the other output formats (measure_all): asking for processes
+    together with either is a ValueError, while a profile's "processes" setting falls back to threads.
+    """
+    explicit = processes is not None
+    if processes is None:
+        processes = get_profile_setting(profile_name, "processes")
+    if not processes:
+        return 0
+    unsupported = [name for name, used in (("delta", delta), ("compare_formats", measure_all)) if used]
+    if unsupported:
+        if explicit:
+            raise ValueError(f"processes can't be combined with {' or '.join(unsupported)}")
+        return 0
+    return int(processes)
+
+def iter_profile_chunks(profile_name, output_format=None, stats=None, sizes=None, metrics=None, measure_all=False,
+                        processes=None, **options):
+    """Return an iterator over a profile's aggregated output, from worker processes or threads.
+
+    This is where every caller picks the pipeline: with processes (see choose_processes()) the
+    output comes from iter_process_pool_chunks(), otherwise from iter_aggregated_chunks() over
+    iter_profile_entries(). `options` are the keyword arguments of iter_profile_entries();
+    `workers` is only used by threads and `delta` only without processes.
+    Raises ValueError straight away (not on first iteration) for unsupported combinations.
+    """
+    processes = choose_processes(profile_name, processes, options.get("delta", False), measure_all)
+    if processes:
+        options.pop("workers", None)
+        options.pop("delta", None)
+        return iter_process_pool_chunks(profile_name, processes, output_format, stats, sizes=sizes, metrics=metrics,
+                                        **options)
+    entries = iter_profile_entries(profile_name, stats, metrics=metrics, **options)
+    return iter_aggregated_chunks(entries, get_output_format(profile_name, output_format), sizes, measure_all,
+                                  metrics)
+
+class AggregationRun:
+    """The options and shared state of one run over a profile's files, for both pipelines.
+
+    Options left as None come from the profile's settings of the same name:
+    `budget` (get_profile_budget()) is charged before files are read, truncating or stopping the walk;
+    `tokenizer` counts each file's tokens (see TOKENIZERS);
+    `dedup` turns repeated content into references to its first copy (see ContentDeduplicator);
+    `gitignore` applies .gitignore files on top of the exclusions;
+    `rank` (also on with a `query`) picks the files that fit the budget by relevance (see iter_ranked_reads());
+    `search` keeps only the files containing all of its terms (see search_profile());
+    `search_index` keeps the profile's SearchIndex up to date (see uses_search_index()).
+    `delta` only yields files changed since the last delta run (see DeltaTracker), phases are
+    timed in `metrics` (a new PipelineMetrics by default) and the run's stats go in `stats`.
+    """
+
+    def __init__(self, profile_name, stats=None, budget=None, tokenizer=None, dedup=None, gitignore=None,
+                 metrics=None, delta=False, rank=None, query=None, search=None, search_index=None,
+                 directories=None):
+        self.profile_name = profile_name
+        self.stats = stats
+        self.budget = budget if budget is not None else get_profile_budget(profile_name)
+        if tokenizer is None:
+            tokenizer = get_profile_setting(profile_name, "tokenizer", DEFAULT_TOKENIZER)
+        self.tokenizer = tokenizer
+        if dedup is None:
+            dedup = get_profile_setting(profile_name, "dedup", False)
+        self.deduplicator = ContentDeduplicator() if dedup else None
+        self.tracker = get_delta_tracker(profile_name) if delta else None
+        if gitignore is None:
+            gitignore = get_profile_setting(profile_name, "gitignore", False)
+        self.gitignore = gitignore
+        if rank is None:
+            rank = bool(query) or get_profile_setting(profile_name, "rank", False)
+        self.rank = rank
+        self.query = query
+        self.search = search
+        self.directories = directories
+        self.index = get_search_index(profile_name) if uses_search_index(profile_name, search_index) else None
+        self.reindexed = 0
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.cache = get_file_cache(profile_name).start_run()
+        self.file_tokens = {}
+        self.seen_paths = set()
+        self.stopped = False
+
+    def iter_files_to_read(self):
+        """Walk the profile and yield (path, stat, limit) for the files to read, within the budget.
+
+        Only search hits are kept with `search`, and with `rank` the most relevant files are
+        picked instead of the first ones in walk order.
+        """
+        walk = iter_file_paths(get_profile_paths(self.profile_name), get_exclusion_matcher(self.profile_name),
+                               self.gitignore, self.metrics, directories=self.directories)
+        if self.search:
+            walk = filter_search_hits(self.profile_name, walk, self.search, self.stats)
+        if self.rank:
+            return iter_ranked_reads(self.profile_name, walk, self.budget, self.query, self.stats, self.tokenizer)
+        return iter_budgeted_reads(walk, self.budget, get_token_lookup(self.profile_name, self.tokenizer))
+
+    def fit(self, entry, st, limit, tokens):
+        """Charge a loaded file's actual token count against the budget, in walk order.
+
+        Returns (entry, tokens). A file that goes over max_total_tokens is cut down to the
+        tokens left (see cut_to_tokens()), re-read here if `entry` is a summary without
+        content from a worker process; after it, the run is stopped and (None, 0) is returned.
+        """
+        if self.stopped:
+            return None, 0
+        if self.budget.take(tokens):
+            return entry, tokens
+        self.stopped = True
+        self.budget.exhausted = True
+        if "content" not in entry:
+            entry = load_file_entry(entry["full_path"], st=st, limit=limit)[0]
+        entry, tokens = cut_to_tokens(entry, st.st_size if st is not None else None, limit,
+                                      self.budget.tokens_left(), TOKENIZERS[self.tokenizer])
+        if entry is not None:
+            self.budget.take(tokens)
+            if limit is None:
+                self.budget.truncated_files += 1
+        return entry, tokens
+
+    def count_file(self, entry):
+        """Count a loaded file in the run's metrics."""
+        self.metrics.count("files")
+        if entry["language"] == "Binary":
+            self.metrics.count("binaries_skipped")
+        elif entry["language"] == "Error":
+            self.metrics.count("errors")
+
+    @property
+    def complete(self):
+        """Whether the run read every file of the profile, and so knows which ones are gone.
+
+        One that stopped early on the budget, or only read ranked files or search hits, may
+        have skipped existing files.
+        """
+        return not (self.search or self.rank or self.budget.exhausted)
+
+    def finish(self):
+        """Persist the caches and record the run's stats once every file was loaded."""
+        if self.index is not None:
+            if self.complete:
+                self.index.remove_unseen(self.seen_paths)
+            self.index.save()
+        self.cache.cache.save()
+        stats = self.stats
+        if stats is None:
+            return
+        stats["cache"] = self.cache.summary()
+        stats["budget"] = self.budget.summary()
+        if self.deduplicator is not None:
+            stats["dedup"] = self.deduplicator.summary(self.file_tokens, TOKENIZERS[self.tokenizer])
+        if self.tracker is not None:
+            stats["delta"] = self.tracker.summary()
+        if self.index is not None:
+            stats["search_index"] = {**self.index.summary(), "reindexed": self.reindexed}
+        stats["tokens"] = {
+            "tokenizer": self.tokenizer,
+            "total": sum(self.file_tokens.values()),
+            "files": self.file_tokens
+        }
+        stats["metrics"] = self.metrics.data
+
+def iter_profile_entries(profile_name, stats=None, workers=None, budget=None, tokenizer=None, dedup=None,
+                         gitignore=None, metrics=None, delta=False, rank=None, query=None, search=None,
+                         search_index=None, signatures=None, directories=None):
+    """Yield the aggregated data entry of each file in a profile, in walk order.
+
+    Files are read by `workers` threads (the profile's "workers" setting by default); the
+    other options are AggregationRun's. `signatures` and `directories` dicts, if given, get the
+    (mtime_ns, size) of each file yielded and the mtime_ns of each directory listed.
+    """
+    if workers is None:
+        workers = get_profile_setting(profile_name, "workers", DEFAULT_WORKERS)
+    run = AggregationRun(profile_name, stats, budget, tokenizer, dedup, gitignore, metrics, delta, rank, query,
+                         search, search_index, directories)
+    tokenizer = run.tokenizer
+    metrics = run.metrics
+    cache = run.cache
+    file_tokens = run.file_tokens
+    index = run.index
+    tracker = run.tracker
+    deduplicator = run.deduplicator
+
+    def emit(entry, st, limit, loaded):
+        run.count_file(entry)
+        if signatures is not None and st is not None:
+            signatures[entry["full_path"]] = (st.st_mtime_ns, st.st_size)
+        if index is not None:
+            # Indexed as loaded, even if the token budget cut it down
+            run.seen_paths.add(entry["full_path"])
+            if index.add_entry(loaded, st):
+                run.reindexed += 1
+        if tracker is not None:
+            path = entry["full_path"]
+            entry = tracker.process(entry, st, limit)
+            if entry is None:
+                # Unchanged since the last delta run, so not part of this run's output
+                del file_tokens[path]
+                return None
+        return deduplicator.process(entry) if deduplicator else entry
+
+    files_to_read = run.iter_files_to_read()
+
+    def iter_loaded():
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # Keep a bounded window of reads in flight so results can be streamed in order
+                pending = deque()
+                for file_path, st, limit in files_to_read:
+                    pending.append((file_path, st, limit, pool.submit(load_file_entry, file_path, cache, st, limit,
+                                                                      tokenizer, metrics)))
+                    if len(pending) >= workers * 4:
+                        done_path, done_st, done_limit, future = pending.popleft()
+                        entry, file_tokens[done_path] = future.result()
+                        yield entry, done_st, done_limit
+                while pending:
+                    done_path, done_st, done_limit, future = pending.popleft()
+                    entry, file_tokens[done_path] = future.result()
+                    yield entry, done_st, done_limit
+        else:
+            for file_path, st, limit in files_to_read:
+                entry, file_tokens[file_path] = load_file_entry(file_path, cache, st, limit, tokenizer, metrics)
+                yield entry, st, limit
+
+    try:
+        for loaded, st, limit in iter_loaded():
+            path = loaded["full_path"]
+            entry, file_tokens[path] = run.fit(loaded, st, limit, file_tokens[path])
+            if entry is None:
+                del file_tokens[path]
+                break
+            entry = emit(entry, st, limit, loaded)
+            if entry is not None:
+                yield entry
+    finally:
+        cache.finish()
+
+    if tracker is not None:
+        if run.complete:
+            yield from tracker.iter_deleted()
+        else:
+            tracker.keep_unseen()
+        tracker.save()
+    run.finish()
+
+def iter_budgeted_reads(files, budget, known_tokens=None):
+    """Charge each (path, stat) pair against the budget and yield (path, stat, limit).
+
+    `limit` is the number of bytes to read for truncated files and None otherwise.
+    Files are charged with their token count from `known_tokens` (see get_token_lookup()),
+    if given and known, and an estimate from their size otherwise.
+    Stops pulling from the walk as soon as the budget is exhausted.
+    """
+    for file_path, st in files:
+        # Files that are never opened (binaries) cost nothing
+        if st is None:
+            yield file_path, st, None
+            continue
+        limit = budget.allot(st.st_size, known_tokens(file_path, st) if known_tokens else None)
+        if limit == 0:
+            return
+        yield file_path, st, limit
+        if budget.exhausted:
+            return
+
+def iter_file_paths(file_paths, exclusion_matcher, gitignore=False, metrics=None, pruned=None, directories=None):
+    """Walk the profile paths and yield (path, stat) pairs for the files to aggregate, in a deterministic order.
+
+    The stat is None for files that won't be opened (known binary extensions) or can't be stat'ed.
+    With `gitignore`, .gitignore files under each directory path are honoured (see walk_directory()).
+    If a `pruned` dict is given, excluded directories are recorded in it (see record_pruned()),
+    and a `directories` dict gets the mtime_ns of each directory listed.
+    """
+    for path in file_paths:
+        # Check if path is a directory
+        if os.path.isdir(path):
+            # Process directory recursively
+            if not should_exclude_dir(path, exclusion_matcher):
+                yield from walk_directory(path, exclusion_matcher, gitignore, metrics, pruned, directories)
+            elif pruned is not None:
+                record_pruned(pruned, path, exclusion_matcher)
+        else:
+            # Process single file if it's not excluded
+            if not should_exclude(path, exclusion_matcher):
+                yield path, stat_file(path)
+
+def walk_directory(root, exclusion_matcher, gitignore=False, metrics=None, pruned=None, directories=None):
+    """Yield (path, stat) for the files under root, in the same top-down order as os.walk.
+
+    Uses os.scandir so directory/file checks reuse the DirEntry type data, excluded
+    directories (see should_exclude_dir()) are pruned before descending, and hidden files
+    and known binary extensions are skipped without a stat call.
+    With `gitignore`, the .gitignore files found along the way are applied as well, so
+    ignored subtrees are never entered.
+    Listing and stat time, exclusion checks and directory counts are recorded in `metrics`, if given.
+    Pruned directories are recorded in `pruned`, if given (see record_pruned()).
+    The mtime_ns of each directory listed is recorded in `directories`, if given, so callers can
+    tell when entries were added to or removed from it since.
+    """
+    def is_excluded(path, is_dir, gitignores):
+        start = time.perf_counter()
+        matched = should_exclude_dir(path, exclusion_matcher) if is_dir else should_exclude(path, exclusion_matcher)
+        excluded = matched
+        if not excluded and gitignores:
+            excluded = is_gitignored(path, is_dir, gitignores)
+        if metrics is not None:
+            metrics.add_time("exclusion", time.perf_counter() - start)
+            if excluded:
+                metrics.count("dirs_excluded" if is_dir else "files_excluded")
+        if excluded and is_dir and pruned is not None:
+            record_pruned(pruned, path, exclusion_matcher if matched else None)
+        return excluded
+
+    stack = [(root, ())]
+    while stack:
+        directory, gitignores = stack.pop()
+        start = time.perf_counter()
+        try:
+            # Stat before listing, so an entry added in between shows up as a later change
+            if directories is not None:
+                directories[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        if metrics is not None:
+            metrics.add_time("traversal", time.perf_counter() - start)
+            metrics.count("dirs_visited")
+
+        if gitignore and any(entry.name == GITIGNORE_FILE for entry in entries):
+            rules = load_gitignore(directory)
+            if rules is not None:
+                gitignores = gitignores + (rules,)
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                # Like os.walk, don't descend into symlinked directories
+                if not entry.is_symlink() and not is_excluded(entry.path, True, gitignores):
+                    subdirs.append((entry.path, gitignores))
+                continue
+
+            # Skip hidden files and excluded paths
+            if entry.name.startswith('.') or is_excluded(entry.path, False, gitignores):
+                continue
+            if os.path.splitext(entry.name)[1].lower() in BINARY_EXTENSIONS:
+                yield entry.path, None
+                continue
+            start = time.perf_counter()
+            try:
+                st = entry.stat()
+            except OSError:
+                st = None
+            if metrics is not None:
+                metrics.add_time("traversal", time.perf_counter() - start)
+            yield entry.path, st
+
+        # Push in reverse so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+def stat_file(path):
+    """Stat a file, returning None if it can't be accessed."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def should_exclude(path, exclusion_matcher):
+    """Check if a path matches any exclusion pattern."""
+    return exclusion_matcher.matches(path)
+
+def should_exclude_dir(path, exclusion_matcher):
+    """Check if a directory matches any exclusion pattern, with or without a trailing separator.
+
+    Patterns like "/node_modules/" only match the directory's contents otherwise, so the
+    walk would descend into it just to exclude every file one by one.
+    """
+    return should_exclude(path, exclusion_matcher) or should_exclude(os.path.join(path, ""), exclusion_matcher)
+
+def record_pruned(pruned, path, exclusion_matcher=None):
+    """Add an excluded directory to `pruned`, keyed by the exclusion pattern that matched it.
+
+    Directories skipped because of a .gitignore (no matcher given) are keyed by GITIGNORE_FILE.
+    """
+    pattern = GITIGNORE_FILE
+    if exclusion_matcher is not None:
+        pattern = (exclusion_matcher.matching_pattern(path)
+                   or exclusion_matcher.matching_pattern(os.path.join(path, "")))
+    pruned.setdefault(pattern, []).append(path)
+
+def process_file(path, aggregated_data, cache=None, st=None, limit=None):
+    """Process a single file and add it to the aggregated data."""
+    aggregated_data.append(get_file_entry(path, cache, st, limit))
+
+def get_file_entry(path, cache=None, st=None, limit=None):
+    """Build the aggregated data entry for a file (see load_file_entry())."""
+    entry, _ = load_file_entry(path, cache, st, limit)
+    return entry
+
+def load_file_entry(path, cache=None, st=None, limit=None, tokenizer=None, metrics=None):
+    """Build the aggregated data entry for a file and return (entry, token count).
+
+    When a cache is given, unchanged files are served from it instead of being re-read.
+    A stat result from the walk can be passed to avoid stat'ing the file again.
+    If `limit` is set, only that many bytes are read and the content is marked as truncated.
+    The token count is None unless a tokenizer name is given.
+    Read, decode and tokenize time is recorded in `metrics`, if given.
+    """
+    count_tokens = TOKENIZERS[tokenizer] if tokenizer is not None else None
+    if count_tokens is not None and metrics is not None:
+        count_tokens = metrics.timed("tokenize", count_tokens)
+
+    if os.path.splitext(path)[1].lower() in BINARY_EXTENSIONS:
+        entry = read_file_entry(path)
+        return entry, count_tokens(entry["content"]) if count_tokens else None
+
+    if st is None:
+        st = stat_file(path)
+    # Large files are streamed from disk when the output is written, so they never enter the cache
+    if st is not None and min(st.st_size, limit if limit is not None else st.st_size) >= MMAP_THRESHOLD_BYTES:
+        loaded = load_mapped_entry(path, st, limit, count_tokens, metrics)
+        if loaded is not None:
+            return loaded
+
+    # Truncated reads depend on the budget, not just the file, so they bypass the cache
+    if cache is None or limit is not None:
+        entry = read_file_entry(path, st.st_size if st is not None else None, limit, metrics)
+        return entry, count_tokens(entry["content"]) if count_tokens else None
+
+    if st is not None:
+        record = cache.get(path, st)
+        if record is not None:
+            entry = record["entry"]
+            if count_tokens is None:
+                return entry, None
+            tokens = record["tokens"].get(tokenizer)
+            if tokens is None:
+                tokens = count_tokens(entry["content"])
+                cache.set_tokens(path, record, tokenizer, tokens)
+            return entry, tokens
+
+    entry = read_file_entry(path, st.st_size if st is not None else None, metrics=metrics)
+    tokens = count_tokens(entry["content"]) if count_tokens else None
+    # Read errors may be transient, so only successful reads are cached
+    if st is not None and entry["language"] != "Error":
+        cache.put(path, st, entry, {tokenizer: tokens} if count_tokens else None)
+    return entry, tokens
+
+def read_file_entry(path, size=None, limit=None, metrics=None):
+    """Read a single file from disk and build its aggregated data entry.
+
+    If the file size is already known, the read is issued for exactly that many bytes.
+    If `limit` is set, only that many bytes are read and a truncation marker is appended.
+    """
+    _, ext = os.path.splitext(path)
+    language = EXTENSION_MAP.get(ext.lower(), "Unknown")
+    
+    # Skip binary files and other non-text formats
+    if ext.lower() in BINARY_EXTENSIONS:
+        return {
+            "filename": os.path.basename(path),
+            "language": "Binary",
+            "content": f"[Binary file: {os.path.basename(path)}]",
+            "full_path": path
+        }
+
+    try:
+        # Try to read as text
+        content = read_text(path, size, limit, metrics)
+        if content is None:
+            # Sniffing the first block showed the file is binary
+            return {
+                "filename": os.path.basename(path),
+                "language": "Binary",
+                "content": f"[Binary file: {os.path.basename(path)}]",
+                "full_path": path
+            }
+        if limit is not None:
+            content += f"\n[Truncated: {os.path.basename(path)} is {size} bytes, only the first {limit} bytes are included]"
+        return {
+            "filename": os.path.basename(path),
+            "language": language,
+            "content": content,
+            "full_path": path
+        }
+    except UnicodeDecodeError:
+        # Handle case where the file is binary but doesn't have a recognized extension
+        return {
+            "filename": os.path.basename(path),
+            "language": "Binary",
+            "content": f"[Binary file: {os.path.basename(path)}]",
+            "full_path": path
+        }
+    except Exception as e:
+        # Handle other errors
+        return {
+            "filename": os.path.basename(path),
+            "language": "Error",
+            "content": f"Could not read file: {e}",
+            "full_path": path
+        }
+
+def read_text(path, size=None, limit=None, metrics=None):
+    """Read a text file, translating newlines the same way text-mode open() does.
+
+    The first block is sniffed before anything else is read, and None is returned if it
+    looks binary. If `limit` is set, at most that many bytes are read and a trailing
+    partial character is dropped. Raises UnicodeDecodeError for undecodable files.
+    """
+    start = time.perf_counter()
+    with open(path, "rb", buffering=0) as file:
+        data = file.read(SNIFF_BYTES if limit is None else min(SNIFF_BYTES, limit))
+        encoding = sniff_encoding(data)
+        if encoding is None:
+            return None
+
+        if limit is not None:
+            if len(data) < limit:
+                data += file.read(limit - len(data))
+        elif size is None:
+            data += file.read()
+        else:
+            # One read sized from the walk's stat; read on only if the file grew since
+            data += file.read(max(size - len(data), 0) + 1)
+            if len(data) > size:
+                data += file.read()
+    if metrics is not None:
+        metrics.add_time("read", time.perf_counter() - start)
+        metrics.count("files_read")
+        metrics.add_bytes("read", len(data))
+
+    start = time.perf_counter()
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        return translate_newlines(decoder.decode(data, final=limit is None))
+    finally:
+        if metrics is not None:
+            metrics.add_time("decode", time.perf_counter() - start)
+
+def sniff_encoding(head):
+    """Classify a file from its first block, returning the codec to decode it with or None if it is binary."""
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    if head.startswith(BINARY_SIGNATURES) or b"\x00" in head:
+        return None
+
+    # Lots of control characters means binary data, even if it happens to decode
+    # bytes.translate() deletes them in C, so counting doesn't loop over the block in Python
+    control_bytes = len(head) - len(head.translate(None, BINARY_CONTROL_BYTES))
+    if control_bytes * 10 > len(head):
+        return None
+
+    # Undecodable bytes in the first block mean the full decode would fail anyway
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return None
+    return "utf-8"
+
+def translate_newlines(content):
+    """Translate \\r\\n and \\r to \\n, matching text-mode open()."""
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    return content
+
+# -----------------------
+# HELPER: MANIFEST
+# -----------------------
+def build_manifest(profile_name, budget=None, gitignore=None, tokenizer=None):
+    """List the files a generate run would pick up for a profile, without reading any of them.
+
+    Uses the same walk, exclusions and read budget as iter_profile_entries(), but only the
+    stat results from the walk, so it is cheap enough to run after every exclusion change.
+    Token counts are the ones already known for the profile's tokenizer (see get_token_lookup())
+    and otherwise projected from file sizes (BYTES_PER_TOKEN), like the budget's charges.
+    Binary files are listed but count no bytes or tokens, since they are never read.
+    Returns the file list, per-language counts, totals and the directories pruned by each
+    exclusion pattern (or by .gitignore files).
+    """
+    file_paths = get_profile_paths(profile_name)
+    exclusion_matcher = get_exclusion_matcher(profile_name)
+    if budget is None:
+        budget = get_profile_budget(profile_name)
+    if gitignore is None:
+        gitignore = get_profile_setting(profile_name, "gitignore", False)
+    if tokenizer is None:
+        tokenizer = get_profile_setting(profile_name, "tokenizer", DEFAULT_TOKENIZER)
+    known_tokens = get_token_lookup(profile_name, tokenizer)
+    metrics = PipelineMetrics()
+    pruned = {}
+    files = []
+    languages = {}
+
+    walk = iter_file_paths(file_paths, exclusion_matcher, gitignore, metrics, pruned)
+    for file_path, st, limit in iter_budgeted_reads(walk, budget, known_tokens):
+        ext = os.path.splitext(file_path)[1].lower()
+        tokens = None
+        if ext in BINARY_EXTENSIONS:
+            language = "Binary"
+            size = 0
+        else:
+            language = EXTENSION_MAP.get(ext, "Unknown")
+            size = st.st_size if st is not None else 0
+            if limit is not None:
+                size = limit
+            elif st is not None:
+                tokens = known_tokens(file_path, st)
+        item = {
+            "path": file_path,
+            "language": language,
+            "bytes": size,
+            "tokens": tokens if tokens is not None else (size + BYTES_PER_TOKEN - 1) // BYTES_PER_TOKEN
+        }
+        if limit is not None:
+            item["truncated"] = True
+        files.append(item)
+        counts = languages.setdefault(language, {"files": 0, "bytes": 0, "tokens": 0})
+        counts["files"] += 1
+        counts["bytes"] += item["bytes"]
+        counts["tokens"] += item["tokens"]
+
+    metrics.count("files", len(files))
+    metrics.finish()
+    return {
+        "profile": profile_name,
+        "files": files,
+        "languages": languages,
+        "total_files": len(files),
+        "total_bytes": sum(item["bytes"] for item in files),
+        "projected_tokens": sum(item["tokens"] for item in files),
+        "budget": budget.summary(),
+        "pruned": pruned,
+        "metrics": metrics.data
+    }
+
+# -----------------------
+# HELPER: RELEVANCE RANKING
+# -----------------------
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]{2,}")
+
+# Import/reference statements: Python and Java imports, JS imports and requires, C/C++ includes, C# usings
+REFERENCE_RES = (
+    re.compile(r"^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import|import[ \t]+(?:static[ \t]+)?([\w.]+))", re.M),
+    re.compile(r"""(?:\bfrom[ \t]+|\brequire\([ \t]*|^[ \t]*import[ \t]+)['"]([^'"]+)['"]""", re.M),
+    re.compile(r"^[ \t]*#[ \t]*include[ \t]*\"([^\"]+)\"", re.M),
+    re.compile(r"^[ \t]*using[ \t]+(?:static[ \t]+)?([\w.]+)[ \t]*;", re.M)
+)
+
+# Extensions that are dropped from referenced file names (besides EXTENSION_MAP's)
+REFERENCE_EXTENSIONS = {".h", ".hpp", ".ts", ".tsx", ".jsx", ".mjs"}
+
+def reference_name(reference):
+    """Reduce an import/include target to the file stem it most likely refers to (e.g. "a.b.utils" -> "utils")."""
+    name = re.split(r"[/\\]", reference)[-1]
+    stem, ext = os.path.splitext(name)
+    if ext.lower() in EXTENSION_MAP or ext.lower() in REFERENCE_EXTENSIONS:
+        name = stem
+    else:
+        name = name.rsplit(".", 1)[-1]
+    return name.lower()
+
+def scan_file_features(path, size=None, tokenizer=None):
+    """Scan the head of a file for the file stems it references.
+
+    Returns {"refs": [...], "tokens": {...}}, refs lowercased; unreadable and binary files have
+    none. If the whole file was scanned, its search terms (see text_terms()) are included as
+    "terms" and its token count under `tokenizer` in "tokens", so ranking, search and budgets
+    can use them before the file is read.
+    """
+    whole = size is not None and size <= RANK_SCAN_BYTES
+    try:
+        text = read_text(path, size, None if whole else RANK_SCAN_BYTES)
+    except (OSError, UnicodeDecodeError):
+        text = None
+    if text is None:
+        return {"refs": [], "tokens": {}}
+    refs = set()
+    for reference_re in REFERENCE_RES:
+        for match in reference_re.finditer(text):
+            name = reference_name(next(group for group in match.groups() if group))
+            if name:
+                refs.add(name)
+    features = {"refs": sorted(refs), "tokens": {}}
+    if whole:
+        features["terms"] = sorted(text_terms((text,)))
+        if tokenizer is not None:
+            features["tokens"][tokenizer] = TOKENIZERS[tokenizer](text)
+    return features
+
+class FeatureCache:
+    """Per-file features for ranking and search, persisted and rescanned only when a file's (mtime, size) changes.
+
+    A record holds the file's references and token counts (from a ranking scan, see
+    scan_file_features()) and its search terms (from the scan, or set by the SearchIndex when
+    the file is read), all for one version of the file. Records are persisted in CACHE_SHARDS
+    JSON files under `cache_dir`, like the content cache, so a change only rewrites its shard.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.dirty_shards = set()
+        self.lock = threading.Lock()
+        self.load()
+
+    def get(self, path, st, tokenizer=None):
+        """Return the ranking features of a file, scanning it if they are missing or out of date.
+
+        A small file is also rescanned if its token count under `tokenizer` isn't known yet.
+        """
+        with self.lock:
+            record = self.entries.get(path)
+        if self.is_current(record, st, tokenizer):
+            return record
+        features = scan_file_features(path, st.st_size, tokenizer)
+        with self.lock:
+            record = self.entries.get(path)
+            if record is not None and record["mtime"] == st.st_mtime_ns and record["size"] == st.st_size:
+                # Keep what is already known about this version (e.g. terms of a file too big to scan whole)
+                features["tokens"] = {**record.get("tokens", {}), **features["tokens"]}
+                record = {**record, **features}
+            else:
+                record = {"mtime": st.st_mtime_ns, "size": st.st_size, **features}
+            self.entries[path] = record
+            self.dirty_shards.add(cache_shard(path))
+        return record
+
+    def refresh(self, files, tokenizer=None):
+        """Scan the (path, stat) pairs whose features are missing or out of date; returns how many were scanned."""
+        scanned = 0
+        for path, st in files:
+            with self.lock:
+                record = self.entries.get(path)
+            if self.is_current(record, st, tokenizer):
+                continue
+            self.get(path, st, tokenizer)
+            scanned += 1
+        return scanned
+
+    @staticmethod
+    def is_current(record, st, tokenizer=None):
+        return (record is not None and record["mtime"] == st.st_mtime_ns and record["size"] == st.st_size
+                and "refs" in record
+                and (tokenizer is None or st.st_size > RANK_SCAN_BYTES or tokenizer in record["tokens"]))
+
+    def known_tokens(self, path, st, tokenizer):
+        """Return the token count of path under tokenizer if it was scanned whole and is unchanged, else None."""
+        with self.lock:
+            record = self.entries.get(path)
+        if record is None or record["mtime"] != st.st_mtime_ns or record["size"] != st.st_size:
+            return None
+        return record.get("tokens", {}).get(tokenizer)
+
+    def known_terms(self, path, st):
+        """Return the search terms of path if they are known for its current version, else None."""
+        with self.lock:
+            record = self.entries.get(path)
+        if record is None or record["mtime"] != st.st_mtime_ns or record["size"] != st.st_size:
+            return None
+        return record.get("terms")
+
+    def set_terms(self, path, st, terms):
+        """Record the search terms of a version of a file, dropping features of any other version."""
+        with self.lock:
+            record = self.entries.get(path)
+            if record is None or record["mtime"] != st.st_mtime_ns or record["size"] != st.st_size:
+                record = {"mtime": st.st_mtime_ns, "size": st.st_size}
+                self.entries[path] = record
+            record["terms"] = sorted(terms)
+            self.dirty_shards.add(cache_shard(path))
+
+    def discard(self, path):
+        """Drop the features of a file (e.g. because it was deleted)."""
+        with self.lock:
+            if self.entries.pop(path, None) is not None:
+                self.dirty_shards.add(cache_shard(path))
+
+    def load(self):
+        """Load persisted features from disk, ignoring missing or corrupt shard files."""
+        self.entries = dict(load_cache_shards(self.cache_dir))
+
+    def save(self):
+        """Persist the shards that changed since the last save."""
+        with self.lock:
+            save_cache_shards(self.cache_dir, self.entries, self.dirty_shards)
+            self.dirty_shards.clear()
+
+# Loaded feature caches, keyed by profile name
+_feature_caches = {}
+_feature_caches_lock = threading.Lock()
+
+def get_feature_cache(profile_name):
+    """Get (loading on first use) the feature cache for a profile, shared by ranking and search."""
+    with _feature_caches_lock:
+        cache = _feature_caches.get(profile_name)
+        if cache is None:
+            cache = FeatureCache(os.path.join(CACHE_DIR, safe_file_name(profile_name) + ".features"))
+            _feature_caches[profile_name] = cache
+        return cache
+
+def percentiles(values):
+    """Rank-based position of each value in [0, 1] (ties share the lowest rank; a single value gets 1)."""
+    if len(values) < 2:
+        return [1.0] * len(values)
+    ordered = sorted(values)
+    positions = {}
+    for i, value in enumerate(ordered):
+        positions.setdefault(value, i)
+    return [positions[value] / (len(values) - 1) for value in values]
+
+def has_prefix(sorted_terms, prefix):
+    """Check if any of a sorted list of terms starts with prefix."""
+    i = bisect.bisect_left(sorted_terms, prefix)
+    return i < len(sorted_terms) and sorted_terms[i].startswith(prefix)
+
+def rank_files(profile_name, files, query=None, tokenizer=None):
+    """Score (path, stat) pairs by relevance and return [(score, signals), ...] in the same order.
+
+    Signals, each in [0, 1] and weighted by RANK_WEIGHTS: recency (mtime percentile), size
+    (smaller is better), keyword (share of the query's terms found in the path or the file's
+    search terms) and centrality (how many other files import or include it). Search terms
+    and references come from the profile's FeatureCache, so only changed files are scanned;
+    files too big to scan whole only have search terms once they have been read. Small files
+    also get their token count under `tokenizer` recorded there.
+    """
+    features = get_feature_cache(profile_name)
+    records = [features.get(path, st, tokenizer) for path, st in files]
+    features.save()
+
+    recency = percentiles([st.st_mtime for _, st in files])
+    size = [1.0 - p for p in percentiles([st.st_size for _, st in files])]
+
+    terms = list(dict.fromkeys(re.findall(r"\w+", query.lower()))) if query else []
+    keyword = []
+    for (path, _), record in zip(files, records):
+        if not terms:
+            keyword.append(0.0)
+            continue
+        lower_path = path.lower()
+        words = record.get("terms", [])
+        # A term in the file's path counts fully, one that starts a term used in the file counts half
+        hits = sum(1.0 if term in lower_path else 0.5 if has_prefix(words, term) else 0.0 for term in terms)
+        keyword.append(hits / len(terms))
+
+    # In-degree in the reference graph: other files that reference this file's stem
+    stems = [os.path.splitext(os.path.basename(path))[0].lower() for path, _ in files]
+    referenced_by = {}
+    for i, record in enumerate(records):
+        for ref in record["refs"]:
+            referenced_by.setdefault(ref, set()).add(i)
+    in_degree = [len(referenced_by.get(stem, set()) - {i}) for i, stem in enumerate(stems)]
+    max_degree = max(in_degree, default=0)
+    centrality = [math.log1p(d) / math.log1p(max_degree) if max_degree else 0.0 for d in in_degree]
+
+    ranked = []
+    for i in range(len(files)):
+        signals = {
+            "recency": recency[i],
+            "size": size[i],
+            "keyword": keyword[i],
+            "centrality": centrality[i]
+        }
+        ranked.append((sum(RANK_WEIGHTS[name] * value for name, value in signals.items()), signals))
+    return ranked
+
+def iter_ranked_reads(profile_name, files, budget, query=None, stats=None, tokenizer=None):
+    """Pick the highest-scoring files (see rank_files()) that fit the budget and yield (path, stat, limit).
+
+    Files are packed greedily by score: each one is taken if its (possibly truncated) size
+    and its token count under `tokenizer` (see get_token_lookup(), estimated from the size if
+    unknown) still fit the budget, otherwise it is skipped and smaller ones can still fill the
+    gap. The chosen files are yielded in walk order and charged against the budget as usual.
+    Binary and unreadable files are left out, since they carry no content.
+    If a stats dict is passed, the ranking's outcome is recorded in stats["ranking"].
+    """
+    candidates = [(path, st) for path, st in files if st is not None]
+    scanned = get_feature_cache(profile_name).refresh(candidates, tokenizer)
+    ranked = rank_files(profile_name, candidates, query, tokenizer)
+    known_tokens = get_token_lookup(profile_name, tokenizer)
+    tokens = [known_tokens(path, st) for path, st in candidates]
+
+    # Pack against a scratch copy of the budget, which is then charged for real as the files are read
+    packing = copy.copy(budget)
+    order = sorted(range(len(candidates)), key=lambda i: -ranked[i][0])
+    selected = []
+    for i in order:
+        size = candidates[i][1].st_size
+        # Staying strictly under the limits keeps the budget from reporting itself exhausted midway
+        if not packing.fits(size, tokens[i]):
+            continue
+        packing.allot(size, tokens[i])
+        selected.append(i)
+    selected.sort()
+
+    if stats is not None:
+        stats["ranking"] = {
+            "query": query,
+            "candidates": len(candidates),
+            "selected": len(selected),
+            "bytes": packing.bytes_used - budget.bytes_used,
+            "tokens": packing.tokens_used - budget.tokens_used,
+            "capacity_bytes": budget.remaining_bytes(),
+            "features_scanned": scanned,
+            "scores": {candidates[i][0]: round(ranked[i][0], 4) for i in selected}
+        }
+    return iter_budgeted_reads((candidates[i] for i in selected), budget, known_tokens)
+
+# -----------------------
+# HELPER: SEARCH INDEX
+# -----------------------
+# Parts (3+ characters) of camelCase, PascalCase and snake_case identifiers, so "brain" also finds AgentBrain
+SUBWORD_RE = re.compile(r"[A-Z][a-z]{2,}|[a-z]{3,}|[A-Z]{3,}(?![a-z])|[0-9]{3,}")
+
+# Stale ids are compacted out of the postings once they make up this share of all ids
+SEARCH_COMPACT_RATIO = 0.25
+
+def text_terms(chunks):
+    """The search terms of a text given as an iterable of strings: identifiers (3+ characters) and their word parts, lowercased."""
+    words = set()
+    for chunk in chunks:
+        words.update(IDENTIFIER_RE.findall(chunk))
+        # One pass over the whole text finds the same parts as splitting each identifier
+        words.update(SUBWORD_RE.findall(chunk))
+    return {word.lower() for word in words}
+
+def index_terms(entry):
+    """The search terms of a file entry (see text_terms())."""
+    if entry["language"] in ("Binary", "Error"):
+        return set()
+    return text_terms(iter_content_chunks(entry["content"]))
+
+def query_terms(query):
+    """Split a search query into the lowercased terms (identifiers of 3+ characters) that all have to match."""
+    return list(dict.fromkeys(word.lower() for word in IDENTIFIER_RE.findall(query or "")))
+
+def check_search_query(query):
+    """Return the terms of a search query, raising ValueError if it has none (e.g. only words under 3 characters)."""
+    terms = query_terms(query)
+    if not terms:
+        raise ValueError("Search query has no searchable terms (identifiers of at least 3 characters)")
+    return terms
+
+class SearchIndex:
+    """Inverted index (term -> file ids) over a profile's file contents.
+
+    The terms of each file are persisted in the profile's FeatureCache, which ranking scans fill
+    in as well, and the postings are built from it in memory, so a changed file only rewrites
+    its feature shard. Files are only re-tokenized when their (mtime, size) changed since they
+    were indexed. A changed file gets a new id rather than having its old postings removed, so
+    postings are only ever appended to; ids of old versions are skipped at query time and
+    compacted away once they make up SEARCH_COMPACT_RATIO of the index. Query terms match
+    every indexed term they are a prefix of (see search()).
+    `meta_file` keeps when the index last changed; it exists once the profile has been searched.
+    """
+
+    def __init__(self, features, meta_file):
+        self.features = features
+        self.meta_file = meta_file
+        self.files = {}
+        self.ids = {}
+        self.postings = {}
+        self.sorted_terms = []
+        self.terms_changed = False
+        self.next_id = 0
+        self.stale = 0
+        self.updated_at = None
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def is_current(self, path, st):
+        """Check if a file is indexed as of the given stat result."""
+        with self.lock:
+            file_id = self.ids.get(path)
+            return file_id is not None and self.files[file_id][1:] == [st.st_mtime_ns, st.st_size]
+
+    def add_entry(self, entry, st):
+        """Index a loaded file entry, unless it is already indexed as of `st`; returns whether it was (re)indexed.
+
+        Terms a ranking scan already found for this version of the file are reused.
+        """
+        path = entry["full_path"]
+        if st is None or self.is_current(path, st):
+            return False
+        terms = self.features.known_terms(path, st)
+        self.update(path, st, index_terms(entry) if terms is None else terms)
+        return True
+
+    def update(self, path, st, terms):
+        """(Re)index a file under the given terms."""
+        self.features.set_terms(path, st, terms)
+        with self.lock:
+            self._add(path, st.st_mtime_ns, st.st_size, terms)
+            self.dirty = True
+
+    def _add(self, path, mtime, size, terms):
+        self._discard(path)
+        file_id = self.next_id
+        self.next_id += 1
+        self.files[file_id] = [path, mtime, size]
+        self.ids[path] = file_id
+        postings = self.postings
+        for term in terms:
+            ids = postings.get(term)
+            if ids is None:
+                postings[term] = [file_id]
+                self.terms_changed = True
+            else:
+                ids.append(file_id)
+
+    def discard(self, path):
+        """Drop a file from the index (e.g. because it was deleted)."""
+        with self.lock:
+            self._discard(path)
+            self.dirty = True
+        self.features.discard(path)
+
+    def remove_unseen(self, seen_paths):
+        """Drop the files that a complete run of the profile didn't see (deleted or now excluded)."""
+        with self.lock:
+            unseen = [path for path in self.ids if path not in seen_paths]
+            for path in unseen:
+                self._discard(path)
+            self.dirty = self.dirty or bool(unseen)
+        for path in unseen:
+            self.features.discard(path)
+
+    def _discard(self, path):
+        file_id = self.ids.pop(path, None)
+        if file_id is not None:
+            del self.files[file_id]
+            self.stale += 1
+
+    def search(self, query):
+        """Return the paths of the files containing every term of the query, sorted.
+
+        Each query term matches the indexed terms that start with it, so "AgentBrain" also
+        finds AgentBrainController. Raises ValueError if the query has no usable terms.
+        """
+        terms = check_search_query(query)
+        with self.lock:
+            if self.terms_changed:
+                self.sorted_terms = sorted(self.postings)
+                self.terms_changed = False
+            matches = None
+            for term in terms:
+                start = bisect.bisect_left(self.sorted_terms, term)
+                end = bisect.bisect_left(self.sorted_terms, term + "\U0010ffff", start)
+                ids = set()
+                for indexed_term in self.sorted_terms[start:end]:
+                    ids.update(self.postings[indexed_term])
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+            return sorted(self.files[file_id][0] for file_id in matches if file_id in self.files)
+
+    def compact(self):
+        """Remove the ids of old file versions from the postings."""
+        postings = {}
+        for term, ids in self.postings.items():
+            ids = [file_id for file_id in ids if file_id in self.files]
+            if ids:
+                postings[term] = ids
+        self.postings = postings
+        self.terms_changed = True
+        self.stale = 0
+
+    def load(self):
+        """Build the postings from the terms in the feature cache and read when the index was last updated."""
+        for path, record in self.features.entries.items():
+            if "terms" in record:
+                self._add(path, record["mtime"], record["size"], record["terms"])
+        try:
+            with open(self.meta_file, "r", encoding="utf-8") as f:
+                self.updated_at = json.load(f)["updated_at"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.updated_at = None
+
+    def save(self):
+        """Persist the changed feature shards and the update time, compacting the postings first if needed.
+
+        Nothing is written if the index didn't change since it was last saved.
+        """
+        with self.lock:
+            if self.dirty or self.updated_at is None:
+                self.updated_at = time.time()
+                if self.stale > SEARCH_COMPACT_RATIO * (len(self.files) + self.stale):
+                    self.compact()
+                os.makedirs(os.path.dirname(self.meta_file), exist_ok=True)
+                tmp_file = self.meta_file + ".tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump({"updated_at": self.updated_at}, f)
+                os.replace(tmp_file, self.meta_file)
+                self.dirty = False
+        self.features.save()
+
+    def summary(self):
+        """Size of the index, for the run's stats."""
+        return {"files": len(self.files), "terms": len(self.postings)}
+
+def filter_search_hits(profile_name, files, search, stats=None):
+    """Keep only the (path, stat) pairs of files that contain every term of `search`.
+
+    The walk still runs, so exclusions and walk order apply as usual. The query and its
+    number of hits are recorded in stats["search"], if a stats dict is passed.
+    """
+    hits = set(search_profile(profile_name, search))
+    if stats is not None:
+        stats["search"] = {"query": search, "hits": len(hits)}
+    return ((path, st) for path, st in files if path in hits)
+
+# Loaded search indexes, keyed by profile name
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+
+def search_index_file(profile_name):
+    return os.path.join(CACHE_DIR, safe_file_name(profile_name) + ".search.json")
+
+def get_search_index(profile_name):
+    """Get (loading on first use) the search index for a profile."""
+    with _search_indexes_lock:
+        index = _search_indexes.get(profile_name)
+        if index is None:
+            index = SearchIndex(get_feature_cache(profile_name), search_index_file(profile_name))
+            _search_indexes[profile_name] = index
+        return index
+
+def uses_search_index(profile_name, search_index=None):
+    """Whether runs over a profile keep its search index up to date as they read files.
+
+    Defaults to the profile's "search_index" setting, and otherwise to whether the profile has
+    been searched before, so profiles that are never searched don't pay for an index.
+    """
+    if search_index is None:
+        search_index = get_profile_setting(profile_name, "search_index")
+    if search_index is None:
+        index = _search_indexes.get(profile_name)
+        return index.updated_at is not None if index is not None else os.path.exists(search_index_file(profile_name))
+    return bool(search_index)
+
+def refresh_search_index(profile_name):
+    """Bring a profile's search index up to date with its files; returns how many were (re)indexed.
+
+    The profile is walked and only the files whose (mtime, size) changed since they were
+    indexed are read (through the content cache, and whole up to the profile's
+    max_file_bytes); files that are gone or now excluded are dropped.
+    """
+    index = get_search_index(profile_name)
+    walk = iter_file_paths(get_profile_paths(profile_name), get_exclusion_matcher(profile_name),
+                           get_profile_setting(profile_name, "gitignore", False))
+    seen_paths = set()
+    stale = []
+    reindexed = 0
+    for path, st in walk:
+        seen_paths.add(path)
+        if st is None or index.is_current(path, st):
+            continue
+        # Terms a ranking scan already found don't need the file to be read
+        terms = index.features.known_terms(path, st)
+        if terms is None:
+            stale.append((path, st))
+        else:
+            index.update(path, st, terms)
+            reindexed += 1
+    index.remove_unseen(seen_paths)
+
+    max_file_bytes = get_profile_budget(profile_name).max_file_bytes
+    cache = get_file_cache(profile_name).start_run()
+
+    def load(item):
+        path, st = item
+        limit = max_file_bytes if max_file_bytes is not None and st.st_size > max_file_bytes else None
+        return load_file_entry(path, cache, st, limit)[0]
+
+    try:
+        workers = max(get_profile_setting(profile_name, "workers", DEFAULT_WORKERS), 1)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (_, st), entry in zip(stale, pool.map(load, stale)):
+                if index.add_entry(entry, st):
+                    reindexed += 1
+    finally:
+        cache.finish()
+    cache.cache.save()
+    index.save()
+    return reindexed
+
+def search_profile(profile_name, query):
+    """Return the paths of a profile's files that contain every term of the query.
+
+    The index is brought up to date first (see refresh_search_index()), so the results
+    reflect the files as they are now.
+    """
+    check_search_query(query)
+    refresh_search_index(profile_name)
+    return get_search_index(profile_name).search(query)
+
+# -----------------------
+# HELPER: PROCESS POOL
+# -----------------------
+# Read-only copy of the profile's content cache in each process-pool worker
+_shard_cache = None
+
+def iter_process_pool_chunks(profile_name, processes, output_format=None, stats=None, budget=None, tokenizer=None,
+                             dedup=None, gitignore=None, sizes=None, metrics=None, rank=None, query=None,
+                             search=None, search_index=None):
+    """Yield a profile's aggregated output with files loaded and encoded by worker processes.
+
+    Same output as iter_aggregated_chunks(iter_profile_entries(...)): shards of the walk (see
+    SHARD_MAX_FILES) go to `processes` workers and are merged back in walk order. Tokenizers
+    added with register_tokenizer() aren't available in the workers.
+    """
+    output_format = get_output_format(profile_name, output_format)
+    cache = get_file_cache(profile_name)
+    # Workers start from the cache files, so they have to be up to date
+    cache.save()
+    run = AggregationRun(profile_name, stats, budget, tokenizer, dedup, gitignore, metrics, rank=rank, query=query,
+                         search=search, search_index=search_index)
+    tokenizer = run.tokenizer
+    dedup = run.deduplicator is not None
+    metrics = run.metrics
+    index = run.index
+    fmt = OUTPUT_FORMATS[output_format]
+    total_bytes = len(fmt.header.encode("utf-8"))
+    empty = True
+
+    def merge(shard, shard_result):
+        nonlocal total_bytes, empty
+        results, cache_updates, cache_hits, misses, worker_metrics = shard_result
+        reads = {path: (st, limit) for path, st, limit in shard}
+        run.cache.hits += len(cache_hits)
+        run.cache.misses += misses
+        for path in cache_hits:
+            run.cache.touch(path)
+        metrics.merge(worker_metrics)
+        for path, st, entry, tokens in cache_updates:
+            run.cache.put(path, st, entry, {tokenizer: tokens} if tokens is not None else None)
+        for entry, fragment, fragment_bytes, tokens, digest, terms in results:
+            path = entry["full_path"]
+            st, limit = reads[path]
+            fitted, tokens = run.fit(entry, st, limit, tokens)
+            if fitted is None:
+                return
+            if fitted is not entry:
+                # Cut down to the token budget, so it has to be encoded (and hashed) again here
+                entry = fitted
+                fragment = fmt.encode_entry(entry, empty)
+                fragment_bytes = len(fragment.encode("utf-8"))
+                digest = run.deduplicator.digest(entry) if run.deduplicator is not None else None
+            run.file_tokens[path] = tokens
+            if index is not None:
+                run.seen_paths.add(path)
+                if terms is not None:
+                    index.update(path, st, terms)
+                    run.reindexed += 1
+            empty = False
+            run.count_file(entry)
+            if run.deduplicator is not None and digest is not None:
+                reference = run.deduplicator.process(entry, digest)
+                if reference is not entry:
+                    fragment = fmt.encode_entry(reference, False)
+                    fragment_bytes = len(fragment.encode("utf-8"))
+            total_bytes += fragment_bytes
+            yield fragment
+
+    files_to_read = run.iter_files_to_read()
+
+    yield fmt.header
+    # Spawned (not forked) workers, since the web app runs other threads that a fork would copy mid-flight
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_shard_worker, initargs=(cache.cache_dir,)) as pool:
+        try:
+            pending = deque()
+            first = True
+            for shard in iter_shards(files_to_read):
+                index_paths = set()
+                if index is not None:
+                    for path, st, _ in shard:
+                        if st is None or index.is_current(path, st):
+                            continue
+                        # Terms a ranking scan already found don't need to be sent back by a worker
+                        terms = index.features.known_terms(path, st)
+                        if terms is None:
+                            index_paths.add(path)
+                        else:
+                            index.update(path, st, terms)
+                            run.reindexed += 1
+                pending.append((shard, pool.submit(render_shard, shard, output_format, tokenizer, dedup, first,
+                                                   index_paths)))
+                first = False
+                if len(pending) >= processes * 2:
+                    shard, future = pending.popleft()
+                    yield from merge(shard, future.result())
+                    if run.stopped:
+                        break
+            while pending and not run.stopped:
+                shard, future = pending.popleft()
+                yield from merge(shard, future.result())
+            for _, future in pending:
+                future.cancel()
+        finally:
+            run.cache.finish()
+    footer = fmt.footer(empty)
+    total_bytes += len(footer.encode("utf-8"))
+    yield footer
+
+    run.finish()
+    if sizes is not None:
+        sizes[output_format] = total_bytes
+    if stats is not None:
+        stats["processes"] = processes
+
+def iter_shards(files, max_files=SHARD_MAX_FILES, max_bytes=SHARD_MAX_BYTES):
+    """Group (path, stat, limit) triples into contiguous lists bounded by file count and size."""
+    shard = []
+    shard_bytes = 0
+    for file_path, st, limit in files:
+        shard.append((file_path, st, limit))
+        if st is not None:
+            shard_bytes += st.st_size if limit is None else limit
+        if len(shard) >= max_files or shard_bytes >= max_bytes:
+            yield shard
+            shard = []
+            shard_bytes = 0
+    if shard:
+        yield shard
+
+def init_shard_worker(cache_dir):
+    """Process-pool initializer: load the profile's persisted content cache once per worker."""
+    global _shard_cache
+    _shard_cache = FileCache(cache_dir)
+
+def render_shard(files, output_format, tokenizer, dedup, first, index_paths=frozenset()):
+    """Load and encode a shard of files in a worker process.
+
+    Returns (results, cache updates, paths served from the cache, cache misses, metrics data). Each result is
+    (entry without its content, encoded fragment, fragment UTF-8 size, tokens, dedup digest,
+    search terms); `first` says whether the shard's first file is the first one in the output.
+    Search terms are only extracted for the files in `index_paths`, and None for the others.
+    """
+    fmt = OUTPUT_FORMATS[output_format]
+    cache = _shard_cache.start_run()
+    metrics = PipelineMetrics()
+    deduplicator = ContentDeduplicator() if dedup else None
+    results = []
+    cache_updates = []
+    cache_hits = []
+    for file_path, st, limit in files:
+        hits = cache.hits
+        misses = cache.misses
+        entry, tokens = load_file_entry(file_path, cache, st, limit, tokenizer, metrics)
+        if cache.hits != hits:
+            cache_hits.append(file_path)
+        # Same rules as load_file_entry() for what may be cached
+        if (cache.misses != misses and entry["language"] != "Error"
+                and not isinstance(entry["content"], MappedText)):
+            cache_updates.append((file_path, st, entry, tokens))
+
+        digest = deduplicator.digest(entry) if deduplicator else None
+        start = time.perf_counter()
+        if isinstance(entry["content"], MappedText):
+            fragment = "".join(fmt.stream_entry(entry, first))
+        else:
+            fragment = fmt.encode_entry(entry, first)
+        metrics.add_time("serialize", time.perf_counter() - start)
+        first = False
+        terms = index_terms(entry) if file_path in index_paths else None
+        summary = {key: value for key, value in entry.items() if key != "content"}
+        results.append((summary, fragment, len(fragment.encode("utf-8")), tokens, digest, terms))
+    cache.finish()
+    return results, cache_updates, cache_hits, cache.misses, metrics.data
+
+# -----------------------
+# HELPER: LARGE FILES
+# -----------------------
+class MappedText:
+    """The content of a large UTF-8 text file, decoded on demand from an mmap in chunks.
+
+    Takes the place of the content string in an entry; OutputFormat.stream_entry() escapes it
+    into the output one chunk at a time, so the whole file is never held as a string.
+    `length` limits how many bytes are used and `suffix` is appended (the truncation marker).
+    `mtime_ns` and `size` are the file's stat when it was read: the content is only decoded
+    while the file still matches them, since its tokens and digest were computed from that version.
+    """
+
+    def __init__(self, path, size, mtime_ns, length=None, suffix=""):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.length = length
+        self.suffix = suffix
+
+    @property
+    def nbytes(self):
+        """Bytes of the file that are used."""
+        return self.size if self.length is None else min(self.size, self.length)
+
+    def __len__(self):
+        # Only used for "is this short?" checks; bytes are a close enough upper bound
+        return self.nbytes + len(self.suffix)
+
+    def iter_chunks(self, chunk_bytes=MMAP_CHUNK_BYTES):
+        """Yield the content like decode_chunks(), but never raise partway through an output stream.
+
+        If the file was changed, removed or can't be decoded any more, the rest of the content
+        is replaced by a "Could not read file" marker.
+        """
+        try:
+            yield from self.decode_chunks(chunk_bytes)
+        except (OSError, ValueError) as e:
+            yield f"Could not read file: {e}"
+
+    def changed(self, st):
+        """Check whether a stat of the file no longer matches the version the content was read from."""
+        return st.st_mtime_ns != self.mtime_ns or st.st_size != self.size
+
+    def decode_chunks(self, chunk_bytes=MMAP_CHUNK_BYTES):
+        """Yield the decoded, newline-translated content in chunks of about chunk_bytes.
+
+        Raises OSError if the file changed since it was read (or is gone) and UnicodeDecodeError
+        if it isn't valid UTF-8.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        end = self.nbytes
+        pending = ""
+        with open(self.path, "rb") as file:
+            if self.changed(os.fstat(file.fileno())):
+                raise OSError(f"{os.path.basename(self.path)} changed since it was scanned")
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        with mapped:
+            end = min(end, len(mapped))
+            for offset in range(0, end, chunk_bytes):
+                # Touching pages past the end of a file truncated in the meantime would crash the process
+                if self.changed(os.stat(self.path)):
+                    raise OSError(f"{os.path.basename(self.path)} changed while it was being read")
+                text = pending + decoder.decode(mapped[offset:min(offset + chunk_bytes, end)])
+                # Hold back a trailing \r in case the next chunk starts with the \n of a \r\n
+                pending = ""
+                if text.endswith("\r"):
+                    text, pending = text[:-1], "\r"
+                if text:
+                    yield translate_newlines(text)
+        # A truncated file may end in the middle of a character, which is dropped
+        text = translate_newlines(pending + decoder.decode(b"", final=self.length is None)) + self.suffix
+        if text:
+            yield text
+
+def iter_content_chunks(content):
+    """Yield an entry's content as strings: the string itself, or a MappedText's chunks."""
+    if isinstance(content, MappedText):
+        yield from content.iter_chunks()
+    else:
+        yield content
+
+def load_mapped_entry(path, st, limit=None, count_tokens=None, metrics=None):
+    """Build (entry, tokens) for a large file without keeping its content in memory.
+
+    The file is decoded once here, chunk by chunk, to count tokens and to make sure it is
+    valid UTF-8. Returns None for files that should take the normal read path (other encodings).
+    `st` is the file's stat from the walk; the content is tied to that version of the file.
+    """
+    size = st.st_size
+    filename = os.path.basename(path)
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as file:
+            encoding = sniff_encoding(file.read(SNIFF_BYTES))
+        if encoding is None:
+            entry = {"filename": filename, "language": "Binary", "content": f"[Binary file: {filename}]",
+                     "full_path": path}
+            return entry, count_tokens(entry["content"]) if count_tokens else None
+        if encoding != "utf-8":
+            return None
+
+        suffix = ""
+        if limit is not None:
+            suffix = f"\n[Truncated: {filename} is {size} bytes, only the first {limit} bytes are included]"
+        content = MappedText(path, size, st.st_mtime_ns, limit, suffix)
+        tokens = 0
+        for chunk in content.decode_chunks():
+            if count_tokens:
+                tokens += count_tokens(chunk)
+    except UnicodeDecodeError:
+        entry = {"filename": filename, "language": "Binary", "content": f"[Binary file: {filename}]",
+                 "full_path": path}
+        return entry, count_tokens(entry["content"]) if count_tokens else None
+    except (OSError, ValueError) as e:
+        entry = {"filename": filename, "language": "Error", "content": f"Could not read file: {e}",
+                 "full_path": path}
+        return entry, count_tokens(entry["content"]) if count_tokens else None
+    finally:
+        if metrics is not None:
+            metrics.add_time("decode", time.perf_counter() - start)
+
+    if metrics is not None:
+        metrics.count("files_read")
+        metrics.add_bytes("read", content.nbytes)
+    language = EXTENSION_MAP.get(os.path.splitext(path)[1].lower(), "Unknown")
+    entry = {"filename": filename, "language": language, "content": content, "full_path": path}
+    return entry, tokens if count_tokens else None
+
+# -----------------------
+# HELPER: PROFILE WATCHERS
+# -----------------------
+class ProfileSnapshot:
+    """A pre-aggregated profile: its entries in walk order and the stats of the run that built them.
+
+    `signatures` maps each file's path to the (mtime_ns, size) its entry was read at, and
+    `directories` each directory walked to its mtime_ns when it was listed.
+    """
+
+    def __init__(self, entries, stats, version, signatures, directories):
+        self.entries = entries
+        self.stats = stats
+        self.version = version
+        self.signatures = signatures
+        self.directories = directories
+        self.built_at = time.time()
+
+    def changed_directories(self):
+        """The walked directories that had entries added, removed or renamed since they were listed."""
+        changed = []
+        for path, mtime_ns in self.directories.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime_ns:
+                    changed.append(path)
+            except OSError:
+                changed.append(path)
+        return changed
+
+    def changed_paths(self):
+        """The snapshot's files that changed or disappeared since they were read.
+
+        Costs a stat per file, which is still far cheaper than reading them; files added since
+        the snapshot was built show up in changed_directories() instead.
+        """
+        changed = []
+        for path, signature in self.signatures.items():
+            st = stat_file(path)
+            if st is None or (st.st_mtime_ns, st.st_size) != signature:
+                changed.append(path)
+        return changed
+
+class WatchdogHandler:
+    """Passes filesystem events on paths its profile doesn't exclude on to a watcher."""
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def dispatch(self, event):
+        # Reads (including the watcher's own) change nothing
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        # A directory's "modified" event only echoes the events of the files in it
+        if event.is_directory and event.event_type == "modified":
+            return
+        exclusion_matcher = get_exclusion_matcher(self.watcher.profile_name)
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if not path:
+                continue
+            path = os.fsdecode(path)
+            if should_exclude(path, exclusion_matcher):
+                continue
+            # Directory events have no trailing separator, but patterns like "/node_modules/" expect one
+            if event.is_directory and should_exclude(os.path.join(path, ""), exclusion_matcher):
+                continue
+            # Files are updated one by one; anything that happens to a directory takes a full rescan
+            self.watcher.notify(None if event.is_directory else path)
+
+class ProfileWatcher:
+    """Keeps a warm snapshot of a profile's aggregation up to date in a background thread.
+
+    With watchdog installed, filesystem events name the files that changed and only those are
+    re-read into the snapshot (see update()). A full rescan walks the profile with its
+    exclusions, so excluded trees are never tracked, and goes through the content cache, so
+    only files whose (mtime, size) changed are re-read. Full rescans happen on start, after
+    events update() can't apply, and every `interval` seconds (without watchdog) or every
+    WATCHDOG_POLL_INTERVAL seconds (with it, in case events were missed).
+    """
+
+    def __init__(self, profile_name, interval=DEFAULT_WATCH_INTERVAL):
+        self.profile_name = profile_name
+        self.interval = interval
+        self.snapshot = None
+        self.last_error = None
+        self._version = 0
+        self._changes = set()
+        self._full_rescan = True
+        self._changes_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    @property
+    def mode(self):
+        return "watchdog" if self._observer is not None else "polling"
+
+    def start(self):
+        """Start the rescan thread (and the watchdog observer, if available)."""
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.daemon = True
+            self._schedule_events()
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run, name=f"watch-{self.profile_name}", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """Pick up changed profile paths or exclusions: re-register event watches and rescan right away."""
+        if self._observer is not None:
+            self._observer.unschedule_all()
+            self._schedule_events()
+        self.wake()
+
+    def _schedule_events(self):
+        handler = WatchdogHandler(self)
+        for path in get_profile_paths(self.profile_name):
+            if os.path.isdir(path):
+                self._observer.schedule(handler, path, recursive=True)
+            elif os.path.isdir(os.path.dirname(path)):
+                self._observer.schedule(handler, os.path.dirname(path), recursive=False)
+
+    def stop(self):
+        """Stop watching; the thread exits after its current rescan."""
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def wake(self):
+        """Ask for a full rescan as soon as possible (e.g. after the profile's paths or exclusions changed)."""
+        self.notify(None)
+
+    def notify(self, path):
+        """Note that the file at `path` changed (or, with None, that a full rescan is needed) and wake the thread."""
+        with self._changes_lock:
+            if path is None:
+                self._full_rescan = True
+            else:
+                self._changes.add(path)
+        self._wake.set()
+
+    def get_snapshot(self, timeout=None):
+        """Return the latest snapshot, waiting up to `timeout` seconds for the first one to be built.
+
+        Returns None if files changed or were added since the snapshot was built (e.g. the
+        watcher hasn't handled their events yet), so stale, deleted or missing files are never
+        served; the watcher is told about them to catch up, with a full rescan for new files.
+        """
+        self._ready.wait(timeout)
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        if snapshot.changed_directories():
+            self.notify(None)
+            return None
+        changed = snapshot.changed_paths()
+        if changed:
+            for path in changed:
+                self.notify(path)
+            return None
+        return snapshot
+
+    def rescan(self):
+        """Rebuild the snapshot from the current state of the profile's files."""
+        stats = {}
+        signatures = {}
+        directories = {}
+        entries = list(iter_profile_entries(self.profile_name, stats, signatures=signatures,
+                                            directories=directories))
+        self._publish(entries, stats, signatures, directories)
+
+    def update(self, paths):
+        """Re-read only the changed files at `paths` into the current snapshot.
+
+        Returns False, changing nothing, when a full rescan is needed instead: for a file that
+        isn't in the snapshot yet (its place in walk order isn't known), or when the profile's
+        output depends on more than each file itself (total budgets, deduplication, ranking
+        or .gitignore files).
+        """
+        name = self.profile_name
+        snapshot = self.snapshot
+        budget = get_profile_budget(name)
+        if (snapshot is None or budget.max_total_bytes is not None or budget.max_total_tokens is not None
+                or get_profile_setting(name, "dedup", False) or get_profile_setting(name, "rank", False)
+                or get_profile_setting(name, "gitignore", False)):
+            return False
+
+        positions = {entry["full_path"]: i for i, entry in enumerate(snapshot.entries)}
+        roots = [os.path.join(root, "") for root in get_profile_paths(name)]
+        exclusion_matcher = get_exclusion_matcher(name)
+        changes = {}
+        for path in paths:
+            st = stat_file(path)
+            if path in positions:
+                changes[path] = st
+                continue
+            # Gone again (e.g. an editor's temporary file), or a file the walk wouldn't pick up
+            name_part = os.path.basename(path)
+            if (st is None or not os.path.isfile(path) or name_part.startswith('.')
+                    or os.path.splitext(name_part)[1].lower() in BINARY_EXTENSIONS
+                    or should_exclude(path, exclusion_matcher)
+                    or not any(path.startswith(root) or path + os.sep == root for root in roots)):
+                continue
+            return False
+        if not changes:
+            return True
+
+        stats = copy.copy(snapshot.stats)
+        tokenizer = stats["tokens"]["tokenizer"]
+        file_tokens = dict(stats["tokens"]["files"])
+        signatures = dict(snapshot.signatures)
+        entries = list(snapshot.entries)
+        metrics = PipelineMetrics()
+        cache = get_file_cache(name)
+        index = get_search_index(name) if uses_search_index(name) else None
+        run = cache.start_run()
+        reindexed = 0
+        removed = set()
+        try:
+            for path, st in changes.items():
+                if st is None:
+                    removed.add(path)
+                    file_tokens.pop(path, None)
+                    signatures.pop(path, None)
+                    cache.discard(path)
+                    if index is not None:
+                        index.discard(path)
+                    continue
+                if signatures.get(path) == (st.st_mtime_ns, st.st_size):
+                    continue
+                entry, file_tokens[path] = load_file_entry(path, run, st, budget.allot(st.st_size), tokenizer,
+                                                           metrics)
+                entries[positions[path]] = entry
+                if os.path.splitext(path)[1].lower() not in BINARY_EXTENSIONS:
+                    signatures[path] = (st.st_mtime_ns, st.st_size)
+                if index is not None and index.add_entry(entry, st):
+                    reindexed += 1
+        finally:
+            run.finish()
+        if removed:
+            entries = [entry for entry in entries if entry["full_path"] not in removed]
+        # Saving or deleting a file can touch its directory too; any file added there has its own event
+        directories = dict(snapshot.directories)
+        for path in changes:
+            parent = os.path.dirname(path)
+            if parent in directories:
+                try:
+                    directories[parent] = os.stat(parent).st_mtime_ns
+                except OSError:
+                    # Gone with it: the stale mtime kept here asks for a full rescan
+                    pass
+        cache.save()
+        if index is not None:
+            index.save()
+
+        # Re-charge the budget for the whole snapshot, so its stats match a full rescan's
+        budget = get_profile_budget(name)
+        for path, (_, size) in signatures.items():
+            budget.allot(size, file_tokens.get(path))
+            budget.take(file_tokens.get(path))
+        stats["cache"] = run.summary()
+        stats["budget"] = budget.summary()
+        if index is not None:
+            stats["search_index"] = {**index.summary(), "reindexed": reindexed}
+        stats["tokens"] = {"tokenizer": tokenizer, "total": sum(file_tokens.values()), "files": file_tokens}
+        stats["metrics"] = metrics.finish()
+        self._publish(entries, stats, signatures, directories)
+        return True
+
+    def _publish(self, entries, stats, signatures, directories):
+        self._version += 1
+        self.snapshot = ProfileSnapshot(entries, stats, self._version, signatures, directories)
+        self._ready.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._changes_lock:
+                paths, full_rescan = self._changes, self._full_rescan
+                self._changes, self._full_rescan = set(), False
+            try:
+                if full_rescan or not self.update(paths):
+                    self.rescan()
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the previous snapshot; the error is reported with the watcher status
+                self.last_error = str(e)
+                self._ready.set()
+            poll_interval = self.interval if self._observer is None else max(self.interval, WATCHDOG_POLL_INTERVAL)
+            if self._wake.wait(poll_interval):
+                time.sleep(WATCH_DEBOUNCE)
+            else:
+                # Nothing said what changed since the last scan, so check everything
+                with self._changes_lock:
+                    self._full_rescan = True
+            self._wake.clear()
+
+# Running watchers, keyed by profile name
+_profile_watchers = {}
+_profile_watchers_lock = threading.Lock()
+
+def get_profile_watcher(profile_name):
+    """Get the running watcher for a profile, or None."""
+    return _profile_watchers.get(profile_name)
+
+def start_profile_watcher(profile_name):
+    """Start watching a profile (no-op if it is already watched) and return its watcher."""
+    with _profile_watchers_lock:
+        watcher = _profile_watchers.get(profile_name)
+        if watcher is None:
+            interval = get_profile_setting(profile_name, "watch_interval", DEFAULT_WATCH_INTERVAL)
+            watcher = ProfileWatcher(profile_name, interval)
+            watcher.start()
+            _profile_watchers[profile_name] = watcher
+        return watcher
+
+def stop_profile_watcher(profile_name):
+    """Stop watching a profile."""
+    with _profile_watchers_lock:
+        watcher = _profile_watchers.pop(profile_name, None)
+    if watcher is not None:
+        watcher.stop()
+
+def ensure_profile_watcher(profile_name):
+    """Start or stop a profile's watcher to match its "watch" setting and return the running watcher, if any."""
+    if get_profile_setting(profile_name, "watch", False):
+        return start_profile_watcher(profile_name)
+    stop_profile_watcher(profile_name)
+    return None
+
+def notify_profile_changed(profile_name):
+    """Tell a profile's watcher that its paths or exclusions changed, so it rescans right away."""
+    watcher = get_profile_watcher(profile_name)
+    if watcher is not None:
+        watcher.refresh()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import sys
+
+import collate
+from collate import (
+    OUTPUT_FORMATS, TOKENIZERS,
+    PipelineMetrics, build_manifest, load_profiles, get_profile_budget, get_output_format,
+    choose_processes, iter_profile_chunks, check_search_query, safe_file_name
+)
+
+# Extension of the per-profile files --manifest writes into an --output directory
+MANIFEST_EXTENSION = ".manifest.json"
+
+# -----------------------
+# COMMAND LINE
+# -----------------------
+def parse_args(argv=None):
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Aggregate the files of one or more profiles without starting the web app."
+    )
+    parser.add_argument("profiles", nargs="*", help="Profiles to aggregate")
+    parser.add_argument("--all", action="store_true", help="Aggregate every profile")
+    parser.add_argument("--list", action="store_true", help="List the available profiles and exit")
+    parser.add_argument("--profiles-file", default=collate.PROFILES_FILE,
+                        help=f"Profiles JSON file (default: {collate.PROFILES_FILE})")
+    parser.add_argument("-o", "--output",
+                        help="Output file, or directory when aggregating several profiles (default: stdout)")
+    parser.add_argument("--format", choices=sorted(OUTPUT_FORMATS), help="Output format (default: the profile's)")
+    parser.add_argument("--workers", type=int, help="Threads used to read files (default: the profile's)")
+    parser.add_argument("--processes", type=int,
+                        help="Load and encode files in this many worker processes (default: the profile's, or off)")
+    parser.add_argument("--tokenizer", choices=sorted(TOKENIZERS), help="Token estimator (default: the profile's)")
+    parser.add_argument("--max-file-bytes", type=int, help="Truncate files larger than this")
+    parser.add_argument("--max-total-bytes", type=int, help="Stop once this many bytes have been read")
+    parser.add_argument("--max-total-tokens", type=int, help="Stop once this many (estimated) tokens have been read")
+    parser.add_argument("--dedup", action=argparse.BooleanOptionalAction, default=None,
+                        help="Emit identical file contents once and reference the first copy elsewhere "
+                             "(default: the profile's)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only output the files added, modified or deleted since the profile's last --delta run")
+    parser.add_argument("--rank", action=argparse.BooleanOptionalAction, default=None,
+                        help="Pick the most relevant files that fit the budget instead of the first ones walked "
+                             "(default: the profile's)")
+    parser.add_argument("--query", help="Rank files by these keywords as well (implies --rank)")
+    parser.add_argument("--search", help="Only aggregate the files that contain every term of this search")
+    parser.add_argument("--gitignore", action=argparse.BooleanOptionalAction, default=None,
+                        help="Also skip files ignored by .gitignore files under the profile's folders "
+                             "(default: the profile's)")
+    parser.add_argument("--manifest", action="store_true",
+                        help="Only list the files that would be aggregated, with sizes and projected tokens, as JSON "
+                             f"(written like the output; {MANIFEST_EXTENSION} files in an --output directory)")
+    parser.add_argument("--stats", action="store_true", help="Print cache, budget, token, dedup, delta, ranking, search and timing stats to stderr")
+    return parser.parse_args(argv)
+
+def profile_budget(profile_name, args):
+    """A profile's read budget with the limits given on the command line applied."""
+    budget = get_profile_budget(profile_name)
+    if args.max_file_bytes is not None:
+        budget.max_file_bytes = args.max_file_bytes
+    if args.max_total_bytes is not None:
+        budget.max_total_bytes = args.max_total_bytes
+    if args.max_total_tokens is not None:
+        budget.max_total_tokens = args.max_total_tokens
+    return budget
+
+def aggregate_profile(profile_name, out_file, args):
+    """Stream one profile's aggregated output to an open file and return its stats."""
+    budget = profile_budget(profile_name, args)
+
+    stats = {}
+    sizes = {}
+    metrics = PipelineMetrics()
+    output_format = get_output_format(profile_name, args.format)
+    chunks = iter_profile_chunks(profile_name, output_format, stats, sizes, metrics, processes=args.processes,
+                                 workers=args.workers, budget=budget, tokenizer=args.tokenizer, dedup=args.dedup,
+                                 gitignore=args.gitignore, delta=args.delta, rank=args.rank, query=args.query,
+                                 search=args.search)
+    write = metrics.timed("write", out_file.write)
+    for chunk in chunks:
+        write(chunk)
+    metrics.add_bytes("written", sizes[output_format])
+    metrics.finish()
+    stats["output"] = {"format": output_format, "bytes": sizes}
+    return stats
+
+def output_path(profile_name, args, several):
+    """Where a profile's output goes: None for stdout, the given file, or <dir>/<safe profile name><ext>."""
+    if args.output is None:
+        return None
+    if not several:
+        return args.output
+    if args.manifest:
+        extension = MANIFEST_EXTENSION
+    else:
+        extension = OUTPUT_FORMATS[get_output_format(profile_name, args.format)].extension
+    return os.path.join(args.output, safe_file_name(profile_name) + extension)
+
+def main(argv=None):
+    args = parse_args(argv)
+    collate.PROFILES_FILE = args.profiles_file
+
+    try:
+        profiles = load_profiles()
+    except (OSError, ValueError) as e:
+        print(f"Could not load profiles from {args.profiles_file}: {e}", file=sys.stderr)
+        return 1
+
+    if args.list:
+        for name in profiles:
+            print(name)
+        return 0
+
+    names = list(profiles) if args.all else args.profiles
+    if not names:
+        print("No profiles given (pass profile names or --all)", file=sys.stderr)
+        return 2
+    missing = [name for name in names if name not in profiles]
+    if missing:
+        print(f"Unknown profile(s): {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    if args.search is not None:
+        try:
+            check_search_query(args.search)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+
+    several = len(names) > 1
+    if several and args.output is not None:
+        paths = {}
+        for name in names:
+            paths.setdefault(output_path(name, args, several), []).append(name)
+        clashes = [" and ".join(same) for same in paths.values() if len(same) > 1]
+        if clashes:
+            print(f"Profiles would be written to the same file: {'; '.join(clashes)}", file=sys.stderr)
+            return 2
+        os.makedirs(args.output, exist_ok=True)
+
+    for name in names:
+        path = output_path(name, args, several)
+        if args.manifest:
+            manifest = json.dumps(build_manifest(name, profile_budget(name, args), gitignore=args.gitignore,
+                                                 tokenizer=args.tokenizer), separators=(",", ":"))
+            if path is None:
+                print(manifest)
+            else:
+                with open(path, "w", encoding="utf-8") as out_file:
+                    out_file.write(manifest + "\n")
+            continue
+        try:
+            choose_processes(name, args.processes, args.delta)
+        except ValueError as e:
+            print(f"{name}: {e}", file=sys.stderr)
+            return 2
+        if path is None:
+            stats = aggregate_profile(name, sys.stdout, args)
+            sys.stdout.flush()
+        else:
+            with open(path, "w", encoding="utf-8") as out_file:
+                stats = aggregate_profile(name, out_file, args)
+        if args.stats:
+            print(json.dumps({"profile": name, **stats}, separators=(",", ":")), file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
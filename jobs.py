@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from collate import PipelineMetrics, get_output_format, iter_profile_chunks, iter_written_output
+
+# -----------------------
+# CONFIGURATION
+# -----------------------
+# How many aggregation jobs may run at the same time (each one also has its own read pool)
+JOB_WORKERS = 2
+
+# Finished jobs (and their results) are dropped after this many seconds
+JOB_RETENTION_SECONDS = 600
+
+# -----------------------
+# HELPER: AGGREGATION JOBS
+# -----------------------
+class AggregationJob:
+    """One background aggregation of a profile, with live progress and its result once done.
+
+    Runs the same pipeline and writes the same output artifact as a synchronous /generate
+    (see iter_profile_chunks() and iter_written_output()); `on_finish(profile, stats)` is
+    called with the stats of a successful run.
+    """
+
+    def __init__(self, profile_name, output_format=None, tokenizer=None, workers=None, dedup=None, delta=False,
+                 rank=None, query=None, search=None, processes=None, compression=None, measure_all=False,
+                 expected_files=None, on_finish=None):
+        self.id = uuid.uuid4().hex
+        self.profile_name = profile_name
+        self.output_format = get_output_format(profile_name, output_format)
+        self.tokenizer = tokenizer
+        self.workers = workers
+        self.dedup = dedup
+        self.delta = delta
+        self.rank = rank
+        self.query = query
+        self.search = search
+        self.processes = processes
+        self.compression = compression
+        self.measure_all = measure_all
+        self.expected_files = expected_files
+        self.on_finish = on_finish
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.stats = None
+        self.metrics = PipelineMetrics()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def files_done(self):
+        return self.metrics.data["counts"]["files"]
+
+    @property
+    def bytes_done(self):
+        return self.metrics.data["bytes"]["read"]
+
+    def run(self):
+        """Aggregate the profile (blocking); progress is read from the run's metrics as it goes."""
+        self.started_at = time.time()
+        stats = {}
+        sizes = {}
+        chunks = iter_profile_chunks(self.profile_name, self.output_format, stats, sizes, self.metrics,
+                                     self.measure_all, self.processes, workers=self.workers,
+                                     tokenizer=self.tokenizer, dedup=self.dedup, delta=self.delta, rank=self.rank,
+                                     query=self.query, search=self.search)
+        self.result = "".join(iter_written_output(self.profile_name, chunks, stats, sizes, self.output_format,
+                                                  self.metrics, self.compression))
+        self.stats = stats
+        if self.on_finish is not None:
+            self.on_finish(self.profile_name, stats)
+
+    def progress(self):
+        """Status and progress counters, with an ETA based on the profile's previous file count."""
+        elapsed = None
+        eta = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if self.finished_at is None and self.expected_files and self.files_done:
+                remaining = max(self.expected_files - self.files_done, 0)
+                eta = round(elapsed / self.files_done * remaining, 3)
+        return {
+            "job_id": self.id,
+            "profile": self.profile_name,
+            "status": self.status,
+            "files_scanned": self.files_done,
+            "bytes_read": self.bytes_done,
+            "expected_files": self.expected_files,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "eta_seconds": eta,
+            "error": self.error
+        }
+
+class JobManager:
+    """Runs aggregation jobs on an asyncio event loop in a background thread.
+
+    Blocking aggregation work is handed to a small thread pool so the loop stays free to
+    schedule jobs. Submitting a job identical to one that is still running returns the
+    running job instead of starting a second one.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, on_finish=None):
+        self.on_finish = on_finish
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self._active = {}
+        self._last_file_counts = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="collate-job")
+        self._loop = None
+
+    def submit(self, profile_name, output_format=None, tokenizer=None, workers=None, dedup=None, delta=False,
+               rank=None, query=None, search=None, processes=None, compression=None, measure_all=False):
+        """Start (or join) a job for the profile; returns (job, deduplicated)."""
+        key = (profile_name, get_output_format(profile_name, output_format), tokenizer, workers, dedup, delta,
+               rank, query, search, processes, compression, measure_all)
+        with self.lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None:
+                return job, True
+            job = AggregationJob(profile_name, output_format, tokenizer, workers, dedup, delta, rank, query, search,
+                                 processes, compression, measure_all,
+                                 expected_files=self._last_file_counts.get(profile_name), on_finish=self.on_finish)
+            self.jobs[job.id] = job
+            self._active[key] = job
+        asyncio.run_coroutine_threadsafe(self._run(job, key), self._get_loop())
+        return job, False
+
+    def get(self, job_id):
+        """Get a job by id, or None."""
+        return self.jobs.get(job_id)
+
+    async def _run(self, job, key):
+        job.status = "running"
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, job.run)
+            job.status = "done"
+            # Delta and search runs only count some files, which says nothing about the next run's size
+            if not (job.delta or job.search):
+                self._last_file_counts[job.profile_name] = job.files_done
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                self._active.pop(key, None)
+            job.done.set()
+
+    def _get_loop(self):
+        with self.lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="collate-jobs", daemon=True).start()
+            return self._loop
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self.jobs[job_id]
@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import collate
+
+# Files of the sample profile: plain and nested sources, escapes, non-ASCII text, CRLF, an empty and a binary file
+TREE_FILES = {
+    "main.py": "import util\n\nprint('hello')\n",
+    "util.py": "def helper(x):\n    return \"quoted\\\\path\\t\" + x\n",
+    "notes.md": "# Notes\n\nNon-ASCII: café ✓ 日本 \U0001f600\n",
+    "crlf.txt": "first\r\nsecond\r\n",
+    "empty.txt": "",
+    "pkg/__init__.py": "",
+    "pkg/models.py": "class AgentBrainController:\n    pass\n" * 20,
+    "pkg/deep/data.json": "{\"key\": [1, 2, 3]}\n",
+    "pkg/deep/copy.py": "import util\n\nprint('hello')\n",
+}
+
+@pytest.fixture
+def profile(tmp_path, monkeypatch, fresh_caches):
+    """A profile "T" over a sample tree, with its own profiles file and cache directory.
+
+    Returns the tree's root directory.
+    """
+    root = tmp_path / "tree"
+    for name, content in TREE_FILES.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content.encode("utf-8"))
+    (root / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n\x00\x01")
+
+    profiles_file = tmp_path / "profiles.json"
+    profiles_file.write_text(json.dumps({"T": {"paths": [str(root)], "exclusions": ["/.git/"]}}))
+    monkeypatch.setattr(collate, "PROFILES_FILE", str(profiles_file))
+    fresh_caches(tmp_path / ".collate_cache")
+    return root
+
+@pytest.fixture
+def fresh_caches(monkeypatch):
+    """A function that points CACHE_DIR at a directory and forgets the per-profile caches loaded so far."""
+    def reset(cache_dir):
+        monkeypatch.setattr(collate, "CACHE_DIR", str(cache_dir))
+        for name in ("_file_caches", "_feature_caches", "_search_indexes", "_exclusion_matchers"):
+            monkeypatch.setattr(collate, name, {})
+    return reset
+
+@pytest.fixture
+def client(profile, monkeypatch, tmp_path):
+    """A Flask test client for the web app, writing its output files under tmp_path."""
+    import app
+    monkeypatch.chdir(tmp_path)
+    return app.app.test_client()
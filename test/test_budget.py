@@ -0,0 +1,103 @@
+import pytest
+
+import collate
+from collate import ReadBudget, aggregate_files, cut_to_tokens
+
+def usage(budget):
+    summary = budget.summary()
+    return summary["bytes"], summary["estimated_tokens"], summary["truncated_files"], summary["exhausted"]
+
+# -----------------------
+# CHARGING FILES
+# -----------------------
+def test_budget_unlimited():
+    budget = ReadBudget()
+    assert budget.allot(100) is None
+    assert budget.allot(None) is None
+    assert usage(budget) == (100, 25, 0, False)
+
+def test_budget_truncates_large_files():
+    budget = ReadBudget(max_file_bytes=10)
+    assert budget.allot(100) == 10
+    assert budget.allot(10) is None
+    assert usage(budget) == (20, 6, 1, False)
+
+def test_budget_total_bytes():
+    budget = ReadBudget(max_total_bytes=150)
+    assert budget.fits(100)
+    assert budget.allot(100) is None
+    assert not budget.fits(100)
+    assert budget.allot(100) == 50
+    assert budget.exhausted
+    assert budget.allot(10) == 0
+    assert usage(budget) == (150, 38, 1, True)
+
+def test_budget_estimated_tokens():
+    budget = ReadBudget(max_total_tokens=10)
+    assert budget.allot(100) == 10 * collate.BYTES_PER_TOKEN
+    assert budget.tokens_used == 10
+    assert budget.exhausted
+
+def test_budget_known_tokens():
+    budget = ReadBudget(max_total_tokens=100)
+    # 8 bytes per token: charged exactly 50 tokens, not 400 / BYTES_PER_TOKEN
+    assert budget.allot(400, tokens=50) is None
+    assert budget.tokens_used == 50
+    assert budget.fits(300, tokens=30)
+    assert not budget.fits(400, tokens=100)
+    # 50 tokens left at 4 bytes per token
+    assert budget.allot(400, tokens=100) == 200
+    assert usage(budget) == (600, 100, 1, True)
+
+def test_budget_exhausted_exactly():
+    budget = ReadBudget(max_total_bytes=100)
+    assert budget.allot(100) is None
+    assert budget.exhausted
+    assert budget.allot(1) == 0
+
+# -----------------------
+# ACTUAL TOKEN COUNTS
+# -----------------------
+def test_budget_take():
+    budget = ReadBudget(max_total_tokens=10)
+    assert budget.take(6)
+    assert budget.take(None)
+    assert not budget.take(5)
+    assert budget.tokens_left() == 4
+    assert budget.take(4)
+    assert budget.summary()["tokens"] == 10
+    assert ReadBudget().tokens_left() is None
+
+def test_cut_to_tokens():
+    count_tokens = collate.TOKENIZERS["chars"]
+    content = "".join(f"line {i}\n" for i in range(100))
+    entry = {"filename": "a.py", "language": "Python", "content": content, "full_path": "/a.py"}
+    cut, tokens = cut_to_tokens(entry, len(content), None, 40, count_tokens)
+    assert tokens == count_tokens(cut["content"]) <= 40
+    text, marker = cut["content"].split("\n[Truncated: ")
+    # Cut after a whole line
+    assert content.startswith(text) and text.endswith("\n")
+    assert marker == f"a.py is {len(content)} bytes, only the first {len(text)} bytes are included]"
+
+    assert cut_to_tokens(entry, len(content), None, 1, count_tokens) == (None, 0)
+    binary = {**entry, "language": "Binary", "content": "[Binary file: a.py]"}
+    assert cut_to_tokens(binary, 10, None, 40, count_tokens) == (None, 0)
+
+@pytest.mark.parametrize("options", [{}, {"processes": 2}, {"rank": True}, {"dedup": True}],
+                         ids=lambda options: ",".join(options) or "threads")
+@pytest.mark.parametrize("tokenizer", ["bpe", "chars"])
+def test_total_tokens_enforced_on_a_cold_run(profile, options, tokenizer):
+    # Dense code has fewer than BYTES_PER_TOKEN bytes per token, so size estimates undercharge it
+    for i in range(5):
+        (profile / f"dense{i}.py").write_text("x=(1,2,3);" * 40)
+    stats = {}
+    output = aggregate_files("T", stats, budget=ReadBudget(max_total_tokens=150), tokenizer=tokenizer, **options)
+    assert stats["tokens"]["total"] <= 150
+    assert stats["budget"]["tokens"] == stats["tokens"]["total"]
+    assert output.count('"filename"') == len(stats["tokens"]["files"])
+
+def test_total_tokens_processes_match_threads(profile):
+    for i in range(5):
+        (profile / f"dense{i}.py").write_text("x=(1,2,3);" * 40)
+    threads = aggregate_files("T", budget=ReadBudget(max_total_tokens=150))
+    assert aggregate_files("T", processes=2, budget=ReadBudget(max_total_tokens=150)) == threads
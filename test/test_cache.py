@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import collate
+from collate import aggregate_files
+
+def test_cached_run_matches_first_run(profile, fresh_caches, tmp_path):
+    first = aggregate_files("T")
+    stats = {}
+    assert aggregate_files("T", stats) == first
+    assert stats["cache"]["hits"] == 9
+    # A fresh process loads the same entries from the persisted shards
+    fresh_caches(tmp_path / ".collate_cache")
+    assert aggregate_files("T") == first
+
+def test_edited_files_are_read_again(profile):
+    aggregate_files("T")
+    (profile / "util.py").write_text("def helper(x):\n    return x * 2\n")
+    stats = {}
+    assert "return x * 2" in aggregate_files("T", stats)
+    assert (stats["cache"]["hits"], stats["cache"]["misses"]) == (8, 1)
+
+@pytest.mark.parametrize("get_cache, cache_class", [
+    (collate.get_file_cache, "FileCache"),
+    (collate.get_feature_cache, "FeatureCache"),
+    (collate.get_search_index, "SearchIndex"),
+])
+def test_concurrent_first_use_loads_one_cache(profile, monkeypatch, get_cache, cache_class):
+    loaded = getattr(collate, cache_class)
+
+    class SlowLoad(loaded):
+        def __init__(self, *args, **kwargs):
+            # Wide enough a window for every thread to miss the cache without the lock
+            time.sleep(0.05)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(collate, cache_class, SlowLoad)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        caches = list(pool.map(lambda _: get_cache("T"), range(8)))
+    assert all(cache is caches[0] for cache in caches)
@@ -0,0 +1,53 @@
+import json
+
+import collate
+import collate_code
+from collate import aggregate_files
+
+def run(capsys, *argv):
+    """Run the CLI against the sample profiles file; returns (exit code, stdout)."""
+    code = collate_code.main(["--profiles-file", collate.PROFILES_FILE, *argv])
+    return code, capsys.readouterr().out
+
+def add_profiles(profile, *names):
+    with collate.get_profile_store().transaction() as profiles:
+        for name in names:
+            profiles[name] = {"paths": [str(profile / "pkg")], "exclusions": []}
+
+def test_single_profile_to_stdout_and_file(profile, tmp_path, capsys):
+    expected = aggregate_files("T")
+    assert run(capsys, "T") == (0, expected)
+    out_file = tmp_path / "out.json"
+    assert run(capsys, "T", "-o", str(out_file)) == (0, "")
+    assert out_file.read_text(encoding="utf-8") == expected
+
+def test_several_profiles_use_safe_file_names(profile, tmp_path, capsys):
+    add_profiles(profile, "../up", "web app")
+    out_dir = tmp_path / "out"
+    assert run(capsys, "T", "../up", "web app", "-o", str(out_dir), "--format", "ndjson") == (0, "")
+    assert sorted(path.name for path in out_dir.iterdir()) == [".._up.ndjson", "T.ndjson", "web_app.ndjson"]
+    assert not (tmp_path / "up.ndjson").exists()
+
+def test_clashing_file_names_are_rejected(profile, tmp_path, capsys):
+    add_profiles(profile, "a/b", "a_b")
+    assert run(capsys, "a/b", "a_b", "-o", str(tmp_path / "out"))[0] == 2
+    assert not (tmp_path / "out").exists()
+
+def test_manifest_honours_output(profile, tmp_path, capsys):
+    code, out = run(capsys, "T", "--manifest")
+    assert code == 0
+    manifest = json.loads(out)
+    assert len(manifest["files"]) == 10
+
+    out_file = tmp_path / "manifest.json"
+    assert run(capsys, "T", "--manifest", "-o", str(out_file)) == (0, "")
+    assert json.loads(out_file.read_text(encoding="utf-8"))["files"] == manifest["files"]
+
+    add_profiles(profile, "web app")
+    out_dir = tmp_path / "manifests"
+    assert run(capsys, "--all", "--manifest", "-o", str(out_dir)) == (0, "")
+    assert sorted(path.name for path in out_dir.iterdir()) == ["T.manifest.json", "web_app.manifest.json"]
+
+def test_unknown_profile(profile, capsys):
+    assert run(capsys, "missing")[0] == 2
+    assert run(capsys)[0] == 2
@@ -0,0 +1,119 @@
+import json
+import os
+
+from collate import DeltaTracker, aggregate_files, iter_profile_entries
+
+# -----------------------
+# TRACKER
+# -----------------------
+def make_entry(path):
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    return {"filename": os.path.basename(path), "language": "Python", "content": content, "full_path": str(path)}
+
+def run_delta(manifest_file, paths):
+    """One delta run over the given files: returns (emitted entries, the tracker)."""
+    tracker = DeltaTracker(str(manifest_file))
+    emitted = []
+    for path in paths:
+        changed = tracker.process(make_entry(path), os.stat(path))
+        if changed is not None:
+            emitted.append(changed)
+    emitted.extend(tracker.iter_deleted())
+    tracker.save()
+    return emitted, tracker
+
+def test_delta_tracker(tmp_path):
+    manifest_file = tmp_path / "cache" / "T.manifest.json"
+    a, b, c = tmp_path / "a.py", tmp_path / "b.py", tmp_path / "c.py"
+    a.write_text("a = 1\n")
+    b.write_text("b = 1\n")
+
+    emitted, tracker = run_delta(manifest_file, [a, b])
+    assert [(e["filename"], e["change"]) for e in emitted] == [("a.py", "added"), ("b.py", "added")]
+    assert emitted[0]["content"] == "a = 1\n"
+    assert tracker.summary() == {"added": 2, "modified": 0, "deleted": 0, "unchanged": 0}
+
+    emitted, tracker = run_delta(manifest_file, [a, b])
+    assert emitted == []
+    assert tracker.summary() == {"added": 0, "modified": 0, "deleted": 0, "unchanged": 2}
+
+    b.write_text("b = 22\n")
+    c.write_text("c = 1\n")
+    emitted, tracker = run_delta(manifest_file, [b, c])
+    assert [(e["filename"], e["change"]) for e in emitted] == [("b.py", "modified"), ("c.py", "added"),
+                                                              ("a.py", "deleted")]
+    assert emitted[2]["content"] == "[Deleted file: a.py]"
+    assert tracker.summary() == {"added": 1, "modified": 1, "deleted": 1, "unchanged": 0}
+
+def test_delta_tracker_content_and_stat_keys(tmp_path):
+    manifest_file = tmp_path / "T.manifest.json"
+    a = tmp_path / "a.py"
+    a.write_text("a = 1\n")
+    run_delta(manifest_file, [a])
+
+    # Rewritten with the same content: the hash is recomputed and still matches
+    st = os.stat(a)
+    a.write_text("a = 1\n")
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    emitted, _ = run_delta(manifest_file, [a])
+    assert emitted == []
+
+    # An unchanged (mtime, size) reuses the stored hash without reading the content again
+    tracker = DeltaTracker(str(manifest_file))
+    assert tracker.process({**make_entry(a), "content": "different"}, os.stat(a)) is None
+
+def test_delta_tracker_keep_unseen(tmp_path):
+    manifest_file = tmp_path / "T.manifest.json"
+    a, b = tmp_path / "a.py", tmp_path / "b.py"
+    a.write_text("a = 1\n")
+    b.write_text("b = 1\n")
+    run_delta(manifest_file, [a, b])
+
+    # A run cut short by its budget only saw a; b must not be reported deleted next time
+    tracker = DeltaTracker(str(manifest_file))
+    assert tracker.process(make_entry(a), os.stat(a)) is None
+    tracker.keep_unseen()
+    tracker.save()
+    emitted, tracker = run_delta(manifest_file, [a, b])
+    assert emitted == []
+    assert tracker.summary()["unchanged"] == 2
+
+def test_delta_tracker_ignores_corrupt_manifest(tmp_path):
+    manifest_file = tmp_path / "T.manifest.json"
+    manifest_file.write_text("{not json")
+    a = tmp_path / "a.py"
+    a.write_text("a = 1\n")
+    emitted, _ = run_delta(manifest_file, [a])
+    assert [e["change"] for e in emitted] == ["added"]
+
+# -----------------------
+# DELTA RUNS
+# -----------------------
+def delta_run(stats=None):
+    return sorted((os.path.basename(e["full_path"]), e["change"]) for e in iter_profile_entries("T", stats, delta=True))
+
+def test_delta_runs(profile):
+    assert len(delta_run()) == 10
+    stats = {}
+    assert delta_run(stats) == []
+    assert stats["delta"]["unchanged"] == 10
+
+    (profile / "util.py").write_text("def helper(x):\n    return x\n")
+    (profile / "main.py").unlink()
+    (profile / "new.py").write_text("x = 1\n")
+    assert delta_run() == [("main.py", "deleted"), ("new.py", "added"), ("util.py", "modified")]
+
+def test_full_runs_leave_the_delta_manifest_alone(profile):
+    delta_run()
+    (profile / "new.py").write_text("x = 1\n")
+    aggregate_files("T")
+    assert delta_run() == [("new.py", "added")]
+
+def test_generate_delta(client, profile):
+    client.post("/generate", json={"profile": "T", "delta": True})
+    (profile / "new.py").write_text("x = 1\n")
+    response = client.post("/generate", json={"profile": "T", "delta": True})
+    entries = json.loads(response.json["aggregated"].split("\n", 1)[1])
+    assert [(e["filename"], e["change"]) for e in entries] == [("new.py", "added")]
+    assert response.json["delta"]["unchanged"] == 10
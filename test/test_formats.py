@@ -0,0 +1,42 @@
+import json
+
+from collate import aggregate_files, iter_profile_entries
+from conftest import TREE_FILES
+
+HEADER = "Current code below:\n"
+
+def test_json_output_matches_json_dumps(profile):
+    entries = list(iter_profile_entries("T", workers=1))
+    assert len(entries) == 10
+    assert aggregate_files("T", workers=1) == HEADER + json.dumps(entries, indent=2)
+
+def test_empty_profile_json_output(profile):
+    for path in profile.rglob("*"):
+        if path.is_file():
+            path.unlink()
+    assert aggregate_files("T") == HEADER + json.dumps([], indent=2)
+
+def test_compact_and_ndjson_hold_the_same_entries(profile):
+    entries = list(iter_profile_entries("T", workers=1))
+    compact = aggregate_files("T", output_format="compact")
+    assert compact.startswith(HEADER)
+    assert json.loads(compact[len(HEADER):]) == entries
+    assert "\n" not in compact[len(HEADER):]
+    ndjson = aggregate_files("T", output_format="ndjson")
+    assert [json.loads(line) for line in ndjson.splitlines()] == entries
+
+def test_text_output_has_raw_contents(profile):
+    text = aggregate_files("T", output_format="text")
+    assert text.startswith(HEADER)
+    assert f"===== {profile / 'util.py'} (Python) =====" in text
+    # No escaping: backslashes, quotes and non-ASCII come through as they are
+    assert TREE_FILES["util.py"] in text
+    assert TREE_FILES["notes.md"] in text
+
+def test_generate_format_field(client, tmp_path):
+    response = client.post("/generate", json={"profile": "T", "format": "ndjson"})
+    assert response.status_code == 200
+    lines = response.json["aggregated"].splitlines()
+    assert len(lines) == 10
+    assert (tmp_path / "aggregated_files.ndjson").read_text(encoding="utf-8") == response.json["aggregated"]
+    assert client.post("/generate", json={"profile": "T", "format": "xml"}).status_code == 400
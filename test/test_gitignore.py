@@ -0,0 +1,77 @@
+import re
+
+import pytest
+
+from collate import aggregate_files, get_profile_store, translate_gitignore_pattern
+
+# -----------------------
+# PATTERNS
+# -----------------------
+@pytest.mark.parametrize("line", ["", "\n", "   ", "# comment", "/", "!"])
+def test_gitignore_blank_and_comment_lines(line):
+    assert translate_gitignore_pattern(line) is None
+
+@pytest.mark.parametrize("line, matching, not_matching", [
+    ("*.log", ["a.log", "dir/sub/a.log"], ["a.log.txt", "alog"]),
+    ("/build", ["build"], ["src/build"]),
+    ("build", ["build", "src/build"], ["builds"]),
+    ("doc/*.txt", ["doc/a.txt"], ["doc/sub/a.txt", "x/doc/a.txt"]),
+    ("**/foo", ["foo", "a/b/foo"], ["foobar"]),
+    ("a/**/b", ["a/b", "a/x/y/b"], ["b", "a/bb"]),
+    ("abc/**", ["abc/x", "abc/x/y"], ["abc"]),
+    ("file?.py", ["file1.py"], ["file10.py", "file/.py"]),
+    ("[!a]x", ["bx"], ["ax"]),
+    ("[a-c]x", ["ax", "cx"], ["dx"]),
+    ("\\#hash", ["#hash"], ["hash"]),
+    ("trailing   ", ["trailing"], ["trailing   "]),
+    ("escaped\\ ", ["escaped "], ["escaped"]),
+    ("name.py\r\n", ["name.py"], ["namexpy"]),
+])
+def test_gitignore_pattern_matching(line, matching, not_matching):
+    pattern, negated, directories_only = translate_gitignore_pattern(line)
+    assert not negated and not directories_only
+    for path in matching:
+        assert re.match(pattern, path), path
+    for path in not_matching:
+        assert not re.match(pattern, path), path
+
+def test_gitignore_negation_and_directories():
+    pattern, negated, directories_only = translate_gitignore_pattern("!keep.log")
+    assert negated and not directories_only
+    assert re.match(pattern, "logs/keep.log")
+
+    pattern, negated, directories_only = translate_gitignore_pattern("logs/")
+    assert directories_only and not negated
+    assert re.match(pattern, "logs") and re.match(pattern, "a/logs")
+
+    pattern, negated, _ = translate_gitignore_pattern("\\!important")
+    assert not negated
+    assert re.match(pattern, "!important")
+
+# -----------------------
+# WALKING
+# -----------------------
+def use_gitignore(profile, rules):
+    (profile / ".gitignore").write_text(rules)
+    with get_profile_store().transaction() as profiles:
+        profiles["T"]["gitignore"] = True
+
+def test_gitignore_applied_to_the_walk(profile):
+    (profile / "pkg" / "deep" / ".gitignore").write_text("copy.py\n")
+    use_gitignore(profile, "*.md\n/crlf.txt\nmodels.py\n!pkg/models.py\n")
+    output = aggregate_files("T")
+    for name in ("notes.md", "crlf.txt", "copy.py"):
+        assert name not in output
+    assert str(profile / "pkg" / "models.py") in output
+    assert str(profile / "pkg" / "deep" / "data.json") in output
+
+def test_gitignored_directories_are_not_entered(profile):
+    use_gitignore(profile, "deep/\n")
+    stats = {}
+    output = aggregate_files("T", stats)
+    assert "data.json" not in output
+    assert stats["metrics"]["counts"]["dirs_excluded"] == 1
+
+def test_gitignore_off_by_default(profile):
+    (profile / ".gitignore").write_text("*.md\n")
+    assert "notes.md" in aggregate_files("T")
@@ -0,0 +1,38 @@
+import json
+
+import jobs
+
+def wait_for(client, job_id):
+    """Follow a job's event stream until it finishes; returns the progress events."""
+    body = client.get(f"/jobs/{job_id}/events").get_data(as_text=True)
+    return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+
+def test_async_generate_matches_sync(client, tmp_path):
+    expected = client.post("/generate", json={"profile": "T"}).json["aggregated"]
+    response = client.post("/generate", json={"profile": "T", "async": True})
+    assert response.status_code == 202
+    job_id = response.json["job_id"]
+
+    events = wait_for(client, job_id)
+    assert events[-1]["status"] == "done"
+    assert events[-1]["files_scanned"] == 10
+    status = client.get(f"/jobs/{job_id}").json
+    assert status["success"] and status["status"] == "done"
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.json["aggregated"] == expected
+    assert (tmp_path / "aggregated_files.json").read_text(encoding="utf-8") == expected
+
+def test_failed_job_result(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("disk on fire")
+    monkeypatch.setattr(jobs, "iter_profile_chunks", fail)
+    job_id = client.post("/generate", json={"profile": "T", "async": True}).json["job_id"]
+    assert wait_for(client, job_id)[-1]["status"] == "failed"
+    response = client.get(f"/jobs/{job_id}/result")
+    assert response.status_code == 500
+    assert "disk on fire" in response.json["message"]
+
+def test_unknown_job(client):
+    for url in ("/jobs/nope", "/jobs/nope/events", "/jobs/nope/result"):
+        assert client.get(url).status_code == 404
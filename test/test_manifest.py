@@ -0,0 +1,25 @@
+from collate import ReadBudget, aggregate_files, build_manifest
+
+def test_manifest_lists_what_generate_reads(profile):
+    manifest = build_manifest("T")
+    stats = {}
+    aggregate_files("T", stats)
+    assert [item["path"] for item in manifest["files"]] == list(stats["tokens"]["files"])
+    assert manifest["total_files"] == 10
+    assert manifest["languages"]["Binary"] == {"files": 1, "bytes": 0, "tokens": 0}
+    assert manifest["total_bytes"] == sum(item["bytes"] for item in manifest["files"])
+
+def test_manifest_applies_the_budget_and_records_pruned_directories(profile, client):
+    client.post("/add_exclusion", json={"profile": "T", "pattern": "/deep/"})
+    manifest = build_manifest("T", ReadBudget(max_file_bytes=20))
+    assert not any("deep" in item["path"] for item in manifest["files"])
+    assert manifest["pruned"] == {"/deep/": [str(profile / "pkg" / "deep")]}
+    models = next(item for item in manifest["files"] if item["path"].endswith("models.py"))
+    assert models["bytes"] == 20 and models["truncated"]
+
+def test_manifest_route(client):
+    response = client.get("/manifest?profile=T")
+    assert response.status_code == 200
+    assert response.json["success"] and response.json["total_files"] == 10
+    assert client.get("/manifest").status_code == 400
+    assert client.get("/manifest?profile=missing").status_code == 404
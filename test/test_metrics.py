@@ -0,0 +1,40 @@
+import pytest
+
+import app as web_app
+from collate import METRIC_COUNTS, METRIC_PHASES, aggregate_files
+
+@pytest.fixture
+def no_runs(monkeypatch):
+    monkeypatch.setattr(web_app, "_last_run_stats", {})
+    monkeypatch.setattr(web_app, "_run_counts", {})
+
+def test_pipeline_metrics(profile):
+    stats = {}
+    aggregate_files("T", stats)
+    metrics = stats["metrics"]
+    assert set(metrics["seconds"]) == set(METRIC_PHASES)
+    assert metrics["counts"]["files"] == 10
+    assert metrics["counts"]["files_read"] + stats["cache"]["hits"] == 9
+    assert metrics["counts"]["dirs_visited"] == 3
+    assert metrics["bytes"]["read"] > 0
+    # Nothing is written out when the output is returned as a string
+    assert metrics["bytes"]["written"] == 0
+
+def test_metrics_route(client, no_runs):
+    assert client.get("/metrics").get_data(as_text=True).count("collate_generate_runs_total{") == 0
+    client.post("/generate", json={"profile": "T"})
+    client.post("/generate", json={"profile": "T"})
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    assert 'collate_generate_runs_total{profile="T"} 2' in lines
+    assert sum(line.startswith("collate_last_run_phase_seconds{") for line in lines) == len(METRIC_PHASES)
+    assert 'collate_last_run_count{profile="T",counter="files"} 10' in lines
+    assert sum(line.startswith("collate_last_run_count{") for line in lines) == len(METRIC_COUNTS)
+
+def test_generate_stats_route(client, no_runs):
+    assert client.get("/generate_stats?profile=T").status_code == 404
+    client.post("/generate", json={"profile": "T"})
+    stats = client.get("/generate_stats?profile=T").json
+    assert stats["success"] and stats["metrics"]["counts"]["files"] == 10
+    assert client.get("/generate_stats").status_code == 400
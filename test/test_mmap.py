@@ -0,0 +1,31 @@
+import pytest
+
+import collate
+from collate import ReadBudget, aggregate_files
+
+# Longer than one MMAP_CHUNK_BYTES chunk, with multi-byte characters across the chunk boundaries
+BIG_TEXT = "é✓ \"line\"\t\\ 日本\n" * 60000
+
+def run_both(profile, fresh_caches, tmp_path, monkeypatch, **options):
+    """Aggregate the profile with big.txt read into memory, then memory-mapped; returns both outputs."""
+    (profile / "big.txt").write_bytes(BIG_TEXT.encode("utf-8"))
+    fresh_caches(tmp_path / "in-memory")
+    in_memory = aggregate_files("T", **options)
+
+    monkeypatch.setattr(collate, "MMAP_THRESHOLD_BYTES", 16)
+    fresh_caches(tmp_path / "mapped")
+    entry, _ = collate.load_file_entry(str(profile / "big.txt"))
+    assert isinstance(entry["content"], collate.MappedText)
+    return in_memory, aggregate_files("T", **options)
+
+@pytest.mark.parametrize("output_format", sorted(collate.OUTPUT_FORMATS))
+def test_mmap_streaming_matches_in_memory(profile, fresh_caches, tmp_path, monkeypatch, output_format):
+    in_memory, mapped = run_both(profile, fresh_caches, tmp_path, monkeypatch, output_format=output_format)
+    assert mapped == in_memory
+
+def test_mmap_truncated_matches_in_memory(profile, fresh_caches, tmp_path, monkeypatch):
+    # The cut lands inside a multi-byte character
+    in_memory, mapped = run_both(profile, fresh_caches, tmp_path, monkeypatch,
+                                 budget=ReadBudget(max_file_bytes=100001))
+    assert "[Truncated: big.txt" in in_memory
+    assert mapped == in_memory
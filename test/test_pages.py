@@ -0,0 +1,38 @@
+import app as web_app
+from collate import get_profile_store
+
+def add_paths(profile, count):
+    paths = [str(profile / f"file{i:03}.py") for i in range(count)]
+    with get_profile_store().transaction() as profiles:
+        profiles["T"]["paths"] += paths
+    return [str(profile)] + paths
+
+def test_get_paths_pages(client, profile):
+    paths = add_paths(profile, 24)
+    response = client.get("/get_paths?profile=T&offset=0&limit=10")
+    assert response.json["total"] == 25
+    assert response.json["next_offset"] == 10
+    assert response.json["paths"][0] == {"path": str(profile), "is_dir": True, "icon": "fas fa-folder",
+                                         "color": "#FFC107"}
+    seen = []
+    offset = 0
+    while offset is not None:
+        page = client.get(f"/get_paths?profile=T&offset={offset}&limit=10").json
+        seen += [item["path"] for item in page["paths"]]
+        offset = page["next_offset"]
+    assert seen == paths
+
+def test_page_arguments_are_checked(client, profile):
+    for query in ("offset=-1", "limit=0", "limit=ten"):
+        assert client.get(f"/get_paths?profile=T&{query}").status_code == 400
+        assert client.get(f"/get_exclusions?profile=T&{query}").status_code == 400
+    assert client.get("/get_paths").status_code == 400
+    # Without paging arguments, exclusions are listed in full
+    assert client.get("/get_exclusions?profile=T").json == {"success": True, "exclusions": ["/.git/"]}
+
+def test_index_renders_only_the_first_page(client, profile, monkeypatch):
+    monkeypatch.setattr(web_app, "INDEX_PAGE_SIZE", 5)
+    paths = add_paths(profile, 24)
+    page = client.get("/?profile=T").get_data(as_text=True)
+    assert paths[4] in page
+    assert paths[5] not in page
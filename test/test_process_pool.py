@@ -0,0 +1,37 @@
+import pytest
+
+from collate import aggregate_files, choose_processes, get_profile_store
+
+PROCESS_POOL_OPTIONS = [
+    {},
+    {"dedup": True},
+    {"rank": True, "query": "helper"},
+    {"search": "AgentBrain"},
+    {"output_format": "ndjson"},
+]
+
+@pytest.mark.parametrize("options", PROCESS_POOL_OPTIONS, ids=lambda options: ",".join(options) or "default")
+def test_process_pool_matches_threads(profile, options):
+    threads = aggregate_files("T", workers=2, **options)
+    assert aggregate_files("T", processes=2, **options) == threads
+
+def test_choose_processes(profile):
+    assert choose_processes("T") == 0
+    assert choose_processes("T", 2) == 2
+    with pytest.raises(ValueError):
+        choose_processes("T", 2, delta=True)
+    with pytest.raises(ValueError):
+        choose_processes("T", 2, measure_all=True)
+
+    # A profile's setting falls back to threads where processes can't be used
+    with get_profile_store().transaction() as profiles:
+        profiles["T"]["processes"] = 3
+    assert choose_processes("T") == 3
+    assert choose_processes("T", delta=True) == 0
+
+def test_generate_with_processes(client):
+    threads = client.post("/generate", json={"profile": "T"}).json["aggregated"]
+    assert client.post("/generate", json={"profile": "T", "processes": 2}).json["aggregated"] == threads
+    response = client.post("/generate", json={"profile": "T", "processes": 2, "delta": True})
+    assert response.status_code == 400
+    assert client.post("/generate", json={"profile": "T", "processes": "two"}).status_code == 400
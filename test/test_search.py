@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import collate
+from collate import aggregate_files, search_profile
+
+def test_prefix_search(profile):
+    assert search_profile("T", "AgentBrain") == [str(profile / "pkg" / "models.py")]
+    assert search_profile("T", "agentbraincontroller helper") == []
+    assert search_profile("T", "help") == [str(profile / "util.py")]
+
+def test_query_without_terms(profile):
+    with pytest.raises(ValueError):
+        search_profile("T", "a b")
+
+def test_search_sees_edits_since_indexing(profile):
+    assert search_profile("T", "AgentBrain") == [str(profile / "pkg" / "models.py")]
+    # A new file defines the class, an existing one starts using it
+    (profile / "brain.py").write_text("class AgentBrain:\n    pass\n")
+    with open(profile / "main.py", "a") as f:
+        f.write("AgentBrain()\n")
+    (profile / "pkg" / "models.py").unlink()
+
+    hits = [str(profile / "brain.py"), str(profile / "main.py")]
+    assert search_profile("T", "AgentBrain") == hits
+    stats = {}
+    output = aggregate_files("T", stats, search="AgentBrain")
+    assert stats["search"] == {"query": "AgentBrain", "hits": 2}
+    assert "brain.py" in output and "main.py" in output and "models.py" not in output
+
+def test_index_off_until_searched(profile):
+    stats = {}
+    aggregate_files("T", stats)
+    assert "search_index" not in stats
+    assert not os.path.exists(collate.search_index_file("T"))
+
+    search_profile("T", "helper")
+    stats = {}
+    aggregate_files("T", stats)
+    assert stats["search_index"]["files"] == 9
+    assert stats["search_index"]["reindexed"] == 0
+
+def test_unchanged_index_is_not_rewritten(profile):
+    search_profile("T", "helper")
+    mtime = os.stat(collate.search_index_file("T")).st_mtime_ns
+    search_profile("T", "helper")
+    aggregate_files("T")
+    assert os.stat(collate.search_index_file("T")).st_mtime_ns == mtime
+
+def test_search_route(client, profile):
+    response = client.get("/search?profile=T&q=AgentBrain")
+    assert response.status_code == 200
+    assert response.json["files"] == [str(profile / "pkg" / "models.py")]
+    assert response.json["total"] == 1
+
+    response = client.get("/search?profile=T&q=ab")
+    assert response.status_code == 400
+    assert not response.json["success"]
+    assert client.get("/search?profile=T").status_code == 400
+    assert client.get("/search?profile=missing&q=AgentBrain").status_code == 404
+
+def test_generate_rejects_query_without_terms(client):
+    response = client.post("/generate", json={"profile": "T", "search": "ab"})
+    assert response.status_code == 400
@@ -0,0 +1,30 @@
+import codecs
+
+from collate import read_text, sniff_encoding
+
+def test_sniff_text():
+    assert sniff_encoding(b"def f():\n\treturn 1\r\n\x1b[0m\x0c") == "utf-8"
+    assert sniff_encoding("café ✓".encode("utf-8")) == "utf-8"
+    assert sniff_encoding(b"") == "utf-8"
+
+def test_sniff_boms():
+    assert sniff_encoding(codecs.BOM_UTF8 + b"text") == "utf-8"
+    assert sniff_encoding(codecs.BOM_UTF16_LE + "text".encode("utf-16-le")) == "utf-16"
+
+def test_sniff_binary():
+    assert sniff_encoding(b"\x89PNG\r\n\x1a\n") is None
+    assert sniff_encoding(b"text\x00more") is None
+    assert sniff_encoding(b"\x80\x81" * 10 + b"abc") is None
+
+def test_sniff_control_byte_ratio():
+    # More than one control byte in ten (other than tab, newlines, form feed, backspace, escape) is binary
+    assert sniff_encoding(b"\x01" + b"a" * 9) == "utf-8"
+    assert sniff_encoding(b"\x01\x02" + b"a" * 9) is None
+    assert sniff_encoding(b"\t\n\r\x08\x0c\x1b" * 10) == "utf-8"
+
+def test_read_text(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"one\r\ntwo\rthree\n")
+    assert read_text(str(path)) == "one\ntwo\nthree\n"
+    path.write_bytes(b"\x01\x02\x03\x04")
+    assert read_text(str(path)) is None
@@ -0,0 +1,26 @@
+import gzip
+
+def test_streamed_body_matches_the_file_written(client, tmp_path):
+    response = client.post("/generate", json={"profile": "T", "stream": True})
+    assert response.status_code == 200
+    assert response.is_streamed
+    body = response.get_data(as_text=True)
+    assert body.startswith("Current code below:\n")
+    assert body == (tmp_path / "aggregated_files.json").read_text(encoding="utf-8")
+
+def test_streamed_body_matches_the_buffered_response(client):
+    buffered = client.post("/generate", json={"profile": "T"}).json["aggregated"]
+    streamed = client.post("/generate", json={"profile": "T", "stream": True}).get_data(as_text=True)
+    assert streamed == buffered
+
+def test_streamed_body_compressed_on_request(client, tmp_path):
+    response = client.post("/generate", json={"profile": "T", "stream": True}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == (tmp_path / "aggregated_files.json").read_bytes()
+
+def test_stream_records_the_run_once_finished(client):
+    response = client.post("/generate", json={"profile": "T", "stream": True})
+    response.get_data()
+    stats = client.get("/generate_stats?profile=T").json
+    assert stats["success"]
+    assert len(stats["tokens"]["files"]) == 10
@@ -0,0 +1,20 @@
+import pytest
+
+import collate
+from collate import aggregate_files
+
+@pytest.mark.parametrize("output_format", sorted(collate.OUTPUT_FORMATS))
+def test_threads_match_serial(profile, output_format):
+    serial = aggregate_files("T", workers=1, output_format=output_format)
+    assert aggregate_files("T", workers=4, output_format=output_format) == serial
+
+def test_threads_keep_walk_order_past_the_read_window(profile):
+    # Many more files than the workers * 4 reads kept in flight
+    for i in range(50):
+        (profile / "pkg" / f"mod{i:02}.py").write_text(f"value = {i}\n" * (50 - i))
+    assert aggregate_files("T", workers=2) == aggregate_files("T", workers=1)
+
+def test_generate_rejects_invalid_workers(client):
+    response = client.post("/generate", json={"profile": "T", "workers": "many"})
+    assert response.status_code == 400
+    assert not response.json["success"]
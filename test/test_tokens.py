@@ -0,0 +1,26 @@
+import collate
+from collate import aggregate_files, estimate_tokens_bpe, estimate_tokens_chars
+
+def test_estimate_tokens_chars():
+    assert estimate_tokens_chars("") == 0
+    assert estimate_tokens_chars("abcd") == 1
+    assert estimate_tokens_chars("abcde") == 2
+
+def test_estimate_tokens_bpe():
+    assert estimate_tokens_bpe("") == 0
+    # Indentation is one token, long words one per 4 characters
+    assert estimate_tokens_bpe("        return") == 3
+    # "it", "'s", " 123", "45"
+    assert estimate_tokens_bpe("it's 12345") == 4
+
+def test_token_stats(profile):
+    stats = {}
+    aggregate_files("T", stats)
+    tokens = stats["tokens"]
+    assert tokens["tokenizer"] == collate.DEFAULT_TOKENIZER == "chars"
+    assert tokens["files"][str(profile / "main.py")] == estimate_tokens_chars((profile / "main.py").read_text())
+    assert tokens["total"] == sum(tokens["files"].values())
+
+    stats = {}
+    aggregate_files("T", stats, tokenizer="bpe")
+    assert stats["tokens"]["files"][str(profile / "main.py")] == estimate_tokens_bpe((profile / "main.py").read_text())
@@ -0,0 +1,83 @@
+import os
+
+import app as web_app
+import collate
+
+def record_notifications(monkeypatch):
+    """Record the paths and exclusions a profile has when its watcher is notified of a change."""
+    seen = []
+
+    def notify(profile):
+        seen.append((collate.get_profile_paths(profile), collate.get_profile_exclusions(profile)))
+    monkeypatch.setattr(web_app, "notify_profile_changed", notify)
+    return seen
+
+def test_profile_edits_notify_after_saving(client, profile, tmp_path, monkeypatch):
+    seen = record_notifications(monkeypatch)
+    other = str(tmp_path / "other")
+
+    client.post("/add_path", data={"profile": "T", "file_path": other})
+    assert seen[-1][0] == [str(profile), other]
+    client.post("/remove_path", json={"profile": "T", "path": other})
+    assert seen[-1][0] == [str(profile)]
+    client.post("/add_exclusion", json={"profile": "T", "pattern": "/pkg/"})
+    assert seen[-1][1] == ["/.git/", "/pkg/"]
+    client.post("/remove_exclusion", json={"profile": "T", "pattern": "/pkg/"})
+    assert seen[-1][1] == ["/.git/"]
+    assert len(seen) == 4
+
+    # Nothing changed, so no notification
+    assert client.post("/remove_path", json={"profile": "T", "path": other}).status_code == 404
+    assert client.post("/remove_exclusion", json={"profile": "T", "pattern": "/pkg/"}).status_code == 404
+    client.post("/add_exclusion", json={"profile": "T", "pattern": "/.git/"})
+    assert len(seen) == 4
+
+def test_exclusion_changes_apply_to_the_next_run(client, profile):
+    assert "models.py" in collate.aggregate_files("T")
+    client.post("/add_exclusion", json={"profile": "T", "pattern": "/pkg/"})
+    assert "models.py" not in collate.aggregate_files("T")
+    client.post("/remove_exclusion", json={"profile": "T", "pattern": "/pkg/"})
+    assert "models.py" in collate.aggregate_files("T")
+
+def test_snapshot_is_stale_once_a_file_is_added(profile):
+    deep = profile / "pkg" / "deep"
+    # An old mtime, so the new file's creation is seen even within the clock's granularity
+    os.utime(deep, ns=(0, 0))
+    watcher = collate.ProfileWatcher("T")
+    watcher.rescan()
+    snapshot = watcher.get_snapshot(0)
+    assert snapshot is not None and watcher.get_snapshot(0) is snapshot
+
+    (deep / "new.py").write_text("x = 1\n")
+    assert watcher.get_snapshot(0) is None
+    assert watcher._full_rescan
+    watcher.rescan()
+    assert str(deep / "new.py") in [entry["full_path"] for entry in watcher.get_snapshot(0).entries]
+
+def test_rescans_without_changes_keep_the_search_index(profile):
+    collate.search_profile("T", "helper")
+    watcher = collate.ProfileWatcher("T")
+    watcher.rescan()
+    mtime = os.stat(collate.search_index_file("T")).st_mtime_ns
+    watcher.rescan()
+    watcher.rescan()
+    assert os.stat(collate.search_index_file("T")).st_mtime_ns == mtime
+
+def test_watch_route_serves_current_snapshots(client, profile):
+    assert client.get("/watch?profile=T").json == {"success": True, "watching": False}
+    # An old mtime, so the file added below is seen even within the clock's granularity
+    os.utime(profile, ns=(0, 0))
+    response = client.post("/watch", json={"profile": "T", "enabled": True})
+    try:
+        assert response.json["watching"]
+        first = client.post("/generate", json={"profile": "T"}).json
+        assert "snapshot" in first
+        assert first["aggregated"] == collate.aggregate_files("T")
+
+        # Never served without a file added since the snapshot was built
+        (profile / "new.py").write_text("x = 1\n")
+        assert str(profile / "new.py") in client.post("/generate", json={"profile": "T"}).json["aggregated"]
+    finally:
+        client.post("/watch", json={"profile": "T", "enabled": False})
+    assert not client.get("/watch?profile=T").json["watching"]
+    assert client.post("/watch", json={"profile": "missing", "enabled": True}).status_code == 404